@@ -0,0 +1,81 @@
+""" Benchmark of the textile conversion engines
+
+Converts a shared corpus (the textile samples of the tests, and issue-like
+texts made of them) with every engine, and reports each engine's throughput
+and how many of its conversions differ from the pandoc engine's.
+
+    python benchmarks/bench_engines.py [--texts 400] [--show-differences]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from redmine_gitlab_migrator.engines import ENGINES, make_engine  # noqa: E402
+from redmine_gitlab_migrator import textile  # noqa: E402,F401
+from redmine_gitlab_migrator.tests.fake import (  # noqa: E402
+    PLAIN_TEXT_SAMPLES, TEXTILE_SAMPLES)
+from redmine_gitlab_migrator.wiki import TextileConverter  # noqa: E402
+
+
+def corpus(size):
+    """ Distinct texts, so that no conversion is served by a cache
+    """
+    samples = TEXTILE_SAMPLES + PLAIN_TEXT_SAMPLES
+    texts = []
+    for i in range(size):
+        sample = samples[i % len(samples)]
+        # A few samples glued together, as in an issue description
+        description = '\n\n'.join(
+            samples[(i + j * 7) % len(samples)] for j in range(i % 4))
+        texts.append('{}\n\nh3. Issue {}\n\n{}'.format(sample, i, description)
+                     if description else '{} {}'.format(sample, i))
+    return texts
+
+
+def run(engine, texts, batches):
+    converter = TextileConverter(engine=engine, memory_cache_size=0)
+    start = time.perf_counter()
+    if batches:
+        converted = []
+        for i in range(0, len(texts), 50):
+            converted.extend(converter.convert_many(texts[i:i + 50]))
+    else:
+        converted = [converter.convert(i) for i in texts]
+    return converted, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--texts', type=int, default=400)
+    parser.add_argument('--show-differences', action='store_true')
+    args = parser.parse_args()
+
+    texts = corpus(args.texts)
+    reference = None
+    print('{:<24} {:>10} {:>12} {:>12}'.format(
+        'engine', 'time (s)', 'texts/s', 'differences'))
+    for name in sorted(ENGINES):
+        engine = make_engine(name)
+        for batches in ((False, True) if engine.batches else (False,)):
+            converted, elapsed = run(engine, texts, batches)
+            if reference is None:
+                reference = converted
+            differences = [
+                (text, expected, actual) for text, expected, actual
+                in zip(texts, reference, converted) if expected != actual]
+            print('{:<24} {:>10.2f} {:>12.0f} {:>12}'.format(
+                name + (' (batches)' if batches else ''), elapsed,
+                len(texts) / elapsed, len(differences)))
+            if args.show_differences:
+                for text, expected, actual in differences:
+                    print('  {!r}\n    pandoc: {!r}\n    {}: {!r}'.format(
+                        text, expected, name, actual))
+        engine.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+""" Benchmark of TextileConverter.postprocess() on long wiki pages
+
+Compares the single-scan postprocess() with the former implementation (one
+re.sub() per rewrite, str.replace() loops for code highlight), on pages of
+growing size: "prose" pages, close to real wiki pages, and "dense" ones, made
+of nothing but rewrites. Both scale linearly with the page size; on dense
+pages the single scan pays for a python call per rewrite, where the former
+passes used re.sub() templates.
+
+    python benchmarks/bench_postprocess.py
+"""
+
+import re
+import sys
+import timeit
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from redmine_gitlab_migrator.wiki import TextileConverter  # noqa: E402
+
+# pandoc output for a section of a wiki page, as written in redmine: mostly
+# prose, with a bit of everything postprocess() rewrites
+PROSE = (
+    "The migration keeps the history of the issues, their notes and their "
+    "attachments. Users are matched by login, and the issues they created are "
+    "created on their behalf when the token allows it. "
+)
+SECTION = (
+    "## Section {0}\n\n"
+    + PROSE * 3 + "See \\[\\[Page {0}|page {0}\\]\\].\n\n"
+    + PROSE * 2 + "{{{{tip(hint {0})}}}}\n\n"
+    "&gt; quote {0}\n\n"
+    + PROSE * 3 + "\n\n"
+    "1.  item\n    \\#\\* nested {0}\n\n"
+    '<code class="python">\nprint({0})\n</code>\n\n'
+)
+# Only rewrites, the worst case for the single scan
+DENSE_SECTION = (
+    "\\[\\[Page {0}\\]\\] {{{{macro{0}}}}} &gt; quote\n"
+    "    \\#\\* nested {0}\n"
+)
+
+REGEX_WIKI_LINK_WITH_TEXT = re.compile(r'\\\[\\\[\s*([^\]]*?)\s*\|\s*([^\]]*?)\s*\\\]\\\]')
+REGEX_WIKI_LINK_WITHOUT_TEXT = re.compile(r'\\\[\\\[\s*([^\]]*?)\s*\\\]\\\]')
+
+
+def former_postprocess(converter, text):
+    """ postprocess() before the single scan (without its 24 rewrites cap)
+    """
+    def wiki_link(match):
+        text = match.group(2) if len(match.groups()) > 1 else match.group(1)
+        return converter.wiki_link(match.group(1), text)
+
+    text = REGEX_WIKI_LINK_WITH_TEXT.sub(wiki_link, text)
+    text = REGEX_WIKI_LINK_WITHOUT_TEXT.sub(wiki_link, text)
+    text = text.replace("    \\#\\*", "    -")
+    text = text.replace("    \\*\\#", "    1.")
+    text = text.replace("&gt; ", ">")
+    text = re.sub(r'\{\{tip\((.*?)\)\}\}', r'---\n**TIP**: \1\n---\n', text)
+    text = re.sub(r'\{\{note\((.*?)\)\}\}', r'---\n**NOTE**: \1\n---\n', text)
+    text = re.sub(r'\{\{warning\((.*?)\)\}\}', r'---\n**WARNING**: \1\n---\n', text)
+    text = re.sub(r'\{\{important\((.*?)\)\}\}', r'---\n**IMPORTANT**: \1\n---\n', text)
+    text = re.sub(r'\{\{(.*)\}\}', r'\1', text)
+    text = converter.regexAttachment.sub(
+        r"\n\n*(Merged from Redmine, please check first note for attachment named **\1**)*", text)
+    for match in converter.regexCodeHighlight.findall(text):
+        text = text.replace(match[0], "\n```{}".format(match[2].lower()))
+        text = text.replace(match[3], "\n```")
+    return text
+
+
+def main():
+    converter = TextileConverter()
+    print('{:>6} {:>9} {:>12} {:>12} {:>8}'.format(
+        'page', 'sections', 'former (ms)', 'scan (ms)', 'speedup'))
+    for name, section in (('prose', SECTION), ('dense', DENSE_SECTION)):
+        for sections in (10, 100, 1000, 5000):
+            page = ''.join(section.format(i) for i in range(sections))
+            runs = max(1, 2000 // sections)
+            former = timeit.timeit(
+                lambda: former_postprocess(converter, page), number=runs) / runs
+            scan = timeit.timeit(
+                lambda: converter.postprocess(page), number=runs) / runs
+            print('{:>6} {:>9} {:>12.2f} {:>12.2f} {:>7.1f}x'.format(
+                name, sections, former * 1000, scan * 1000, former / scan))
+
+
+if __name__ == '__main__':
+    main()
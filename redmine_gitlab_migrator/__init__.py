@@ -1,20 +1,47 @@
 import logging
 
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+import requests.adapters
 
 # http://stackoverflow.com/a/28002687/98491
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+from .retry import RetryPolicy
+
 log = logging.getLogger(__name__)
 
 
 class APIClient:
-    def __init__(self, api_key, verify):
+    # Connections kept alive per host. Should be at least the number of
+    # threads issuing requests concurrently through the same client.
+    DEFAULT_POOL_SIZE = 10
+
+    def __init__(self, api_key, verify, pool_size=DEFAULT_POOL_SIZE,
+                 retry_policy=None, rate_limiter=None, page_workers=1):
+        """
+        :param page_workers: number of pages of a list fetched in parallel
+            once the total number of pages is known
+        """
         self.api_key = api_key
         self.verify = verify
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = rate_limiter
+        self.page_workers = page_workers
+
+        # One pooled session per client: connections are kept alive and
+        # reused across calls instead of paying a TCP+TLS handshake for each.
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.verify = verify
+        self.session.headers.update(self.get_auth_headers())
 
     def get_auth_headers(self):
         """ Method to be overloaded by child classes
@@ -23,59 +50,121 @@ class APIClient:
         """
         return {}
 
-    def add_auth_headers(self, kwargs):
-        _kwargs = kwargs.copy()
-        headers = kwargs.get('headers', {})
-        headers.update(self.get_auth_headers())
-        _kwargs['headers'] = headers
-        _kwargs['verify'] = self.verify
-        return _kwargs
+    def _send(self, method, url, **kwargs):
+        """ Sends a request, retrying transient errors
 
-    def _req(self, func, *args, **kwargs):
+        :return: the successful response
+        """
         log.debug('HTTP REQUEST {} {} {}'.format(
-            func, args, kwargs))
-        kwargs = self.add_auth_headers(kwargs)
+            method, url, kwargs))
+
+        # The body is read again by each attempt: rewind its files in between
+        streams = [(i, i.tell() if _seekable(i) else None)
+                   for i in _body_streams(kwargs)]
 
-        retries = 3
-        retry_wait = 5
-        for tri in range(1,retries+1):
+        attempt = 0
+        while True:
+            resp = None
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(method, url)
             try:
-                resp = func(*args, **kwargs)
+                resp = self.session.request(method, url, **kwargs)
                 resp.raise_for_status()
-            except requests.HTTPError as e:
-                try: 
-                    ret = resp.json()
-                except ValueError:
-                    ret = resp.text
-                log.debug('HTTP RESPONSE {}'.format(ret))
-                if retries == tri:
-                    raise e
-                else:
-                    log.exception("HTTPError retry in {} seconds".format(retry_wait))
-                    time.sleep(retry_wait)
-                    log.info("Retry {}".format(tri+1))
-                    continue
-            # Some endpoints (e.g. DELETE) legitimately return an empty body.
-            if resp.status_code == 204 or not resp.content:
-                return None
-            try:
-                return resp.json()
-            except ValueError:
-                raise Exception(
-                    f"Invalid JSON response: status={resp.status_code}, body={resp.text[:200]}"
-                )
-
-    def get(self, *args, **kwargs):
-        return self._req(requests.get, *args, **kwargs)
-
-    def post(self, *args, **kwargs):
-        return self._req(requests.post, *args, **kwargs)
-
-    def put(self, *args, **kwargs):
-        return self._req(requests.put, *args, **kwargs)
+            except requests.RequestException as e:
+                if resp is not None:
+                    try:
+                        ret = resp.json()
+                    except ValueError:
+                        ret = resp.text
+                    log.debug('HTTP RESPONSE {}'.format(ret))
+                if not self.retry_policy.should_retry(attempt, e, resp, method):
+                    raise
+                if any(position is None for stream, position in streams):
+                    log.warning('{} {} failed ({}), cannot retry: its body is '
+                                'not seekable'.format(method, url, e))
+                    raise
+                for stream, position in streams:
+                    stream.seek(position)
+                retry_wait = self.retry_policy.delay(attempt, resp)
+                attempt += 1
+                log.warning('{} {} failed ({}), retry {} in {:.1f} seconds'.format(
+                    method, url, e, attempt, retry_wait))
+                time.sleep(retry_wait)
+                continue
+            return resp
+
+    def _decode(self, resp):
+        # Some endpoints (e.g. DELETE) legitimately return an empty body.
+        if resp.status_code == 204 or not resp.content:
+            return None
+        try:
+            return resp.json()
+        except ValueError:
+            raise Exception(
+                f"Invalid JSON response: status={resp.status_code}, body={resp.text[:200]}"
+            )
+
+    def _req(self, method, url, **kwargs):
+        return self._decode(self._send(method, url, **kwargs))
+
+    def map_pages(self, fetch, pages):
+        """ Yields ``fetch(page)`` for every page, in order
+
+        Up to ``page_workers`` pages are requested concurrently, the next ones
+        are only requested as the previous results are consumed.
+        """
+        if self.page_workers <= 1:
+            for page in pages:
+                yield fetch(page)
+            return
 
-    def delete(self, *args, **kwargs):
-        return self._req(requests.delete, *args, **kwargs)
+        with ThreadPoolExecutor(max_workers=self.page_workers) as executor:
+            pending = deque()
+            try:
+                for page in pages:
+                    pending.append(executor.submit(fetch, page))
+                    if len(pending) >= self.page_workers:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    # Same signatures as the module-level requests.get/post/... helpers.
+
+    def get(self, url, params=None, **kwargs):
+        return self._req('GET', url, params=params, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self._req('POST', url, data=data, json=json, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self._req('PUT', url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self._req('DELETE', url, **kwargs)
+
+
+def _body_streams(kwargs):
+    """ Files the body of a request is read from
+    """
+    streams = []
+    if hasattr(kwargs.get('data'), 'read'):
+        streams.append(kwargs['data'])
+    files = kwargs.get('files') or []
+    if isinstance(files, dict):
+        files = files.items()
+    for name, value in files:
+        if isinstance(value, (tuple, list)):
+            value = value[1]
+        if hasattr(value, 'read'):
+            streams.append(value)
+    return streams
+
+
+def _seekable(stream):
+    return hasattr(stream, 'seekable') and stream.seekable()
 
 
 class Project:
@@ -0,0 +1,213 @@
+""" Transfer of attachments from redmine to gitlab, in bounded memory
+"""
+
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import tempfile
+import threading
+import uuid
+from urllib.request import urlopen
+
+from urllib3.fields import RequestField
+
+# Downloads are kept in memory up to that size, in a temporary file beyond
+SPOOL_MEMORY_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# Default bound of the size of the files transferred at once by an UploadPool
+MAX_TRANSFER_SIZE = 64 * 1024 * 1024
+
+
+def download(url, max_memory_size=SPOOL_MEMORY_SIZE, digest=None):
+    """ Downloads a file into a spool
+
+    :param digest: optional hashlib object, updated with the content
+    :return: a SpooledTemporaryFile, to close once used
+    :raises urllib.error.URLError: when the download fails
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=max_memory_size)
+    try:
+        with urlopen(url) as response:
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                if digest is not None:
+                    digest.update(chunk)
+                spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+class UploadCache:
+    """ Files already uploaded to a gitlab project, and their markdown
+
+    Entries are found by redmine attachment id, which spares the download,
+    or by content digest and filename (the filename is part of the
+    markdown), which spares the upload of a file attached several times.
+    Kept in memory, and in a DiskCache (if any) for the next runs.
+    """
+    def __init__(self, cache=None, gitlab_project=''):
+        """
+        :param gitlab_project: identifies the project the files are uploaded
+            to, uploads are only reused within it
+        """
+        self.cache = cache
+        self.namespace = 'uploads:{}'.format(gitlab_project)
+        self._memory = {}
+
+    @staticmethod
+    def attachment_key(attachment_id):
+        return 'attachment:{}'.format(attachment_id)
+
+    @staticmethod
+    def content_key(digest, filename):
+        return 'sha256:{} {}'.format(digest.hexdigest(), filename)
+
+    def get(self, key):
+        """ Returns the markdown of the upload, None if missing
+        """
+        if key in self._memory:
+            return self._memory[key]
+        if self.cache is not None:
+            markdown = self.cache.get(self.namespace, key)
+            if markdown is not None:
+                self._memory[key] = markdown
+            return markdown
+        return None
+
+    def set(self, key, markdown):
+        self._memory[key] = markdown
+        if self.cache is not None:
+            self.cache.set(self.namespace, key, markdown)
+
+
+class ByteLimit:
+    """ Bounds the total size of the files transferred at once
+
+    A file larger than the limit is transferred alone.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.used = 0
+        self._cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def reserve(self, size):
+        size = min(size, self.max_size)
+        with self._cond:
+            self._cond.wait_for(lambda: self.used + size <= self.max_size)
+            self.used += size
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.used -= size
+                self._cond.notify_all()
+
+
+class UploadPool:
+    """ Transfers attachments in a pool of threads, ahead of their issues
+
+    Each attachment is transferred on its own, as long as the files in
+    transfer (by their redmine filesize) stay within max_size.
+    """
+    def __init__(self, upload, workers=4, max_size=MAX_TRANSFER_SIZE):
+        """
+        :param upload: transfers an attachment (a convert_attachment() dict)
+            and returns its markdown, see GitlabProject.upload()
+        """
+        self.upload = upload
+        self.limit = ByteLimit(max_size)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(self, uploads):
+        """ :return: the futures of the uploads markdown, in order
+        """
+        return [self.executor.submit(self._transfer, u) for u in uploads]
+
+    def _transfer(self, u):
+        # Unknown sizes count as much as the memory kept by a spool
+        with self.limit.reserve(u.get('filesize') or SPOOL_MEMORY_SIZE):
+            return self.upload(u)
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+def lookahead(items, size, start):
+    """ Yields (item, start(item)), start() being called size items ahead
+    """
+    pending = deque()
+    for item in items:
+        pending.append((item, start(item)))
+        if len(pending) > size:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+
+class MultipartUpload(io.RawIOBase):
+    """ multipart/form-data body of a single file, read from its spool
+
+    Unlike requests' ``files=``, which builds the whole body in memory, the
+    file is read as the body is sent. The body is seekable, so a retried
+    request sends it again from the start.
+    """
+    def __init__(self, field, filename, fileobj, content_type):
+        boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={}'.format(boundary)
+
+        # Same part headers as requests' files=
+        part = RequestField(field, b'', filename=filename)
+        part.make_multipart(content_type=content_type)
+        head = '--{}\r\n{}'.format(boundary, part.render_headers())
+        tail = '\r\n--{}--\r\n'.format(boundary)
+
+        head = head.encode('utf-8')
+        tail = tail.encode('utf-8')
+        fileobj.seek(0, os.SEEK_END)
+        file_size = fileobj.tell()
+        # (file, offset in the body, size)
+        self._parts = [
+            (io.BytesIO(head), 0, len(head)),
+            (fileobj, len(head), file_size),
+            (io.BytesIO(tail), len(head) + file_size, len(tail)),
+        ]
+        self.len = len(head) + file_size + len(tail)
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self.len
+        self._position = max(0, min(offset, self.len))
+        return self._position
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        read = 0
+        for part, start, size in self._parts:
+            offset = self._position - start
+            if read == len(view):
+                break
+            if not 0 <= offset < size:
+                continue
+            part.seek(offset)
+            data = part.read(min(len(view) - read, size - offset))
+            view[read:read + len(data)] = data
+            read += len(data)
+            self._position += len(data)
+        return read
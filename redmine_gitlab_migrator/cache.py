@@ -0,0 +1,79 @@
+""" Local on-disk cache, kept between runs
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class DiskCache:
+    """ JSON-serializable values stored by namespace and key
+
+    Backed by a single SQLite file, so it can be shared by successive runs
+    (and projects) and used from several threads.
+    """
+    FILENAME = 'cache.sqlite'
+
+    def __init__(self, cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, self.FILENAME)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            # WAL lets several migrate-rg processes share the same cache
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                ' namespace TEXT NOT NULL,'
+                ' key TEXT NOT NULL,'
+                ' value TEXT NOT NULL,'
+                ' stored_at REAL NOT NULL,'
+                ' PRIMARY KEY (namespace, key))')
+
+    def __getstate__(self):
+        # Other processes open their own connection
+        return {'cache_dir': os.path.dirname(self.path)}
+
+    def __setstate__(self, state):
+        self.__init__(state['cache_dir'])
+
+    def get(self, namespace, key, max_age=None):
+        """ Returns the stored value, None if missing or older than max_age
+
+        :param max_age: maximum age of the entry in seconds, None for no limit
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, stored_at FROM entries'
+                ' WHERE namespace = ? AND key = ?',
+                (namespace, str(key))).fetchone()
+        if row is None:
+            return None
+        value, stored_at = row
+        if max_age is not None and time.time() - stored_at > max_age:
+            return None
+        return json.loads(value)
+
+    def set(self, namespace, key, value):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                (namespace, str(key), json.dumps(value), time.time()))
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM entries WHERE namespace = ? AND key = ?',
+                (namespace, str(key)))
+
+    def clear(self, namespace):
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM entries WHERE namespace = ?', (namespace,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
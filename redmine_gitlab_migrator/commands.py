@@ -1,15 +1,33 @@
 #!/bin/env python3
 import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import logging
+import os
 import re
 import sys
 
+from redmine_gitlab_migrator import APIClient
+from redmine_gitlab_migrator.attachments import (
+    MAX_TRANSFER_SIZE, UploadCache, UploadPool, lookahead)
+from redmine_gitlab_migrator.cache import DiskCache
+from redmine_gitlab_migrator.engines import ENGINES, make_engine
 from redmine_gitlab_migrator.redmine import RedmineProject, RedmineClient
-from redmine_gitlab_migrator.gitlab import GitlabProject, GitlabClient
-from redmine_gitlab_migrator.converters import convert_issue, convert_version, load_user_dict
+from redmine_gitlab_migrator.gitlab import (
+    CreationOrder, GitlabProject, GitlabClient, GitlabUserResolver)
+from redmine_gitlab_migrator.journal import MigrationJournal
+from redmine_gitlab_migrator.converters import (
+    convert_issue, convert_issues, convert_version, load_user_dict,
+    redmine_username_to_gitlab_username)
 from redmine_gitlab_migrator.logger import setup_module_logging
+from redmine_gitlab_migrator.ratelimit import RateLimiter
+from redmine_gitlab_migrator.retry import RetryPolicy
+from redmine_gitlab_migrator.snapshot import Snapshot, SnapshotProject
 from redmine_gitlab_migrator.wiki import TextileConverter, NopConverter, WikiPageConverter
 from redmine_gitlab_migrator import sql
+# Registers the "python" conversion engine
+from redmine_gitlab_migrator import textile  # noqa: F401
 
 
 """Migration commands for issues and roadmaps from redmine to gitlab
@@ -17,6 +35,8 @@ from redmine_gitlab_migrator import sql
 
 log = logging.getLogger(__name__)
 
+DEFAULT_CONCURRENCY = 4
+
 class CommandError(Exception):
     """ An error that will nicely pop up to user and stops program
     """
@@ -53,12 +73,34 @@ def parse_args():
         'delete-issues', help=perform_delete_issues.__doc__)
     delete_issues.set_defaults(func=perform_delete_issues)
 
-    for i in (parser_issues, parser_pages, parser_roadmap, parser_redirect):
+    parser_export = subparsers.add_parser(
+        'export', help=perform_export.__doc__)
+    parser_export.set_defaults(func=perform_export)
+
+    for i in (parser_issues, parser_pages, parser_roadmap, parser_redirect, parser_export):
         i.add_argument('redmine_project_url')
         i.add_argument(
             '--redmine-key',
             required=True,
             help="Redmine administrator API key")
+        i.add_argument(
+            '--redmine-rate',
+            required=False, type=float, default=None,
+            help="maximum number of requests per second sent to Redmine, "
+                 "unlimited by default")
+        i.add_argument(
+            '--user-cache-ttl',
+            required=False, type=float,
+            default=RedmineProject.USER_CACHE_TTL / 3600,
+            help="hours during which redmine users kept in --cache-dir are "
+                 "reused, default {:g}".format(
+                     RedmineProject.USER_CACHE_TTL / 3600))
+        i.add_argument(
+            '--concurrency',
+            required=False, type=int, default=DEFAULT_CONCURRENCY,
+            help="number of items fetched in parallel when they have to be "
+                 "requested one by one (Redmine issue details, GitLab "
+                 "users...), default {}".format(DEFAULT_CONCURRENCY))
 
     for i in (parser_issues, parser_roadmap, parser_iid, parser_redirect, delete_issues):
         i.add_argument('gitlab_project_url')
@@ -71,8 +113,25 @@ def parse_args():
             required=False, default=None,
             help="Base URL of the GitLab instance (e.g. https://host/gitlab) "
                  "when GitLab is not served at the root of the host")
+        i.add_argument(
+            '--gitlab-rate',
+            required=False, type=float, default=None,
+            help="maximum number of requests per second sent to GitLab, "
+                 "unlimited by default")
+        i.add_argument(
+            '--gitlab-write-rate',
+            required=False, type=float, default=None,
+            help="maximum number of write (POST/PUT/DELETE) requests per "
+                 "second sent to GitLab, on top of --gitlab-rate")
+
+    for i in (parser_issues, parser_pages, parser_roadmap, parser_redirect):
+        i.add_argument(
+            '--snapshot',
+            required=False, default=None,
+            help="read the redmine project from a snapshot written by the "
+                 "export command instead of querying redmine")
 
-    for i in (parser_issues, parser_pages, parser_roadmap, parser_iid, parser_redirect, delete_issues):
+    for i in (parser_issues, parser_pages, parser_roadmap, parser_iid, parser_redirect, delete_issues, parser_export):
         i.add_argument(
             '--check',
             required=False, action='store_true', default=False,
@@ -88,11 +147,61 @@ def parse_args():
             required=False, action='store_false', default=True,
             help="disable SSL certificate verification")
 
+        i.add_argument(
+            '--pool-size',
+            required=False, type=int, default=APIClient.DEFAULT_POOL_SIZE,
+            help="number of keep-alive HTTP connections kept per host, "
+                 "default {}".format(APIClient.DEFAULT_POOL_SIZE))
+
+        i.add_argument(
+            '--cache-dir',
+            required=False, default=None,
+            help="directory where data worth keeping between runs is "
+                 "cached (eg: redmine users), no disk cache by default")
+
+        i.add_argument(
+            '--page-workers',
+            required=False, type=int, default=1,
+            help="number of pages of a list fetched in parallel once the "
+                 "page count is known, default 1 (sequential)")
+
+        i.add_argument(
+            '--max-retries',
+            required=False, type=int, default=RetryPolicy.DEFAULT_MAX_RETRIES,
+            help="retries of a request failing with a transient error "
+                 "(429, 5xx, connection error), default {}".format(
+                     RetryPolicy.DEFAULT_MAX_RETRIES))
+
+        i.add_argument(
+            '--retry-backoff',
+            required=False, type=float, default=RetryPolicy.DEFAULT_BACKOFF,
+            help="base wait in seconds before a retry, doubled on each "
+                 "attempt (Retry-After is honored instead when sent), "
+                 "default {}".format(RetryPolicy.DEFAULT_BACKOFF))
+
+        i.add_argument(
+            '--retry-budget',
+            required=False, type=int, default=None,
+            help="maximum number of retries for the whole run, unlimited "
+                 "by default")
+
     for i in (parser_issues, parser_pages):
         i.add_argument(
             '--no-textile',
             required=False, action='store_true',
             help="Do not perform textile conversion, in case Markdown is used in Redmine")
+        i.add_argument(
+            '--converter-engine',
+            required=False, default='pandoc', choices=sorted(ENGINES),
+            help="how textile is converted: pandoc (a pandoc process per "
+                 "conversion, default), pandoc-server (long-lived `pandoc "
+                 "server` processes, pandoc >= 3.0) or python (in-process, "
+                 "no pandoc needed, covers the common textile)")
+        i.add_argument(
+            '--pandoc-workers',
+            required=False, type=int, default=2,
+            help="number of `pandoc server` processes of the pandoc-server "
+                 "engine, default 2")
 
     parser_issues.add_argument(
         '--closed-states',
@@ -130,6 +239,68 @@ def parse_args():
         required=False, action='store_true', default=False,
         help="migrate issues with same title, useful when no ssh is possible (e.g. gitlab.com) and don't need to keep id (faster)")
 
+    parser_issues.add_argument(
+        '--quick-actions',
+        required=False, action='store_true', default=False,
+        help="set the time tracking of new issues with quick actions in "
+             "their description, and close them with one in their last "
+             "note, rather than with separate requests")
+
+    parser_issues.add_argument(
+        '--graphql-notes',
+        required=False, type=int, default=0,
+        help="create the notes of an issue by GraphQL, that many per "
+             "request, rather than one REST request each; notes are then "
+             "dated of the migration (their redmine date stays in their "
+             "text), and impersonated ones (--sudo) still use REST")
+
+    parser_issues.add_argument(
+        '--incremental',
+        required=False, action='store_true', default=False,
+        help="only sync the issues updated in redmine since the previous "
+             "--incremental run (checkpoint kept in --cache-dir); issues "
+             "already in gitlab are updated, new ones created")
+
+    parser_issues.add_argument(
+        '--create-workers',
+        required=False, type=int, default=1,
+        help="number of issues created in parallel in gitlab, default 1; "
+             "with --keep-id or --keep-title the issues are still created "
+             "in redmine order")
+
+    parser_issues.add_argument(
+        '--upload-workers',
+        required=False, type=int, default=4,
+        help="number of attachments transferred at once from redmine to "
+             "gitlab, ahead of the creation of their issues, default 4; "
+             "0 transfers them when creating their issue")
+
+    parser_issues.add_argument(
+        '--upload-lookahead',
+        required=False, type=int, default=8,
+        help="number of issues to come whose attachments are transferred "
+             "ahead, default 8")
+
+    parser_issues.add_argument(
+        '--upload-max-mb',
+        required=False, type=int, default=MAX_TRANSFER_SIZE // 2 ** 20,
+        help="total size (in MiB) of the attachments transferred at once, "
+             "default %(default)s; a larger file is transferred alone")
+
+    parser_issues.add_argument(
+        '--convert-workers',
+        required=False, type=int, default=1,
+        help="number of processes converting issues to gitlab format "
+             "(textile conversion...) while others are being created, "
+             "default 1 (converted by the main process)")
+
+    parser_issues.add_argument(
+        '--resume',
+        required=False, action='store_true', default=False,
+        help="resume an interrupted migration: skip the issues and steps "
+             "(notes, uploads, time tracking...) the journal kept in "
+             "--cache-dir records as done")
+
     parser_issues.add_argument(
         '--initial-id',
         required=False,
@@ -147,6 +318,22 @@ def parse_args():
         default=None,
         help="if account doesn't exist in GitLab use this account as default")
 
+    parser_export.add_argument(
+        'snapshot_path',
+        help="file the snapshot is written to")
+
+    parser_export.add_argument(
+        '--no-wiki',
+        action='store_true',
+        default=False,
+        help="do not export wiki pages")
+
+    parser_export.add_argument(
+        '--no-history',
+        action='store_true',
+        default=False,
+        help="only export the latest version of wiki pages")
+
     parser_pages.add_argument(
         '--gitlab-wiki',
         required=True,
@@ -158,7 +345,65 @@ def parse_args():
         default=False,
         help="do not convert the history")
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.command:
+        # A single policy for the run, so the retry budget is shared by the
+        # Redmine and the GitLab clients.
+        args.retry_policy = RetryPolicy(
+            max_retries=args.max_retries, backoff=args.retry_backoff,
+            budget=args.retry_budget)
+    return args
+
+def make_redmine_client(args):
+    rate_limiter = None
+    if args.redmine_rate:
+        rate_limiter = RateLimiter(args.redmine_rate)
+    return RedmineClient(
+        args.redmine_key, args.no_verify, pool_size=args.pool_size,
+        retry_policy=args.retry_policy, rate_limiter=rate_limiter,
+        page_workers=args.page_workers)
+
+def make_gitlab_client(args):
+    rate_limiter = None
+    if args.gitlab_rate or args.gitlab_write_rate:
+        rate_limiter = RateLimiter(
+            args.gitlab_rate, write_rate=args.gitlab_write_rate)
+    return GitlabClient(
+        args.gitlab_key, args.no_verify, pool_size=args.pool_size,
+        retry_policy=args.retry_policy, rate_limiter=rate_limiter,
+        page_workers=args.page_workers)
+
+def make_cache(args):
+    if args.cache_dir:
+        return DiskCache(args.cache_dir)
+    return None
+
+def make_textile_converter(args, cache):
+    if args.no_textile:
+        return NopConverter()
+    options = {}
+    if args.converter_engine == 'pandoc-server':
+        options['workers'] = args.pandoc_workers
+    engine = make_engine(args.converter_engine, **options)
+    return TextileConverter(cache=cache, engine=engine)
+
+def make_redmine_project(args, redmine):
+    if getattr(args, 'snapshot', None):
+        if not os.path.exists(args.snapshot):
+            raise CommandError(
+                'Snapshot {} does not exist'.format(args.snapshot))
+        project = SnapshotProject(Snapshot(args.snapshot))
+        log.info('Reading {} from snapshot {}'.format(
+            project.public_url, args.snapshot))
+        if project.public_url != RedmineProject(
+                args.redmine_project_url, redmine).public_url:
+            log.warning('Snapshot {} was exported from {}, not {}'.format(
+                args.snapshot, project.public_url, args.redmine_project_url))
+        return project
+
+    return RedmineProject(
+        args.redmine_project_url, redmine, concurrency=args.concurrency,
+        cache=make_cache(args), user_cache_ttl=args.user_cache_ttl * 3600)
 
 def check(func, message, redmine_project, gitlab_project):
     log.info('{}...'.format(message))
@@ -172,16 +417,18 @@ def check(func, message, redmine_project, gitlab_project):
 def check_users(redmine_project, gitlab_project):
 
     redmine_users = redmine_project.get_participants()
-    gitlab_users = gitlab_project.get_instance().get_all_users()
+    gitlab_instance = gitlab_project.get_instance()
+    resolver = GitlabUserResolver(gitlab_instance)
 
     # Filter out anonymous user
     redmine_user_names = [i['login'] for i in redmine_users if i['login'] != '']
-    gitlab_user_names = set([i['username'] for i in gitlab_users])
+    gitlab_user_names = resolver.resolve(
+        redmine_username_to_gitlab_username(i) for i in redmine_user_names)
 
     log.info('Redmine users are: {}'.format(', '.join(redmine_user_names) + ' '))
     log.info('GitLab users are: {}'.format(', '.join(gitlab_user_names) + ' '))
 
-    return gitlab_project.get_instance().check_users_exist(redmine_user_names)
+    return gitlab_instance.check_users_exist(redmine_user_names, resolver)
 
 def check_no_issue(redmine_project, gitlab_project):
     return len(gitlab_project.get_issues()) == 0
@@ -196,13 +443,10 @@ def check_origin_milestone(redmine_project, gitlab_project):
     return len(redmine_project.get_versions()) > 0
 
 def perform_migrate_pages(args):
-    redmine = RedmineClient(args.redmine_key, args.no_verify)
-    redmine_project = RedmineProject(args.redmine_project_url, redmine)
+    redmine = make_redmine_client(args)
+    redmine_project = make_redmine_project(args, redmine)
 
-    if args.no_textile:
-        textile_converter = NopConverter()
-    else:
-        textile_converter = TextileConverter()
+    textile_converter = make_textile_converter(args, make_cache(args))
 
     # Get copy of GitLab wiki repository
     wiki = WikiPageConverter(args.gitlab_wiki, textile_converter)
@@ -237,72 +481,219 @@ def perform_migrate_issues(args):
     if (args.user_dict is not None):
         load_user_dict(args.user_dict)
 
-    redmine = RedmineClient(args.redmine_key, args.no_verify)
-    gitlab = GitlabClient(args.gitlab_key, args.no_verify)
+    redmine = make_redmine_client(args)
+    gitlab = make_gitlab_client(args)
 
-    redmine_project = RedmineProject(args.redmine_project_url, redmine)
+    redmine_project = make_redmine_project(args, redmine)
     gitlab_project = GitlabProject(args.gitlab_project_url, gitlab, base_url=args.gitlab_url)
+    gitlab_project.quick_actions = args.quick_actions
+    gitlab_project.graphql_notes = args.graphql_notes
+
+    cache = make_cache(args)
+    for option in ('incremental', 'resume'):
+        if getattr(args, option) and cache is None:
+            raise CommandError('--{} requires --cache-dir'.format(option))
+
+    # Every step of the issues creation is journaled, to be able to --resume
+    journal = None
+    if cache is not None and not args.check:
+        journal = MigrationJournal(
+            cache, redmine_project.public_url, gitlab_project.public_url)
+        if not args.resume:
+            journal.clear()
+
+        # Files uploaded by previous runs are reused, unless the project was
+        # recreated since (its id changed)
+        gitlab_project.upload_cache = UploadCache(cache, '{} {}'.format(
+            gitlab_project.public_url, gitlab_project.get_id()))
+
+    # Incremental sync: only the issues updated since the previous run
+    updated_since = None
+    if args.incremental:
+        checkpoint_key = '{} {}'.format(
+            redmine_project.public_url, gitlab_project.public_url)
+        updated_since = cache.get('checkpoints', checkpoint_key)
+        if updated_since:
+            log.info('Syncing issues updated since {}'.format(updated_since))
+        else:
+            log.info('No checkpoint yet, syncing every issue')
 
     gitlab_instance = gitlab_project.get_instance()
-    if (args.project_members_only):
-        gitlab_users_index = gitlab_project.get_members_index()
-    else:
-        gitlab_users_index = gitlab_instance.get_users_index()
-    redmine_users_index = redmine_project.get_users_index(args.issue_ids)
-    milestones_index = gitlab_project.get_milestones_index()
-    if args.no_textile:
-        textile_converter = NopConverter()
-    else:
-        textile_converter = TextileConverter()
-
-    log.debug('GitLab milestones are: {}'.format(', '.join(milestones_index) + ' '))
     if args.sudo:
         migrator_user = 'root'
     else:
         migrator_user = gitlab_instance.get_user()['username']
+
     # get issues
     log.info('Getting redmine issues')
-    issues = redmine_project.get_issues(args.issue_ids)
+    issues = redmine_project.get_issues(args.issue_ids, updated_since)
     if args.initial_id:
         issues = [issue for issue in issues if int(args.initial_id) <= issue['id']]
 
+    redmine_users_index = redmine_project.get_users_index(args.issue_ids)
+    if (args.project_members_only):
+        gitlab_users_index = gitlab_project.get_members_index()
+    else:
+        # Only look up the users taking part in the migrated issues
+        gitlab_user_names = [
+            redmine_username_to_gitlab_username(i['login'])
+            for i in redmine_users_index.values()]
+        gitlab_user_names.append(migrator_user)
+        if args.archive_acc:
+            gitlab_user_names.append(args.archive_acc)
+        resolver = GitlabUserResolver(
+            gitlab_instance, concurrency=args.concurrency)
+        gitlab_users_index = resolver.resolve(gitlab_user_names)
+    milestones_index = gitlab_project.get_milestones_index()
+    textile_converter = make_textile_converter(args, cache)
+
+    log.debug('GitLab milestones are: {}'.format(', '.join(milestones_index) + ' '))
+
+    migrated_issues_index = None
+    if args.incremental:
+        migrated_issues_index = gitlab_project.get_migrated_issues_index()
+
     # convert issues
     log.info('Converting issues')
-    issues_data = (
-        convert_issue(args.redmine_key,
-            i, redmine_users_index, gitlab_users_index, milestones_index, closed_states, custom_fields, textile_converter, migrator_user,
-            args.keep_id or args.keep_title, args.sudo, args.archive_acc)
-        for i in issues)
+    convert = partial(
+        convert_issue, redmine_api_key=args.redmine_key,
+        redmine_user_index=redmine_users_index,
+        gitlab_user_index=gitlab_users_index,
+        gitlab_milestones_index=milestones_index, closed_states=closed_states,
+        custom_fields_include=custom_fields,
+        textile_converter=textile_converter, migrator_user=migrator_user,
+        keep_title=args.keep_id or args.keep_title, sudo=args.sudo,
+        archive_acc=args.archive_acc)
+    issues_data = convert_issues(
+        issues, convert, workers=args.convert_workers)
 
     # create issues
     log.info('Creating gitlab issues')
-    last_iid = int(args.initial_id or 1) - 1
-    for data, meta, redmine_id in issues_data:
-        if args.check:
-            milestone_id = data.get('milestone_id', None)
-            if milestone_id:
-                try:
-                    gitlab_project.get_milestone_by_id(milestone_id)
-                except ValueError:
-                    raise CommandError(
-                        "issue \"{}\" points to unknown milestone_id \"{}\". "
-                        "Check that you already migrated roadmaps".format(
-                            data['title'], milestone_id))
-
-            log.info('Would create issue "{}" and {} notes.'.format(
-                data['title'],
-                len(meta['notes'])))
 
-        else:
-            if args.keep_id:
-                data['iid'] = redmine_id
-            try:
-                created = gitlab_project.create_issue(data, meta, gitlab.get_auth_headers())
-                last_iid = created['iid']
-                log.info('#{iid} {title}'.format(**created))
-            except Exception:
-                log.info('create issue "{}" failed'.format(data['title']))
-                raise
+    # Several issues are created at once; when their iid matters, they still
+    # send their issue POST in redmine order.
+    creation_order = None
+    if args.keep_id or args.keep_title:
+        creation_order = CreationOrder()
+    executor = ThreadPoolExecutor(max_workers=args.create_workers)
+    pending = deque()
+
+    # Attachments of the next issues are transferred while the current ones
+    # are created
+    upload_pool = None
+    if args.upload_workers > 0 and not args.check:
+        upload_pool = UploadPool(
+            gitlab_project.upload, workers=args.upload_workers,
+            max_size=args.upload_max_mb * 2 ** 20)
+
+    def prefetch_uploads(item):
+        data, meta, redmine_id = item
+        if upload_pool is None or not meta['uploads']:
+            return None
+        if args.incremental and redmine_id in migrated_issues_index:
+            # Updated issues only upload the attachments they lack
+            return None
+        if journal is not None and 'uploads' in journal.get(redmine_id):
+            return None
+        return upload_pool.submit(meta['uploads'])
+
+    def create_issue(data, meta, progress, turn, uploads):
+        try:
+            return gitlab_project.create_issue(
+                data, meta, gitlab.get_auth_headers(), progress, turn, uploads)
+        except Exception:
+            log.info('create issue "{}" failed'.format(data['title']))
+            raise
+
+    def report(future, message):
+        log.info(message.format(**future.result()))
+
+    def update_issue(migrated, data, meta):
+        try:
+            return gitlab_project.update_issue(
+                migrated, data, meta, gitlab.get_auth_headers())
+        except Exception:
+            log.info('update issue "{}" failed'.format(data['title']))
+            raise
+
+    try:
+        for (data, meta, redmine_id), uploads in lookahead(
+                issues_data, args.upload_lookahead, prefetch_uploads):
+            migrated = None
+            if args.incremental:
+                migrated = migrated_issues_index.get(redmine_id)
+            if args.check:
+                milestone_id = data.get('milestone_id', None)
+                if milestone_id:
+                    try:
+                        gitlab_project.get_milestone_by_id(milestone_id)
+                    except ValueError:
+                        raise CommandError(
+                            "issue \"{}\" points to unknown milestone_id \"{}\". "
+                            "Check that you already migrated roadmaps".format(
+                                data['title'], milestone_id))
+
+                log.info('Would {} issue "{}" and {} notes.'.format(
+                    'update' if migrated else 'create',
+                    data['title'],
+                    len(meta['notes'])))
+                continue
+
+            elif migrated:
+                pending.append((
+                    executor.submit(update_issue, migrated, data, meta),
+                    '#{iid} {title} (updated)'))
+
+            else:
+                progress = journal.get(redmine_id) if journal else None
+                if progress and progress.get('done'):
+                    log.info('#{} {} (already migrated)'.format(
+                        progress['iid'], data['title']))
+                    continue
+                if progress and progress.get('creating') and 'iid' not in progress:
+                    # Interrupted right after sending the issue: look for it
+                    if migrated_issues_index is None:
+                        migrated_issues_index = gitlab_project.get_migrated_issues_index()
+                    if redmine_id in migrated_issues_index:
+                        progress.save(iid=migrated_issues_index[redmine_id]['iid'])
+                if args.keep_id:
+                    data['iid'] = redmine_id
+                turn = None
+                if creation_order is not None:
+                    turn = creation_order.next_turn()
+                pending.append((
+                    executor.submit(
+                        create_issue, data, meta, progress, turn, uploads),
+                    '#{iid} {title}'))
+
+            # Bounded lookahead, results are reported in redmine order
+            while len(pending) > args.create_workers:
+                report(*pending.popleft())
+
+        while pending:
+            report(*pending.popleft())
+
+    except BaseException:
+        # Don't let queued issues wait for the turn of a failed one
+        if creation_order is not None:
+            creation_order.abort()
+        for future, message in pending:
+            future.cancel()
+        raise
+    finally:
+        executor.shutdown()
+        if upload_pool is not None:
+            upload_pool.shutdown()
+
+    stats = gitlab_project.quick_actions_stats
+    if stats['issues']:
+        log.info('Quick actions spared {} requests ({:.2f} per issue)'.format(
+            stats['saved_requests'], stats['saved_requests'] / stats['issues']))
+
+    if args.incremental and not args.check and issues:
+        # Next run picks up from the most recent update seen in this one
+        cache.set('checkpoints', checkpoint_key, max(
+            [updated_since or ''] + [i['updated_on'] for i in issues]))
 
 def perform_migrate_iid(args):
     """ Should occur after the issues migration
@@ -311,7 +702,7 @@ def perform_migrate_iid(args):
     # access gitlab database with
     # gitlab-rails dbconsole
 
-    gitlab = GitlabClient(args.gitlab_key, args.no_verify)
+    gitlab = make_gitlab_client(args)
     gitlab_project = GitlabProject(args.gitlab_project_url, gitlab, base_url=args.gitlab_url)
     gitlab_project_id = gitlab_project.get_id()
 
@@ -371,7 +762,7 @@ def perform_migrate_iid(args):
 def perform_delete_issues(args):
     """ Delete all issues in the gitlab repo
     """
-    gitlab = GitlabClient(args.gitlab_key, args.no_verify)
+    gitlab = make_gitlab_client(args)
     gitlab_project = GitlabProject(args.gitlab_project_url, gitlab, base_url=args.gitlab_url)
 
     gitlab_issues = gitlab_project.get_issues()
@@ -382,10 +773,10 @@ def perform_delete_issues(args):
         gitlab_project.delete_issue(issue['iid'])
 
 def perform_migrate_roadmap(args):
-    redmine = RedmineClient(args.redmine_key, args.no_verify)
-    gitlab = GitlabClient(args.gitlab_key, args.no_verify)
+    redmine = make_redmine_client(args)
+    gitlab = make_gitlab_client(args)
 
-    redmine_project = RedmineProject(args.redmine_project_url, redmine)
+    redmine_project = make_redmine_project(args, redmine)
     gitlab_project = GitlabProject(args.gitlab_project_url, gitlab, base_url=args.gitlab_url)
 
     checks = [
@@ -407,12 +798,34 @@ def perform_migrate_roadmap(args):
             created = gitlab_project.create_milestone(data, meta)
             log.info("Version {}".format(created['title']))
 
+def perform_export(args):
+    """ Save a redmine project to a local snapshot, to be migrated with --snapshot
+    """
+    redmine = make_redmine_client(args)
+    redmine_project = make_redmine_project(args, redmine)
+
+    if args.check:
+        issues = redmine_project.get_issues()
+        log.info('Would export {} issues to {}'.format(
+            len(issues), args.snapshot_path))
+        return
+
+    snapshot = Snapshot(args.snapshot_path)
+    try:
+        snapshot.export(redmine_project, wiki=not args.no_wiki,
+                        wiki_history=not args.no_history)
+    finally:
+        snapshot.close()
+    log.info('Exported {} to {}'.format(
+        redmine_project.public_url, args.snapshot_path))
+
 def perform_redirect(args):
-    redmine = RedmineClient(args.redmine_key, args.no_verify)
-    redmine_project = RedmineProject(args.redmine_project_url, redmine)
+    redmine = make_redmine_client(args)
+    redmine_project = make_redmine_project(args, redmine)
 
-    # get issues (optionally filtered by --issue-ids)
-    redmine_issues = redmine_project.get_issues(args.issue_ids or "")
+    # list issues (optionally filtered by --issue-ids), only ids are needed so
+    # skip the detail views and print rules as pages come in
+    redmine_issues = redmine_project.iter_issues(args.issue_ids or "")
 
     print('# uncomment next line to enable RewriteEngine')
     print('# RewriteEngine On')
@@ -2,6 +2,11 @@
 """
 
 import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+
 import yaml
 
 log = logging.getLogger(__name__)
@@ -38,7 +43,9 @@ def convert_attachment(redmine_issue_attachment, redmine_api_key):
     :return: a dict describing the attachment
     """
     uploads = {
+        'id': redmine_issue_attachment.get('id'),
         'filename': redmine_issue_attachment['filename'],
+        'filesize': redmine_issue_attachment.get('filesize'),
         'description': redmine_issue_attachment.get('description'),
         'content_url': '{}?key={}'.format(redmine_issue_attachment['content_url'], redmine_api_key),
         'content_type': redmine_issue_attachment.get('content_type', 'application/octet-stream')
@@ -155,6 +162,89 @@ def custom_fields_to_string(custom_fields, custom_fields_include):
 
     return "\n".join(l)
 
+def issue_texts(redmine_issue):
+    """ Textile texts of an issue, as convert_issue() converts them
+
+    :param redmine_issue: a detailed redmine issue
+    """
+    yield redmine_issue.get('description') or ""
+    for entry in redmine_issue.get('journals', []):
+        if entry.get('notes'):
+            yield entry['notes']
+
+
+def batches(items, batch_size):
+    """ Yields lists of batch_size items (the last one may be shorter)
+    """
+    iterator = iter(items)
+    batch = list(islice(iterator, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, batch_size))
+
+
+def prefetch_conversions(redmine_issues, textile_converter, batch_size=50):
+    """ Yields the issues, after converting their texts in batches
+
+    Texts of batch_size issues at a time are converted in a single run of the
+    converter, convert_issue() then finds them already converted.
+    """
+    for batch in batches(redmine_issues, batch_size):
+        textile_converter.prefetch(chain.from_iterable(map(issue_texts, batch)))
+        yield from batch
+
+
+# State of the conversion worker processes, see convert_issues()
+_worker_convert = None
+
+
+def _init_conversion_worker(convert, worker_user_dict):
+    global _worker_convert, user_dict
+    _worker_convert = convert
+    user_dict = worker_user_dict
+
+
+def _convert_batch(redmine_issues):
+    converter = _worker_convert.keywords['textile_converter']
+    return [_worker_convert(redmine_issue=i)
+            for i in prefetch_conversions(redmine_issues, converter)]
+
+
+def convert_issues(redmine_issues, convert, workers=1, batch_size=50):
+    """ Yields the converted issues, in order
+
+    With several workers, issues are converted batch_size at a time by a pool
+    of processes, while the caller consumes the previous ones. At most two
+    batches per worker are converted ahead of the caller, so that a slow
+    consumer holds the conversion back.
+
+    :param convert: convert_issue() with every argument but redmine_issue set
+        as keywords (a functools.partial)
+    :param workers: number of conversion processes, 1 converts in-process
+    """
+    if workers <= 1:
+        converter = convert.keywords['textile_converter']
+        for issue in prefetch_conversions(redmine_issues, converter, batch_size):
+            yield convert(redmine_issue=issue)
+        return
+
+    # Workers are spawned, not forked: the converter is pickled to them, so
+    # they open their own cache connection (a forked one would share the
+    # parent's SQLite connection, which corrupts the database).
+    executor = ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_conversion_worker, initargs=(convert, user_dict))
+    pending = deque()
+    try:
+        for batch in batches(redmine_issues, batch_size):
+            pending.append(executor.submit(_convert_batch, batch))
+            while len(pending) > 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
 # Convertor
 
 def convert_issue(redmine_api_key, redmine_issue, redmine_user_index, gitlab_user_index,
@@ -0,0 +1,52 @@
+""" Engines converting textile to markdown, selected by name
+
+An engine registers itself with the register_engine() decorator, when its
+module is imported. The built-in ones are:
+
+* "pandoc": a pandoc process per conversion (pandoc.PandocProcess)
+* "pandoc-server": long-lived `pandoc server` processes (pandoc.PandocServer)
+* "python": in-process, without pandoc (textile.TextileEngine)
+"""
+
+ENGINES = {}
+
+
+class ConversionEngine:
+    """ Converts pre-processed textile to markdown, before its post-processing
+    """
+    # Whether several texts are better sent as a single document (see
+    # TextileConverter.convert_many()), to save the cost of each conversion
+    batches = False
+
+    @property
+    def version(self):
+        """ Identifies the output of the engine, conversions kept in a cache
+        are redone when it changes
+        """
+        raise NotImplementedError
+
+    def convert(self, text):
+        """ :raises RuntimeError: when the text fails to convert
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def register_engine(name):
+    def register(engine_class):
+        ENGINES[name] = engine_class
+        return engine_class
+    return register
+
+
+def make_engine(name, **options):
+    """ :param options: passed to the engine class
+    """
+    try:
+        engine_class = ENGINES[name]
+    except KeyError:
+        raise ValueError('Unknown conversion engine {}, known ones are {}'.format(
+            name, ', '.join(sorted(ENGINES))))
+    return engine_class(**options)
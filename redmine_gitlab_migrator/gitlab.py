@@ -1,9 +1,14 @@
+import contextlib
+import hashlib
 import re
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from . import APIClient, Project
-import urllib
-from urllib.request import urlopen
+from .attachments import MultipartUpload, UploadCache, download
+from .journal import IssueProgress
+import urllib.error
 
 from redmine_gitlab_migrator.converters import redmine_username_to_gitlab_username
 
@@ -13,22 +18,91 @@ class GitlabClient(APIClient):
     # see http://doc.gitlab.com/ce/api/#pagination
     MAX_PER_PAGE = 100
 
-    def get(self, *args, **kwargs):
-        kwargs['params'] = kwargs.get('params', {})
-        kwargs['params']['page'] = 1
-        kwargs['params']['per_page'] = self.MAX_PER_PAGE
+    # List endpoints supporting keyset pagination, which is not capped and
+    # does not slow down on deep pages like offset pagination does.
+    # see https://docs.gitlab.com/ee/api/rest/#keyset-based-pagination
+    REGEX_KEYSET_PAGINATED = re.compile(r'/api/v4/(projects|users|groups)$')
+
+    def get_object(self, url, params=None, **kwargs):
+        """ GET a single object, without any pagination handling
+        """
+        return super().get(url, params=params, **kwargs)
+
+    def iter_get(self, url, params=None, **kwargs):
+        """ Iterates lazily over a list resource
+
+        Pages are requested one at a time, following the ``Link`` header (or
+        ``X-Next-Page``), with keyset pagination where GitLab supports it.
+        """
+        params = dict(params or {})
+        params['per_page'] = self.MAX_PER_PAGE
+        if self.REGEX_KEYSET_PAGINATED.search(urllib.parse.urlsplit(url).path):
+            keyset_params = dict(
+                params, pagination='keyset', order_by='id', sort='asc')
+            try:
+                resp = self._send('GET', url, params=keyset_params, **kwargs)
+            except requests.exceptions.HTTPError as e:
+                # Older GitLab versions reject keyset pagination here
+                if e.response is None or e.response.status_code not in (400, 405):
+                    raise
+                resp = self._send('GET', url, params=params, **kwargs)
+        else:
+            resp = self._send('GET', url, params=params, **kwargs)
+
+        while True:
+            yield from self._decode(resp) or []
+            if 'next' in resp.links:
+                # The next link carries every parameter, keyset cursor included
+                resp = self._send('GET', resp.links['next']['url'], **kwargs)
+            elif resp.headers.get('X-Next-Page'):
+                params['page'] = resp.headers['X-Next-Page']
+                resp = self._send('GET', url, params=params, **kwargs)
+            else:
+                return
+
+    def get(self, url, params=None, **kwargs):
+        params = dict(params or {})
+        params['page'] = 1
+        params['per_page'] = self.MAX_PER_PAGE
+
+        resp = self._send('GET', url, params=params, **kwargs)
+        result = self._decode(resp)
+        if not isinstance(result, list) or len(result) < self.MAX_PER_PAGE:
+            return result
+
+        def fetch(page):
+            return super(GitlabClient, self).get(
+                url, params=dict(params, page=page), **kwargs)
+
+        # GitLab omits X-Total-Pages on very large lists (> 10k items); when
+        # present, the remaining pages may be fetched in parallel.
+        total_pages = resp.headers.get('X-Total-Pages')
+        if total_pages:
+            for page in self.map_pages(fetch, range(2, int(total_pages) + 1)):
+                result.extend(page)
+            return result
 
-        result = super().get(*args, **kwargs)
-        page = result
         # Stop when a page is not full (fewer than per_page items). Using the
         # per-page length rather than the accumulated total avoids an infinite
         # loop when the total is an exact multiple of per_page.
+        page = result
         while len(page) == self.MAX_PER_PAGE:
-            kwargs['params']['page'] += 1
-            page = super().get(*args, **kwargs)
+            params['page'] += 1
+            page = fetch(params['page'])
             result.extend(page)
         return result
 
+    def graphql(self, url, query, variables=None):
+        """ Runs a GraphQL query or mutation
+
+        :return: the "data" of the response
+        :raises GraphQLError: when the response has errors and no data
+        """
+        ret = self.post(url, json={'query': query, 'variables': variables or {}})
+        if ret.get('errors') and not ret.get('data'):
+            raise GraphQLError(ret['errors'])
+        return ret['data']
+
     def get_auth_headers(self):
         return {"PRIVATE-TOKEN": self.api_key}
 
@@ -42,39 +116,154 @@ class GitlabInstance:
         self.api = client
 
     def get_user(self):
-        return self.api.get('{}/user'.format(self.url))
+        return self.api.get_object('{}/user'.format(self.url))
+
+    def iter_users(self):
+        return self.api.iter_get('{}/users'.format(self.url))
 
     def get_all_users(self):
-        return self.api.get('{}/users'.format(self.url))
+        return list(self.iter_users())
 
     def get_users_index(self):
         """ Returns dict index of users (by login)
         """
-        return {i['username']: i for i in self.get_all_users()}
+        return {i['username']: i for i in self.iter_users()}
+
+    def find_user(self, username):
+        """ Returns the user with this exact username, None if there is none
+        """
+        users = self.api.get('{}/users?username={}'.format(
+            self.url, urllib.parse.quote(username, safe='')))
+        for i in users:
+            # GitLab matches usernames case-insensitively
+            if i['username'] == username:
+                return i
+        return None
 
     def get_group_members(self, group_id):
         return self.api.get('{}/groups/{}/members'.format(self.url, group_id))
 
 
-    def check_users_exist(self, usernames):
+    def check_users_exist(self, usernames, resolver=None):
         """ Returns True if all users exist
         """
-        gitlab_user_names = set([i['username'] for i in self.get_all_users()])
+        resolver = resolver or GitlabUserResolver(self)
 
         translated = []
         for i in usernames:
             print(i, redmine_username_to_gitlab_username(i))
             translated.append(redmine_username_to_gitlab_username(i))
+        gitlab_user_names = resolver.resolve(translated)
         return all((i in gitlab_user_names for i in translated))
 
 
+class CreationAborted(Exception):
+    pass
+
+
+class GraphQLError(Exception):
+    pass
+
+
+class CreationOrder:
+    """ Makes issues created concurrently reach gitlab in a given order
+
+    GitLab gives iids in the order issues are created; each issue creation
+    takes a turn, and waits for the previous turns before sending its issue.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._taken = 0
+        self._current = 0
+        self._aborted = False
+
+    def next_turn(self):
+        """ To be called in the wanted order
+
+        :return: a context manager to send the issue in
+        """
+        position = self._taken
+        self._taken += 1
+        return self._turn(position)
+
+    @contextlib.contextmanager
+    def _turn(self, position):
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._aborted or self._current == position)
+            if self._aborted:
+                raise CreationAborted(
+                    'An earlier issue creation failed')
+        try:
+            yield
+        except BaseException:
+            # Next issues would take the iid expected for this one
+            self.abort()
+            raise
+        with self._cond:
+            self._current += 1
+            self._cond.notify_all()
+
+    def abort(self):
+        with self._cond:
+            self._aborted = True
+            self._cond.notify_all()
+
+
+class GitlabUserResolver:
+    """ Memoized index of GitLab users, looked up by username on demand
+
+    Unlike GitlabInstance.get_users_index(), only the requested usernames are
+    queried, so the cost depends on the number of participants rather than
+    on the size of the instance.
+    """
+    def __init__(self, instance, concurrency=1):
+        self.instance = instance
+        self.concurrency = concurrency
+        # username -> user, or None for users known not to exist
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, usernames):
+        """ Returns dict index of the given users (by login)
+
+        Unknown usernames are left out of the index.
+        """
+        usernames = set(usernames)
+        with self._lock:
+            missing = [i for i in usernames if i not in self._users]
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                found = executor.map(self.instance.find_user, missing)
+                with self._lock:
+                    self._users.update(zip(missing, found))
+        with self._lock:
+            return {i: self._users[i] for i in usernames
+                    if self._users[i] is not None}
+
+
 class GitlabProject(Project):
     REGEX_PROJECT_URL = re.compile(
         r'^(?P<base_url>https?://[^/]+/)(?P<namespace>[\.\w\._/-]+)/(?P<project_name>[\w\._-]+)$')
 
+    # Written by convert_issue() at the end of every migrated description
+    REGEX_REDMINE_ISSUE_ID = re.compile(r'\*\(from redmine: issue id (\d+),')
+
+    UPLOADS_HEADER = "\n* Uploads:\n  * "
+
     def __init__(self, url, client, base_url=None):
         super().__init__(url, client)
         self.group_id = None
+        # Only kept for the run, unless replaced by one backed by a DiskCache
+        self.upload_cache = UploadCache()
+        # Set to fold time tracking and closing into the issue creation and
+        # notes, as quick actions
+        self.quick_actions = False
+        self.quick_actions_stats = {'issues': 0, 'saved_requests': 0}
+        self._stats_lock = threading.Lock()
+        # Notes sent per GraphQL request (createNote mutations), 0 to post
+        # them one by one with the REST API
+        self.graphql_notes = 0
 
         # `base_url` is the GitLab instance root (e.g. https://host/gitlab). The
         # URL regex alone can't tell a sub-path install (host/gitlab/group/proj)
@@ -101,6 +290,7 @@ class GitlabProject(Project):
                 **self._url_match.groupdict())
 
         self.instance_url = '{}/api/v4'.format(base)
+        self.graphql_url = '{}/api/graphql'.format(base)
         self.api_url = '{}/api/v4/projects/{}'.format(
             base, urllib.parse.quote(path_with_namespace, safe=''))
 
@@ -108,64 +298,111 @@ class GitlabProject(Project):
     def is_repository_empty(self):
         """ Heuristic to check if repository is empty
         """
-        return self.api.get(self.api_url)['default_branch'] is None
+        return self.api.get_object(self.api_url)['default_branch'] is None
 
     def uploads_to_string(self, uploads):
+        return self.join_uploads(uploads, [self.upload(u) for u in uploads])
 
-        uploads_url = '{}/uploads'.format(self.api_url)
-        l = []
-        for u in uploads:
-
-           log.info('\tuploading {} ({} / {})'.format(u['filename'], u['content_url'], u['content_type']))
-
-           # http://docs.python-requests.org/en/latest/user/quickstart/#post-a-multipart-encoded-file
-           # http://stackoverflow.com/questions/20830551/how-to-streaming-upload-with-python-requests-module-include-file-and-data
-
-           files = []
-           try:
-               files = [("file", (u['filename'], urlopen(u['content_url']), u['content_type']))]
-           except urllib.error.HTTPError as e:
-               log.warning("{} can't upload due to error: {}!".format(u['content_url'], e))
-
-
-           try:
-               upload = self.api.post(
-                   uploads_url, files=files)
-               l.append('{} {}'.format(upload['markdown'], u['description']))
+    @staticmethod
+    def join_uploads(uploads, markdowns):
+        """ :param markdowns: markdown of each upload, None for the failed ones
+        """
+        return "\n  * ".join(
+            '{} {}'.format(markdown, u['description'])
+            for u, markdown in zip(uploads, markdowns) if markdown is not None)
 
-           except requests.exceptions.HTTPError:
-               # gitlab might throw an "ArgumentError (invalid byte sequence in UTF-8)" in production.log
-               # if the filename contains special chars like german "umlaute"
-               # in that case we retry with an ascii only filename.
-               try:
-                   files = [("file", (self.remove_non_ascii(u['filename']), urlopen(u['content_url']), u['content_type']))]
-                   upload = self.api.post(uploads_url, files=files)
-                   l.append('{} {}'.format(upload['markdown'], u['description']))
-               except urllib.error.HTTPError as e:
-                   log.warning("{} can't upload due to error: {}!".format(u['content_url'], e))
+    def upload(self, u):
+        """ Uploads a redmine attachment, unless it already was
 
+        :return: the markdown of the upload, None if it can't be downloaded
+        """
+        attachment_key = None
+        if u.get('id') is not None:
+            attachment_key = self.upload_cache.attachment_key(u['id'])
+            markdown = self.upload_cache.get(attachment_key)
+            if markdown is not None:
+                log.info('\t{} already uploaded'.format(u['filename']))
+                return markdown
+
+        log.info('\tuploading {} ({} / {})'.format(u['filename'], u['content_url'], u['content_type']))
+
+        # Downloaded once, into memory or a temporary file depending on its
+        # size; uploads (and their retries) are read from there.
+        digest = hashlib.sha256()
+        try:
+            spool = download(u['content_url'], digest=digest)
+        except urllib.error.URLError as e:
+            log.warning("{} can't upload due to error: {}!".format(u['content_url'], e))
+            return None
 
-        return "\n  * ".join(l)
+        uploads_url = '{}/uploads'.format(self.api_url)
+        content_key = self.upload_cache.content_key(digest, u['filename'])
+        with spool:
+            markdown = self.upload_cache.get(content_key)
+            if markdown is not None:
+                log.info('\t{} already uploaded with the same content'.format(u['filename']))
+            else:
+                try:
+                    upload = self.upload_file(
+                        uploads_url, u['filename'], spool, u['content_type'])
+                except requests.exceptions.HTTPError:
+                    # gitlab might throw an "ArgumentError (invalid byte sequence in UTF-8)" in production.log
+                    # if the filename contains special chars like german "umlaute"
+                    # in that case we retry with an ascii only filename.
+                    upload = self.upload_file(
+                        uploads_url, self.remove_non_ascii(u['filename']),
+                        spool, u['content_type'])
+                markdown = upload['markdown']
+                self.upload_cache.set(content_key, markdown)
+        if attachment_key is not None:
+            self.upload_cache.set(attachment_key, markdown)
+        return markdown
+
+    def upload_file(self, uploads_url, filename, fileobj, content_type):
+        """ Uploads a file, streamed from fileobj
+        """
+        body = MultipartUpload('file', filename, fileobj, content_type)
+        return self.api.post(
+            uploads_url, data=body, headers={'Content-Type': body.content_type})
 
     def remove_non_ascii(self, text):
         # http://stackoverflow.com/a/20078869/98491
         return ''.join([i if ord(i) < 128 else ' ' for i in text])
 
-    def create_issue(self, data, meta, auth_header):
+    def create_issue(self, data, meta, auth_header, progress=None, turn=None,
+                     uploads=None):
         """ High-level issue creation
 
         :param meta: dict with "sudo_user", "must_close", "notes" and "attachments" keys
         :param data: dict formatted as the gitlab API expects it
         :param auth_header: dict to with headers to auth request
+        :param progress: IssueProgress of the issue, the steps it records
+            as completed are skipped, and the others recorded as they complete
+        :param turn: optional CreationOrder turn, the issue is sent to gitlab
+            only once the previous issues have been
+        :param uploads: optional futures of the uploads markdown, when
+            uploaded ahead by an UploadPool
         :return: the created issue (without notes)
         """
+        if progress is None:
+            progress = IssueProgress()
+        if turn is None:
+            turn = contextlib.nullcontext()
 
         # attachments have to be uploaded prior to creating an issue
         # attachments are not related to an issue but can be referenced instead
         # see: https://docs.gitlab.com/ce/api/projects.html#upload-a-file
-        uploads_text = self.uploads_to_string(meta['uploads'])
+        if 'uploads' not in progress:
+            if uploads is None:
+                uploads_text = self.uploads_to_string(meta['uploads'])
+            else:
+                uploads_text = self.join_uploads(
+                    meta['uploads'], [i.result() for i in uploads])
+            progress.save(uploads=uploads_text)
+        uploads_text = progress['uploads']
         if len(uploads_text) > 0:
-           data['description'] = "{}\n* Uploads:\n  * {}".format(data['description'], uploads_text)
+           data['description'] = "{}{}{}".format(
+               data['description'], self.UPLOADS_HEADER, uploads_text)
         # Copy so the SUDO header we set below doesn't leak back into the
         # shared auth_header (and thus into subsequent issues/notes).
         headers = dict(auth_header)
@@ -173,45 +410,284 @@ class GitlabProject(Project):
             headers['SUDO'] = meta['sudo_user']
         issues_url = '{}/issues'.format(self.api_url)
         issue = None
-        try:
-            issue = self.api.post(
-                issues_url, data=data, headers=headers)
-        except requests.exceptions.HTTPError as e:
-            log.error("Can't create issue due to error: {}".format(e.response.content))
-            if e.response.status_code == 404 and 'SUDO' in headers:
-                log.error(
-                    "Hint: the impersonated user '{}' may not be a member of "
-                    "the target project — GitLab returns 404 when the SUDO user "
-                    "cannot see it.".format(headers['SUDO']))
-            raise
-
+        time_actions = []
+        with turn:
+            if 'iid' not in progress:
+                payload = data
+                if self.quick_actions:
+                    time_actions = self.time_tracking_actions(meta)
+                if time_actions:
+                    payload = dict(data, description='{}\n\n{}'.format(
+                        data['description'], '\n'.join(time_actions)))
+                progress.save(creating=True)
+                try:
+                    issue = self.api.post(
+                        issues_url, data=payload, headers=headers)
+                except requests.exceptions.HTTPError as e:
+                    log.error("Can't create issue due to error: {}".format(e.response.content))
+                    if e.response.status_code == 404 and 'SUDO' in headers:
+                        log.error(
+                            "Hint: the impersonated user '{}' may not be a member of "
+                            "the target project — GitLab returns 404 when the SUDO user "
+                            "cannot see it.".format(headers['SUDO']))
+                    raise
+                progress.save(iid=issue['iid'])
+        if issue is None:
+            issue = self.api.get_object(
+                '{}/{}'.format(issues_url, progress['iid']))
 
         issue_url = '{}/{}'.format(issues_url, issue['iid'])
 
-        # Handle issues notes
-        issue_notes_url = '{}/notes'.format(issue_url, 'notes')
-        for note_data, note_meta in meta['notes']:
-            note_headers = dict(auth_header)
-            if 'sudo_user' in note_meta:
-                note_headers['SUDO'] = note_meta['sudo_user']
-            self.api.post(
-                issue_notes_url, data=note_data,
-                headers=note_headers)
+        saved = 0
+        if time_actions:
+            saved += self.check_time_tracking(issue, meta, progress)
+            if saved < len(time_actions):
+                # The quick actions not run are left as text by gitlab
+                self.api.put(issue_url, data={'description': data['description']},
+                             headers=headers)
+                saved -= 1
+
+        # Closed by the last note, if posted by the migrating account (the one
+        # otherwise closing the issue)
+        notes = meta['notes']
+        close_by_note = (
+            self.quick_actions and meta['must_close']
+            and not progress.get('closed')
+            and progress.get('notes', 0) < len(notes)
+            and not notes[-1][1].get('sudo_user'))
 
-        # Handle estimated and spent time
-        if meta['human_time_estimate'] is not None and meta['human_time_estimate'] != 0.0:
+        # Handle issues notes
+        last_note = self.create_notes(
+            issue_url, notes, auth_header, progress, close=close_by_note,
+            issue_id=issue.get('id'))
+        if close_by_note:
+            closed = self.check_closed(issue_url, last_note)
+            if closed:
+                progress.save(closed=True)
+            # Without a note body telling it, the state was fetched
+            if closed and last_note is not None:
+                saved += 1
+
+        # Handle estimated and spent time (unless set by quick actions)
+        if meta['human_time_estimate'] is not None and meta['human_time_estimate'] != 0.0 \
+                and not progress.get('time_estimate'):
             time_estimate_url = '{}/time_estimate?duration={}h'.format(issue_url, meta['human_time_estimate'])
             self.api.post(time_estimate_url)
-        if meta['human_total_time_spent'] is not None and meta['human_total_time_spent'] != 0.0:
+            progress.save(time_estimate=True)
+        if meta['human_total_time_spent'] is not None and meta['human_total_time_spent'] != 0.0 \
+                and not progress.get('time_spent'):
             time_spent_url = '{}/add_spent_time?duration={}h'.format(issue_url, meta['human_total_time_spent'])
             self.api.post(time_spent_url)
+            progress.save(time_spent=True)
 
         # Handle closed status
-        if meta['must_close']:
+        if meta['must_close'] and not progress.get('closed'):
             self.api.put(issue_url, {'state_event': 'close'})
+            progress.save(closed=True)
+
+        if self.quick_actions:
+            with self._stats_lock:
+                self.quick_actions_stats['issues'] += 1
+                self.quick_actions_stats['saved_requests'] += saved
 
+        progress.save(done=True)
         return issue
 
+    def time_tracking_actions(self, meta):
+        """ Quick actions setting the time tracking of a new issue
+        """
+        actions = []
+        if meta['human_time_estimate']:
+            actions.append('/estimate {}h'.format(meta['human_time_estimate']))
+        if meta['human_total_time_spent']:
+            actions.append('/spend {}h'.format(meta['human_total_time_spent']))
+        return actions
+
+    def check_time_tracking(self, issue, meta, progress):
+        """ Records the time tracking set by quick actions on issue creation
+
+        The time not set (eg: quick actions not allowed to the issue author)
+        is left to the separate requests.
+
+        :return: the number of requests spared
+        """
+        time_stats = issue.get('time_stats') or {}
+        saved = 0
+        if meta['human_time_estimate'] and time_stats.get('time_estimate'):
+            progress.save(time_estimate=True)
+            saved += 1
+        if meta['human_total_time_spent'] and time_stats.get('total_time_spent'):
+            progress.save(time_spent=True)
+            saved += 1
+        if saved < len(self.time_tracking_actions(meta)):
+            log.info('\ttime tracking quick actions not applied, '
+                     'falling back to separate requests')
+        return saved
+
+    def check_closed(self, issue_url, last_note):
+        """ Whether the /close quick action of the last note closed the issue
+
+        GitLab removes the quick actions it runs from the note it saves: one
+        left at the end of the note was not run (eg: not allowed, or in an
+        unclosed code block). When the saved note is unknown, the issue
+        state is fetched.
+
+        :param last_note: body of the last note, as saved by gitlab
+        """
+        if last_note is not None:
+            closed = not last_note.rstrip().endswith('/close')
+        else:
+            closed = self.api.get_object(issue_url)['state'] == 'closed'
+        if not closed:
+            log.info('\t/close quick action not applied, falling back to '
+                     'a separate request')
+        return closed
+
+    def create_notes(self, issue_url, notes, auth_header, progress=None,
+                     close=False, issue_id=None):
+        """ :param progress: optional IssueProgress, the notes it counts as
+            created are skipped
+        :param close: closes the issue with a /close quick action in the
+            last note
+        :param issue_id: id (not iid) of the issue, to create its notes with
+            GraphQL when graphql_notes is set
+        :return: the body of the last note created, as saved by gitlab (None
+            if unknown)
+        """
+        if progress is None:
+            progress = IssueProgress()
+        issue_notes_url = '{}/notes'.format(issue_url)
+        # Notes waiting for a GraphQL request, as (count, note_data)
+        batch = []
+        last_note = None
+        for count, (note_data, note_meta) in enumerate(notes, 1):
+            if count <= progress.get('notes', 0):
+                continue
+            if close and count == len(notes):
+                note_data = dict(
+                    note_data, body='{}\n\n/close'.format(note_data['body']))
+            # GraphQL has no SUDO: impersonated notes are posted with REST,
+            # once the previous ones are created
+            if self.graphql_notes and issue_id is not None \
+                    and not note_meta.get('sudo_user'):
+                batch.append((count, note_data))
+                if len(batch) >= self.graphql_notes:
+                    last_note = self.create_notes_graphql(issue_id, batch, progress)
+                    batch = []
+                continue
+            if batch:
+                self.create_notes_graphql(issue_id, batch, progress)
+                batch = []
+            note_headers = dict(auth_header)
+            if 'sudo_user' in note_meta:
+                note_headers['SUDO'] = note_meta['sudo_user']
+            created = self.api.post(
+                issue_notes_url, data=note_data,
+                headers=note_headers)
+            last_note = created.get('body') if isinstance(created, dict) else None
+            progress.save(notes=count)
+        if batch:
+            last_note = self.create_notes_graphql(issue_id, batch, progress)
+        return last_note
+
+    def create_notes_graphql(self, issue_id, batch, progress):
+        """ Creates notes with a single GraphQL request
+
+        The mutations of a request are run one after the other, so the notes
+        are created in order. GraphQL can't set their date (created_at), they
+        are dated of the migration.
+
+        :param batch: list of (count, note_data), count being the number of
+            notes of the issue created once the note is
+        :return: the body of the last note, as saved by gitlab
+        """
+        noteable_id = 'gid://gitlab/Issue/{}'.format(issue_id)
+        aliases = ['note{}'.format(count) for count, note_data in batch]
+        query = 'mutation({}) {{ {} }}'.format(
+            ', '.join('${}: CreateNoteInput!'.format(i) for i in aliases),
+            ' '.join('{0}: createNote(input: ${0}) {{ note {{ body }} errors }}'.format(i)
+                     for i in aliases))
+        variables = {
+            alias: {'noteableId': noteable_id, 'body': note_data['body']}
+            for alias, (count, note_data) in zip(aliases, batch)}
+        created = self.api.graphql(self.graphql_url, query, variables)
+        for alias, (count, note_data) in zip(aliases, batch):
+            result = created.get(alias)
+            if not result or result.get('errors'):
+                raise GraphQLError('note {} of issue {} not created: {}'.format(
+                    count, issue_id, result and result['errors']))
+            progress.save(notes=count)
+        return (result.get('note') or {}).get('body')
+
+    def update_issue(self, issue, data, meta, auth_header):
+        """ Brings an issue migrated by a previous run up to date
+
+        Fields are overwritten, and the notes and uploads that are not yet on
+        the gitlab issue are added.
+
+        :param issue: the gitlab issue, as returned by the API
+        :param data: dict formatted as the gitlab API expects it
+        :param meta: same as for create_issue()
+        :param auth_header: dict to with headers to auth request
+        :return: the updated issue
+        """
+        issue_url = '{}/issues/{}'.format(self.api_url, issue['iid'])
+        update = {k: v for k, v in data.items() if k not in ('created_at', 'iid')}
+
+        # Keep the uploads of previous runs, and add the new ones (gitlab
+        # upload links are titled after the file name)
+        old_description = issue.get('description') or ''
+        uploads_start = old_description.find(self.UPLOADS_HEADER)
+        old_uploads = old_description[uploads_start:] if uploads_start >= 0 else ''
+        uploads_text = self.uploads_to_string(
+            [u for u in meta['uploads']
+             if '[{}]('.format(u['filename']) not in old_uploads])
+        if old_uploads:
+            update['description'] += old_uploads
+            if uploads_text:
+                update['description'] += "\n  * " + uploads_text
+        elif uploads_text:
+            update['description'] += self.UPLOADS_HEADER + uploads_text
+
+        if meta['must_close'] and issue['state'] != 'closed':
+            update['state_event'] = 'close'
+        elif not meta['must_close'] and issue['state'] == 'closed':
+            update['state_event'] = 'reopen'
+
+        updated = self.api.put(issue_url, data=update)
+
+        # Notes bodies embed their redmine date, so an already migrated note
+        # is found back by its body.
+        migrated_notes = set(
+            i['body'] for i in self.api.get('{}/notes'.format(issue_url)))
+        self.create_notes(
+            issue_url,
+            [i for i in meta['notes'] if i[0]['body'] not in migrated_notes],
+            auth_header, issue_id=issue.get('id'))
+
+        time_stats = issue.get('time_stats', {})
+        estimate = meta['human_time_estimate'] or 0
+        if estimate and round(estimate * 3600) != time_stats.get('time_estimate'):
+            self.api.post('{}/time_estimate?duration={}h'.format(
+                issue_url, estimate))
+        missing_spent = ((meta['human_total_time_spent'] or 0) * 3600
+                         - time_stats.get('total_time_spent', 0))
+        if missing_spent > 0:
+            self.api.post('{}/add_spent_time?duration={}s'.format(
+                issue_url, round(missing_spent)))
+
+        return updated
+
+    def get_migrated_issues_index(self):
+        """ Returns dict index of the issues migrated from redmine (by redmine id)
+        """
+        index = {}
+        for i in self.api.iter_get('{}/issues'.format(self.api_url)):
+            m = self.REGEX_REDMINE_ISSUE_ID.search(i.get('description') or '')
+            if m:
+                index[int(m.group(1))] = i
+        return index
+
     def delete_issue(self, iid):
         issue_url = '{}/issues/{}'.format(self.api_url, iid)
         # DELETE returns 204 with an empty body; APIClient handles that.
@@ -284,7 +760,7 @@ class GitlabProject(Project):
         return all((i in gitlab_user_names for i in usernames))
 
     def get_id(self):
-        return self.api.get(self.api_url)['id']
+        return self.api.get_object(self.api_url)['id']
 
     def get_instance(self):
         """ Return a GitlabInstance
@@ -0,0 +1,43 @@
+""" Progress of the issues migration, kept on disk so a run can be resumed
+"""
+
+
+class IssueProgress(dict):
+    """ Steps completed for the migration of one redmine issue
+
+    Known keys are "uploads" (markdown of the uploaded attachments),
+    "creating" (the issue POST was sent), "iid", "notes" (count of notes
+    created), "time_estimate", "time_spent", "closed" and "done".
+
+    Every save() is written to the journal before returning, so that a step
+    is never recorded before it happened nor lost once it did.
+    """
+    def __init__(self, journal=None, redmine_id=None, steps=None):
+        super().__init__(steps or {})
+        self.journal = journal
+        self.redmine_id = redmine_id
+
+    def save(self, **steps):
+        self.update(steps)
+        if self.journal is not None:
+            self.journal.cache.set(
+                self.journal.namespace, self.redmine_id, dict(self))
+
+
+class MigrationJournal:
+    """ Journal of the issues migrated from a redmine project to a gitlab one
+
+    Stored in a DiskCache, one entry per redmine issue.
+    """
+    def __init__(self, cache, redmine_url, gitlab_url):
+        self.cache = cache
+        self.namespace = 'journal:{} {}'.format(redmine_url, gitlab_url)
+
+    def get(self, redmine_id):
+        """ :rtype: IssueProgress
+        """
+        return IssueProgress(
+            self, redmine_id, self.cache.get(self.namespace, redmine_id))
+
+    def clear(self):
+        self.cache.clear(self.namespace)
@@ -0,0 +1,256 @@
+""" Ways of running pandoc for the textile conversion
+"""
+
+import functools
+import logging
+import queue
+import socket
+import subprocess
+import threading
+import time
+from multiprocessing.util import Finalize
+
+import pypandoc
+import requests
+
+from .engines import ConversionEngine, register_engine
+
+log = logging.getLogger(__name__)
+
+
+MIN_PANDOC_VERSION = (1, 17)
+
+
+def _pandoc_version_tuple():
+    """ '3.10.1' -> (3, 10, 1); tolerant of non-numeric suffixes. """
+    parts = []
+    for chunk in pypandoc.get_pandoc_version().split('.'):
+        digits = ''.join(c for c in chunk if c.isdigit())
+        parts.append(int(digits) if digits else 0)
+    return tuple(parts)
+
+
+@functools.lru_cache(maxsize=None)
+def check_pandoc_version():
+    """ Numeric version check (a string compare mishandles e.g. 1.2 vs 1.17). """
+    if _pandoc_version_tuple() < MIN_PANDOC_VERSION:
+        log.error('You need at least pandoc {}, download from '
+                  'http://pandoc.org/installing.html'.format(
+                      '.'.join(str(n) for n in MIN_PANDOC_VERSION)))
+        exit(1)
+
+
+@register_engine('pandoc')
+class PandocProcess(ConversionEngine):
+    """ Runs a pandoc process per conversion
+    """
+    batches = True
+
+    def __init__(self):
+        check_pandoc_version()
+
+    @property
+    def version(self):
+        return pypandoc.get_pandoc_version()
+
+    def convert(self, text):
+        """ Converts a textile text to markdown
+
+        :raises RuntimeError: when pandoc fails to convert the text
+        """
+        return pypandoc.convert_text(text, 'markdown_strict', format='textile')
+
+
+class PandocServerError(Exception):
+    """ The pandoc server could not be started or reached
+    """
+
+
+class PandocServerWorker:
+    """ A `pandoc server` process, listening on a local port
+    """
+    STARTUP_TIMEOUT = 10
+    # Time allowed to a conversion, by the server (its default is only 2
+    # seconds, too little for long pages) and by the requests to it
+    REQUEST_TIMEOUT = 60
+
+    def __init__(self, command):
+        self.command = command
+        self.process = None
+        self.url = None
+        self.session = None
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """ Starts the server and waits until it answers
+
+        :raises PandocServerError: when it does not
+        """
+        self.stop()
+        # Let the system pick a free port
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        self.process = subprocess.Popen(
+            self.command + ['--port', str(port),
+                            '--timeout', str(int(self.REQUEST_TIMEOUT))],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.url = 'http://127.0.0.1:{}'.format(port)
+        self.session = requests.Session()
+
+        deadline = time.monotonic() + self.STARTUP_TIMEOUT
+        while True:
+            if not self.alive():
+                self.stop()
+                raise PandocServerError('pandoc server exited on startup')
+            try:
+                socket.create_connection(('127.0.0.1', port), 1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    self.stop()
+                    raise PandocServerError(
+                        'pandoc server not listening after {}s'.format(
+                            self.STARTUP_TIMEOUT))
+                time.sleep(0.05)
+
+        # Listening is not enough, eg: pandoc built without the threaded
+        # runtime accepts connections, and then fails every request.
+        try:
+            response = self.session.get(
+                '{}/version'.format(self.url), timeout=self.STARTUP_TIMEOUT)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            self.stop()
+            raise PandocServerError('pandoc server not answering: {}'.format(e))
+        log.debug('pandoc server {} started on port {}'.format(
+            response.text.strip(), port))
+
+    def stop(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.terminate()
+                try:
+                    self.process.wait(5)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                    self.process.wait()
+            self.process = None
+
+    def convert(self, text):
+        """ :raises RuntimeError: when pandoc fails to convert the text
+        :raises requests.ConnectionError: when the server is gone
+        """
+        try:
+            response = self.session.post(
+                self.url + '/',
+                json={'text': text, 'from': 'textile', 'to': 'markdown_strict'},
+                headers={'Accept': 'application/json'},
+                # Leaves the server the time to report its own timeout
+                timeout=self.REQUEST_TIMEOUT + self.STARTUP_TIMEOUT)
+        except requests.Timeout:
+            # Do not leave it busy with that text, it is restarted on next use
+            self.stop()
+            raise RuntimeError('pandoc server: conversion timed out')
+        if response.status_code != 200:
+            raise RuntimeError('pandoc server: {}'.format(response.text))
+        result = response.json()
+        if 'error' in result:
+            raise RuntimeError('pandoc server: {}'.format(result['error']))
+        output = result['output']
+        # As the pandoc command, always end the text with a newline
+        if not output.endswith('\n'):
+            output += '\n'
+        return output
+
+
+@register_engine('pandoc-server')
+class PandocServer(ConversionEngine):
+    """ Pool of long-lived `pandoc server` processes (pandoc >= 3.0)
+
+    Saves the start of a pandoc process per conversion. Servers are started
+    on the first conversion needing one, up to ``workers`` of them for
+    concurrent conversions. A server that died is restarted.
+
+    When no server can be started (older pandoc, or one built without server
+    support), texts are converted by a pandoc process each, as PandocProcess.
+    So is a text the server fails to convert (eg: timed out).
+    """
+    batches = True
+
+    def __init__(self, workers=2, command=None):
+        check_pandoc_version()
+        if workers < 1:
+            raise ValueError(
+                'workers must be at least 1, got {}'.format(workers))
+        self.workers = workers
+        self.command = command
+        self._setup()
+
+    def _setup(self):
+        self._idle = queue.LifoQueue()
+        for _ in range(self.workers):
+            self._idle.put(PandocServerWorker(
+                self.command or [pypandoc.get_pandoc_path(), 'server']))
+        self._fallback = None
+        self._lock = threading.Lock()
+        # Also run by the processes of a pool, which do not run atexit hooks
+        self._finalizer = Finalize(self, type(self)._close_workers,
+                                   args=(list(self._idle.queue),),
+                                   exitpriority=10)
+
+    @property
+    def version(self):
+        return pypandoc.get_pandoc_version()
+
+    def __getstate__(self):
+        # Other processes start their own servers
+        return {'workers': self.workers, 'command': self.command}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._setup()
+
+    def convert(self, text):
+        """ :raises RuntimeError: when pandoc fails to convert the text
+        """
+        if self._fallback is not None:
+            return self._fallback.convert(text)
+        worker = self._idle.get()
+        try:
+            for attempt in (1, 2):
+                try:
+                    if not worker.alive():
+                        worker.start()
+                    return worker.convert(text)
+                except RuntimeError as e:
+                    log.warning('{}, converting with a pandoc process '
+                                'instead'.format(e))
+                    return PandocProcess().convert(text)
+                except requests.ConnectionError:
+                    if attempt == 2:
+                        raise
+                    log.warning('pandoc server died, restarting it')
+                    worker.stop()
+        except (PandocServerError, requests.ConnectionError) as e:
+            with self._lock:
+                if self._fallback is None:
+                    log.warning('Cannot use pandoc server ({}), running '
+                                'pandoc for every conversion'.format(e))
+                    self._fallback = PandocProcess()
+            return self._fallback.convert(text)
+        finally:
+            self._idle.put(worker)
+
+    def close(self):
+        self._finalizer()
+
+    @staticmethod
+    def _close_workers(workers):
+        for worker in workers:
+            worker.stop()
@@ -0,0 +1,72 @@
+""" Client-side rate limiting of API requests
+"""
+
+import threading
+import time
+from urllib.parse import urlsplit
+
+READ_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+
+class TokenBucket:
+    """ Thread-safe token bucket
+
+    Tokens are refilled at ``rate`` per second, up to ``burst``. A caller
+    that finds the bucket empty reserves the next token anyway and sleeps
+    until it is due, so concurrent callers are served in arrival order.
+    """
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError('rate must be positive, got {}'.format(rate))
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """ Takes a token and returns how many seconds to wait before use
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """ Per-host request rate limiter
+
+    Every host gets its own bucket allowing ``rate`` requests per second.
+    When ``write_rate`` is set, non-GET requests additionally go through a
+    second, write-only bucket of that host.
+    """
+    def __init__(self, rate=None, write_rate=None, burst=None):
+        self.rate = rate
+        self.write_rate = write_rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, host, kind, rate):
+        with self._lock:
+            key = (host, kind)
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(rate, self.burst)
+            return self._buckets[key]
+
+    def acquire(self, method, url):
+        """ Blocks until a request to ``url`` is allowed
+        """
+        host = urlsplit(url).netloc
+        if self.write_rate and method.upper() not in READ_METHODS:
+            self._bucket(host, 'write', self.write_rate).acquire()
+        if self.rate:
+            self._bucket(host, 'all', self.rate).acquire()
@@ -1,11 +1,42 @@
+from concurrent.futures import ThreadPoolExecutor
 from itertools import chain
 import re
+from urllib.parse import quote
 
 from . import APIClient, Project
 from requests.exceptions import HTTPError
 
 ANONYMOUS_USER_ID = 2
 
+
+def participant_ids(issues):
+    """ Ids of the users participating on issues (authors, owners, watchers
+    and note writers)
+
+    :param issues: detailed redmine issues
+    :rtype: set
+    """
+    user_ids = set()
+
+    for i in issues:
+        journals = i.get('journals', [])
+        for i in chain(i.get('watchers', []),
+                       [i['author'], i.get('assigned_to', None)]):
+
+            if i is None or ('name' not in i and 'author' not in i):
+                continue
+            user_ids.add(i['id'])
+        for entry in journals:
+            if not entry.get('notes', None):
+                continue
+            user_ids.add(entry['user']['id'])
+
+    # The anonymous user is not really part of the project...
+    # You may want to add Group IDs such as [ANONYMOUS_USER_ID, 324, 234, ...] if necessary
+    user_ids.discard(ANONYMOUS_USER_ID)
+    return user_ids
+
+
 class RedmineClient(APIClient):
     PAGE_MAX_SIZE = 100
 
@@ -24,8 +55,12 @@ class RedmineClient(APIClient):
 
     def unpaginated_get(self, *args, **kwargs):
         """ Iterates over API pagination for a given resource list
+
+        Items are yielded as soon as their page is received. Later pages are
+        requested as the previous ones are consumed, ``page_workers`` at a
+        time.
         """
-        kwargs['params'] = kwargs.get('params', {})
+        kwargs['params'] = dict(kwargs.get('params', {}))
         kwargs['params']['limit'] = self.PAGE_MAX_SIZE
 
         resp = self.get(*args, **kwargs)
@@ -37,16 +72,20 @@ class RedmineClient(APIClient):
         assert len(keys_candidates) == 1
         res_list_key = list(keys_candidates)[0]
 
-        result_pages = [resp[res_list_key]]
         if 'offset' not in resp:
             raise ValueError('HTTP response data is not paginated')
+        yield from resp[res_list_key]
+
+        # total_count gives every remaining offset up front, so the remaining
+        # pages may be fetched in parallel (see APIClient.map_pages).
+        def fetch(offset):
+            page_kwargs = dict(kwargs, params=dict(kwargs['params'], offset=offset))
+            return self.get(*args, **page_kwargs)[res_list_key]
 
-        while (resp['total_count'] - resp['offset'] - resp['limit']) > 0:
-            kwargs['params']['offset'] = (kwargs['params'].get('offset', 0)
-                                          + self.PAGE_MAX_SIZE)
-            resp = self.get(*args, **kwargs)
-            result_pages.append(resp[res_list_key])
-        return chain.from_iterable(result_pages)
+        offsets = range(resp['offset'] + resp['limit'], resp['total_count'],
+                        resp['limit'])
+        for page in self.map_pages(fetch, offsets):
+            yield from page
 
 
 class RedmineProject(Project):
@@ -56,11 +95,24 @@ class RedmineProject(Project):
     REGEX_CATEGORY_PROJECT_URL = re.compile(
         r'^(?P<base_url>https?://.*)/project/(?P<category_name>[\w_-]+)/(?P<project_name>[\w_-]+)/?$')
 
-    def __init__(self, url, *args, **kwargs):
+    # Default lifetime, in seconds, of the users kept in the disk cache
+    USER_CACHE_TTL = 24 * 3600
+
+    def __init__(self, url, *args, concurrency=1, cache=None,
+                 user_cache_ttl=USER_CACHE_TTL, **kwargs):
+        """
+        :param concurrency: number of requests sent in parallel when fetching
+            one resource per item (eg: issue details)
+        :param cache: optional DiskCache where users are kept between runs
+        :param user_cache_ttl: seconds after which a cached user is fetched again
+        """
         normalized_url = self._canonicalize_url(url)
         super().__init__(normalized_url, *args, **kwargs)
         self.api_url = '{}.json'.format(self.public_url)
         self.instance_url = self._url_match.group('base_url')
+        self.concurrency = concurrency
+        self.cache = cache
+        self.user_cache_ttl = user_cache_ttl
 
     @classmethod
     def _canonicalize_url(cls, url):
@@ -78,27 +130,42 @@ class RedmineProject(Project):
         else:
             return url
 
-    def get_issues(self, issue_ids=""):
+    def iter_issues(self, issue_ids="", updated_since=None):
+        """ Iterates over the issues list view, sorted by id
 
-        if not hasattr(self, '_cache_issues'):
+        Issues are yielded page by page as Redmine returns them. List view
+        items lack journals, attachments and other details.
 
-            if issue_ids:
-                issue_ids_arg = "&issue_id=" + issue_ids
-            else:
-                issue_ids_arg = ""
+        :param updated_since: optional redmine timestamp, only the issues
+            updated on or after it are listed
+        """
+        if issue_ids:
+            issue_ids_arg = "&issue_id=" + issue_ids
+        else:
+            issue_ids_arg = ""
+        if updated_since:
+            issue_ids_arg += "&updated_on=" + quote('>=' + updated_since)
 
-            issues = self.api.unpaginated_get(
-                '{}/issues.json?subproject_id=1&status_id=*{}'.format(self.public_url, issue_ids_arg))
-            detailed_issues = []
-            # It's impossible to get issue history from list view, so get it from
-            # detail view...
+        return self.api.unpaginated_get(
+            '{}/issues.json?subproject_id=1&status_id=*&sort=id{}'.format(
+                self.public_url, issue_ids_arg))
 
-            for issue_id in sorted(i['id'] for i in issues):
-                issue_url = '{}/issues/{}.json?include=journals,watchers,relations,children,attachments,changesets'.format(
-                    self.instance_url, issue_id)
-                detailed_issues.append(self.api.get(issue_url))
+    def get_issues(self, issue_ids="", updated_since=None):
 
-            self._cache_issues = detailed_issues
+        if not hasattr(self, '_cache_issues'):
+            # It's impossible to get issue history from list view, so get it from
+            # detail view... Detail requests start while later list pages are
+            # still being fetched.
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                details = {}
+                for issue in self.iter_issues(issue_ids, updated_since):
+                    issue_url = '{}/issues/{}.json?include=journals,watchers,relations,children,attachments,changesets'.format(
+                        self.instance_url, issue['id'])
+                    if issue['id'] not in details:
+                        details[issue['id']] = executor.submit(
+                            self.api.get, issue_url)
+                self._cache_issues = [
+                    details[i].result() for i in sorted(details)]
 
         return self._cache_issues
 
@@ -116,33 +183,35 @@ class RedmineProject(Project):
         :return: list of all users participating on issues
         :rtype: list
         """
-        user_ids = set()
-        users = []
-
-        for i in self.get_issues(issue_ids):
-            journals = i.get('journals', [])
-            for i in chain(i.get('watchers', []),
-                           [i['author'], i.get('assigned_to', None)]):
-
-                if i is None or ('name' not in i and 'author' not in i):
-                    continue
-                user_ids.add(i['id'])
-            for entry in journals:
-                if not entry.get('notes', None):
-                    continue
-                user_ids.add(entry['user']['id'])
-
-        for i in user_ids:
-            # The anonymous user is not really part of the project...
-            # You may want to add Group IDs such as [ANONYMOUS_USER_ID, 324, 234, ...] if necessary
-            if i not in [ANONYMOUS_USER_ID]:
-                try:
-                  users.append(self.api.get('{}/users/{}.json'.format(
-                      self.instance_url, i)))
-                except HTTPError:
-                  print("unable to retrieve user!")
-
-        return users
+        user_ids = participant_ids(self.get_issues(issue_ids))
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            users = executor.map(self.get_user, sorted(user_ids))
+            return [i for i in users if i is not None]
+
+    def get_user(self, user_id):
+        """ Returns a Redmine user, None if it can't be retrieved
+
+        Users are kept in the disk cache (if any) for ``user_cache_ttl``
+        seconds. The cache is keyed by Redmine instance, so it is shared by
+        all the projects of an instance.
+        """
+        cache_namespace = 'redmine-users:{}'.format(self.instance_url)
+        if self.cache is not None:
+            user = self.cache.get(
+                cache_namespace, user_id, max_age=self.user_cache_ttl)
+            if user is not None:
+                return user
+
+        try:
+            user = self.api.get('{}/users/{}.json'.format(
+                self.instance_url, user_id))
+        except HTTPError:
+            print("unable to retrieve user!")
+            return None
+
+        if self.cache is not None:
+            self.cache.set(cache_namespace, user_id, user)
+        return user
 
     def get_users_index(self, issue_ids=""):
         """ Returns dict index of users (by user id)
@@ -0,0 +1,141 @@
+""" Retry policy for Redmine and GitLab API requests
+"""
+
+import email.utils
+import logging
+import random
+import threading
+import time
+
+import requests
+import urllib3
+
+log = logging.getLogger(__name__)
+
+
+class RetryPolicy:
+    """ Decides whether a failed request is retried and how long to wait
+
+    Only transient failures are retried: connection errors, timeouts and the
+    status codes in ``RETRY_STATUSES``. Other 4xx errors can never succeed and
+    are raised immediately. Requests that are not idempotent (POST...) may
+    have been applied when they failed, sending them again could create an
+    issue or a note twice: they are only retried when the server surely did
+    not process them (``UNPROCESSED_STATUSES``, or no connection made).
+
+    Waits grow exponentially with full jitter, unless the server tells us how
+    long to wait through ``Retry-After`` or GitLab's ``RateLimit-Reset``.
+
+    The budget caps the total number of retries over the whole run; one
+    policy is meant to be shared by all the clients of a run.
+    """
+    RETRY_STATUSES = frozenset([408, 429, 500, 502, 503, 504])
+    RETRY_EXCEPTIONS = (
+        requests.ConnectionError,
+        requests.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+    )
+    IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+    UNPROCESSED_STATUSES = frozenset([429, 503])
+
+    DEFAULT_MAX_RETRIES = 5
+    DEFAULT_BACKOFF = 1.0
+    DEFAULT_MAX_BACKOFF = 60.0
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF,
+                 budget=None):
+        """
+        :param max_retries: retries allowed for a single request
+        :param backoff: base wait in seconds, doubled on every retry
+        :param max_backoff: upper bound of the computed wait in seconds
+        :param budget: retries allowed for the whole run, None for no limit
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget
+        self.retries_used = 0
+        self._lock = threading.Lock()
+
+    def is_retryable(self, exc, response=None, method='GET'):
+        idempotent = method.upper() in self.IDEMPOTENT_METHODS
+        if isinstance(exc, requests.HTTPError):
+            statuses = (self.RETRY_STATUSES if idempotent
+                        else self.UNPROCESSED_STATUSES)
+            return response is not None and response.status_code in statuses
+        if not idempotent:
+            return self.is_connect_error(exc)
+        return isinstance(exc, self.RETRY_EXCEPTIONS)
+
+    @staticmethod
+    def is_connect_error(exc):
+        """ Whether the request failed before being sent
+
+        requests raises a ConnectionError for these, and for the connections
+        lost once the request was sent; only the former wrap urllib3's
+        connection errors.
+        """
+        if isinstance(exc, requests.exceptions.ConnectTimeout):
+            return True
+        if not isinstance(exc, requests.ConnectionError) or not exc.args:
+            return False
+        reason = getattr(exc.args[0], 'reason', None)
+        return isinstance(reason, urllib3.exceptions.ConnectTimeoutError)
+
+    def should_retry(self, attempt, exc, response=None, method='GET'):
+        """ Returns True if the request may be sent again
+
+        Consumes one unit of the run budget when it does.
+
+        :param attempt: number of retries already done for this request
+        :param method: HTTP method of the request
+        """
+        if attempt >= self.max_retries or \
+                not self.is_retryable(exc, response, method):
+            return False
+        with self._lock:
+            if self.budget is not None and self.retries_used >= self.budget:
+                log.warning('Retry budget of {} exhausted'.format(self.budget))
+                return False
+            self.retries_used += 1
+        return True
+
+    def delay(self, attempt, response=None):
+        """ Seconds to wait before the given retry
+        """
+        server_delay = self.server_delay(response)
+        if server_delay is not None:
+            return server_delay
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    @staticmethod
+    def server_delay(response):
+        """ Wait requested by the server, None if it did not ask for any
+        """
+        if response is None:
+            return None
+
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                pass
+            try:
+                date = email.utils.parsedate_to_datetime(retry_after)
+            except (TypeError, ValueError):
+                date = None
+            if date is not None:
+                return max(0.0, date.timestamp() - time.time())
+
+        # GitLab sends RateLimit-Reset as an epoch timestamp once throttled
+        if response.headers.get('RateLimit-Remaining') == '0':
+            try:
+                reset = float(response.headers['RateLimit-Reset'])
+            except (KeyError, ValueError):
+                return None
+            return max(0.0, reset - time.time())
+
+        return None
@@ -0,0 +1,232 @@
+""" Offline copy of a Redmine project
+
+A snapshot is written once by the ``export`` command, then read by the other
+commands in place of a live Redmine, so that dry runs and re-runs don't send a
+single request to Redmine.
+"""
+
+import json
+import logging
+import sqlite3
+import zlib
+from datetime import datetime, timezone
+
+from requests.exceptions import HTTPError
+
+from .redmine import participant_ids
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS issues (
+    id INTEGER PRIMARY KEY,
+    updated_on TEXT,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS versions (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS wiki_pages (
+    title TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    updated_on TEXT,
+    data BLOB NOT NULL,
+    PRIMARY KEY (title, version)
+);
+"""
+
+
+def _dump(obj):
+    return zlib.compress(json.dumps(obj).encode('utf-8'))
+
+
+def _load(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+class Snapshot:
+    """ SQLite file holding issues, users, versions and wiki pages
+
+    Objects are stored as compressed JSON, exactly as the Redmine API returned
+    them, and indexed by their Redmine ids.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def get_meta(self, key):
+        row = self.conn.execute(
+            'SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+    def add_issue(self, issue):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO issues VALUES (?, ?, ?)',
+            (issue['id'], issue.get('updated_on'), _dump(issue)))
+
+    def add_user(self, user):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO users VALUES (?, ?)',
+            (user['id'], _dump(user)))
+
+    def add_version(self, version, position):
+        """ :param position: rank of the version in the redmine API listing
+        """
+        self.conn.execute(
+            'INSERT OR REPLACE INTO versions VALUES (?, ?, ?)',
+            (version['id'], position, _dump(version)))
+
+    def add_page(self, page):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO wiki_pages VALUES (?, ?, ?, ?)',
+            (page['title'], page['version'], page.get('updated_on'),
+             _dump(page)))
+
+    def iter_issues(self, issue_ids=None, updated_since=None):
+        """ Yields issues sorted by id
+
+        :param issue_ids: optional iterable of ids to restrict to
+        :param updated_since: optional redmine timestamp, only the issues
+            updated on or after it are yielded
+        """
+        rows = self.conn.execute(
+            'SELECT id, data FROM issues'
+            ' WHERE ? IS NULL OR updated_on >= ? ORDER BY id',
+            (updated_since, updated_since))
+        wanted = set(issue_ids) if issue_ids else None
+        for issue_id, data in rows:
+            if wanted is None or issue_id in wanted:
+                yield _load(data)
+
+    def get_user(self, user_id):
+        row = self.conn.execute(
+            'SELECT data FROM users WHERE id = ?', (user_id,)).fetchone()
+        return _load(row[0]) if row else None
+
+    def get_versions(self):
+        return [_load(data) for data, in self.conn.execute(
+            'SELECT data FROM versions ORDER BY position')]
+
+    def get_page(self, title, version):
+        row = self.conn.execute(
+            'SELECT data FROM wiki_pages WHERE title = ? AND version = ?',
+            (title, version)).fetchone()
+        if row is None:
+            raise KeyError('No version {} of wiki page {} in {}'.format(
+                version, title, self.path))
+        return _load(row[0])
+
+    def get_latest_pages(self):
+        return [_load(data) for data, in self.conn.execute(
+            'SELECT data FROM wiki_pages AS p WHERE version = ('
+            ' SELECT MAX(version) FROM wiki_pages WHERE title = p.title)'
+            ' ORDER BY title')]
+
+    def export(self, redmine_project, wiki=True, wiki_history=True):
+        """ Copies a Redmine project into the snapshot
+
+        :param redmine_project: a RedmineProject
+        :param wiki: whether wiki pages are exported
+        :param wiki_history: whether every version of the pages is exported,
+            not only the latest one
+        """
+        with self.conn:
+            self.set_meta('project_url', redmine_project.public_url)
+            self.set_meta('instance_url', redmine_project.instance_url)
+            self.set_meta('exported_at', datetime.now(timezone.utc).isoformat())
+
+            log.info('Exporting issues')
+            for issue in redmine_project.get_issues():
+                self.add_issue(issue)
+
+            log.info('Exporting users')
+            for user in redmine_project.get_participants():
+                self.add_user(user)
+
+            log.info('Exporting versions')
+            for position, version in enumerate(redmine_project.get_versions()):
+                self.add_version(version, position)
+
+            if wiki:
+                log.info('Exporting wiki pages')
+                self._export_wiki(redmine_project, wiki_history)
+
+    def _export_wiki(self, redmine_project, wiki_history):
+        try:
+            pages = redmine_project.get_all_pages()
+        except HTTPError as e:
+            log.warning("Can't export wiki, skipping it: {}".format(e))
+            return
+
+        for page in pages:
+            start_version = 1 if wiki_history else page['version']
+            for version in range(start_version, page['version'] + 1):
+                try:
+                    self.add_page(
+                        redmine_project.get_page(page['title'], version))
+                except HTTPError:
+                    log.exception('Error when retrieving {}, version {}'.format(
+                        page['title'], version))
+
+
+class SnapshotProject:
+    """ Read-only RedmineProject stand-in, reading from a Snapshot
+    """
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.public_url = snapshot.get_meta('project_url')
+        self.instance_url = snapshot.get_meta('instance_url')
+        self.api_url = '{}.json'.format(self.public_url)
+
+    @staticmethod
+    def _parse_issue_ids(issue_ids):
+        if not issue_ids:
+            return None
+        return [int(i) for i in issue_ids.split(',') if i.strip()]
+
+    def iter_issues(self, issue_ids="", updated_since=None):
+        return self.snapshot.iter_issues(
+            self._parse_issue_ids(issue_ids), updated_since)
+
+    def get_issues(self, issue_ids="", updated_since=None):
+        if not hasattr(self, '_cache_issues'):
+            self._cache_issues = list(
+                self.iter_issues(issue_ids, updated_since))
+        return self._cache_issues
+
+    def get_participants(self, issue_ids=""):
+        users = (self.snapshot.get_user(i)
+                 for i in sorted(participant_ids(self.get_issues(issue_ids))))
+        return [i for i in users if i is not None]
+
+    def get_users_index(self, issue_ids=""):
+        """ Returns dict index of users (by user id)
+        """
+        return {i['id']: i for i in self.get_participants(issue_ids)}
+
+    def get_versions(self):
+        return self.snapshot.get_versions()
+
+    def get_all_pages(self):
+        return self.snapshot.get_latest_pages()
+
+    def get_page(self, title, version):
+        return self.snapshot.get_page(title, version)
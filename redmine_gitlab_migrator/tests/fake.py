@@ -1,3 +1,9 @@
+import json
+import re
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
 JOHN = {
     "id": 1,
     "username": "john_smith",
@@ -159,8 +165,18 @@ REDMINE_ISSUE_1439 = {
 
 
 class FakeGitlabClient:
+    def get_object(self, url):
+        return self.get(url)
+
+    def iter_get(self, url):
+        return iter(self.get(url))
+
     def get(self, url):
-        if url.endswith('/users'):
+        if '/users?username=' in url:
+            username = url.split('/users?username=')[1]
+            return [i for i in (JOHN, JACK) if i['username'] == username]
+
+        elif url.endswith('/users'):
             return [JOHN, JACK]
 
         elif url.endswith('api/v4/projects') or url.endswith('api/v4/projects?owned=true'):
@@ -440,13 +456,74 @@ class FakeGitlabClient:
             raise ValueError('No test data for {}'.format(url))
 
 
+class FakeGitlabNotesServer:
+    """ Stand-in for the gitlab notes API, by REST and GraphQL
+
+    To be used as the request() of a GitlabClient session. Notes are
+    recorded as (issue, body, author) in the order they are created: by REST
+    for the issue iid in the URL, by GraphQL createNote mutations (run one
+    after the other) for the issue id in their noteableId. As with GitLab,
+    GraphQL requests can't be impersonated, and empty notes are refused.
+    """
+    REGEX_NOTES_URL = re.compile(r'/issues/(\d+)/notes$')
+    REGEX_MUTATION = re.compile(r'(\w+): createNote\(input: \$(\w+)\)')
+    REGEX_ISSUE_GID = re.compile(r'^gid://gitlab/Issue/(\d+)$')
+
+    def __init__(self, username='root'):
+        self.username = username
+        self.notes = []
+        self.requests = []
+
+    def request(self, method, url, data=None, json=None, headers=None, **kwargs):
+        headers = headers or {}
+        self.requests.append((method, url))
+        if url.endswith('/api/graphql'):
+            if 'SUDO' in headers:
+                return self.response({'errors': [
+                    {'message': 'Sudo is not supported by GraphQL'}]})
+            return self.response(self.graphql(json['query'], json['variables']))
+
+        match = self.REGEX_NOTES_URL.search(url)
+        if method != 'POST' or not match:
+            raise ValueError('No test data for {} {}'.format(method, url))
+        if not data['body']:
+            return self.response({'message': "Note can't be blank"}, 400)
+        author = headers.get('SUDO') or self.username
+        self.notes.append((int(match.group(1)), data['body'], author))
+        return self.response({'id': len(self.notes), 'body': data['body']}, 201)
+
+    def graphql(self, query, variables):
+        if not query.startswith('mutation'):
+            return {'errors': [{'message': 'Only mutations are supported'}]}
+        data = {}
+        for alias, variable in self.REGEX_MUTATION.findall(query):
+            note = variables[variable]
+            issue = self.REGEX_ISSUE_GID.match(note['noteableId'])
+            if not issue:
+                data[alias] = {'errors': ['Invalid noteable']}
+            elif not note['body']:
+                data[alias] = {'errors': ["Note can't be blank"]}
+            else:
+                self.notes.append(
+                    (int(issue.group(1)), note['body'], self.username))
+                data[alias] = {'note': {'body': note['body']}, 'errors': []}
+        return {'data': data}
+
+    @staticmethod
+    def response(data, status_code=200):
+        resp = requests.Response()
+        resp.status_code = status_code
+        resp._content = json.dumps(data).encode()
+        return resp
+
+
 class FakeRedmineClient:
     def unpaginated_get(self, url):
         if '/projects/puppet/issues.json' in url:
             return []
 
         elif '/projects/diaspora-site/issues.json' in url:
-            return [
+            issues = [
                 {
                     "closed_on": "2015-09-09T15:54:49Z",
                     "updated_on": "2015-09-09T15:54:49Z",
@@ -525,6 +602,11 @@ class FakeRedmineClient:
                     "id": 1439
                 },
             ]
+            updated_since = parse_qs(urlsplit(url).query).get('updated_on')
+            if updated_since:
+                return [i for i in issues
+                        if i['updated_on'] >= updated_since[0][2:]]
+            return issues
 
         else:
             raise ValueError('{} is unknown data test'.format(url))
@@ -611,6 +693,28 @@ class FakeRedmineClient:
                 'total_count': 2,
             }
 
+        elif url.endswith('/projects/diaspora-site/wiki/index.json'):
+            return [
+                {
+                    "title": "Wiki",
+                    "version": 2,
+                    "created_on": "2015-04-03T14:56:08Z",
+                    "updated_on": "2015-04-04T10:00:00Z"
+                }
+            ]
+
+        elif '/projects/diaspora-site/wiki/Wiki/' in url:
+            version = int(url.rsplit('/', 1)[1].split('.')[0])
+            return {
+                "title": "Wiki",
+                "text": "h1. Diaspora\n\nVersion {}".format(version),
+                "version": version,
+                "author": {"id": 83, "name": "John Smith"},
+                "comments": "",
+                "created_on": "2015-04-03T14:56:08Z",
+                "updated_on": "2015-04-0{}T10:00:00Z".format(2 + version)
+            }
+
         elif url.endswith('/users/83.json'):
             return {
                 "id": 83,
@@ -635,3 +739,57 @@ class FakeRedmineClient:
 
         else:
             raise ValueError('{} is unknown data test'.format(url))
+
+
+# Redmine descriptions and notes, covering what TextileConverter handles
+TEXTILE_SAMPLES = [
+    "",
+    "The doc is a bit old",
+    "Appliqué par commit commit:66cbf9571ed501c6d38a5978f8a27e7b1aa35268.",
+    "h1. Title\n\nSome *bold* and _emphasized_ text, @inline code@.",
+    "h2. Install\n\n# first\n# second\n## nested\n\n* a\n** b\n* c",
+    "p. An explicit paragraph.\n\np>. Right aligned",
+    "<pre>\ndef f():\n    return 1\n</pre>\n\nAfter the code",
+    '<pre><code class="Python">\nprint(1)\n</code></pre>',
+    "  indented code\n  on two lines\n\nnot code",
+    "bc. single line block code",
+    "bc.. extended\n\nblock code",
+    "|_. a |_. b |\n| 1 | 2 |\n| 3 | 4 |",
+    "See [[Some Page]] and [[Other Page|the other one]].",
+    '"a link":http://example.com and http://example.org',
+    "{{tip(be careful)}}\n\n{{warning(really)}}\n\n{{toc}}",
+    "{{collapse(Details)\nhidden text\n}}",
+    'See attachment:"screenshot.png" for details',
+    "> quoted reply\n> on two lines\n\nanswer",
+    "A long line that pandoc will have to wrap because it goes far beyond the "
+    "seventy-two columns of markdown output, twice over, with more words.",
+    "Footnote reference[1].\n\nfn1. The footnote.",
+    "Unclosed <pre>\ncode",
+    "Line one\nline two\r\nline three",
+    "Special chars: * _ # < > & ` \\ | [ ] { }",
+    "!image.png!\n\n!http://example.com/image.png!",
+    "-deleted- +inserted+ ^sup^ ~sub~ ??citation??",
+]
+
+# Redmine notes without any markup
+PLAIN_TEXT_SAMPLES = [
+    "Fixed",
+    "Done, thanks!",
+    "Works for me. Can you check again?",
+    "Closing: no answer since a month",
+    " Leading and trailing spaces  ",
+    "Two\nlines",
+    "Two paragraphs\n\n\nwith extra blank lines\n \nand a blank line with a space",
+    "Merci, ça marche très bien maintenant. Bonne journée",
+    "This note is long enough to be wrapped by pandoc at seventy two columns, "
+    "so the fast path has to wrap it at exactly the same place, on every line "
+    "of this paragraph, even with averyveryveryveryveryveryveryveryveryveryvery"
+    "veryveryveryverylongword in it.",
+    # 71 and 72 characters before a line break: pandoc counts the two spaces
+    # of the hard line break in the line width
+    "Thanks for the report, I reproduced it on the staging server this night\nWill fix",
+    "Thanks for the report, I reproduced it on the staging server this nights\nWill fix",
+    "Wrapped over two lines before a line break, the last word of the second one "
+    "is the one carried to the third line now\nend",
+    "",
+]
@@ -0,0 +1,59 @@
+""" Stand-in for `pandoc server`, converting with the pandoc command
+
+    python fake_pandoc_server.py --port PORT [--timeout SECONDS]
+
+As pandoc server, conversions taking more than the timeout (2 seconds by
+default) fail.
+"""
+
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pypandoc
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/version':
+            self.send_error(404)
+            return
+        self.reply(200, 'text/plain', pypandoc.get_pandoc_version())
+
+    def do_POST(self):
+        params = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        start = time.monotonic()
+        try:
+            output = pypandoc.convert_text(
+                params['text'], params['to'], format=params['from'])
+        except RuntimeError as e:
+            self.reply(500, 'text/plain', str(e))
+            return
+        if time.monotonic() - start > self.server.conversion_timeout:
+            self.reply(200, 'application/json', json.dumps({'error': 'Timeout'}))
+            return
+        # pandoc server does not end the text with a newline
+        self.reply(200, 'application/json', json.dumps(
+            {'output': output.rstrip('\n'), 'base64': False, 'messages': []}))
+
+    def reply(self, status, content_type, body):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--timeout', type=int, default=2)
+    args = parser.parse_args()
+    server = HTTPServer(('127.0.0.1', args.port), Handler)
+    server.conversion_timeout = args.timeout
+    server.serve_forever()
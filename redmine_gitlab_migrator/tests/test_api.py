@@ -0,0 +1,226 @@
+import json
+import time
+import unittest
+from unittest import mock
+
+import requests
+import urllib3
+
+from redmine_gitlab_migrator.redmine import RedmineClient
+from redmine_gitlab_migrator.gitlab import GitlabClient
+from redmine_gitlab_migrator.ratelimit import RateLimiter, TokenBucket
+from redmine_gitlab_migrator.retry import RetryPolicy
+
+
+def make_response(status_code=200, data=None, headers=None):
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp.headers.update(headers or {})
+    resp._content = json.dumps(data).encode() if data is not None else b''
+    return resp
+
+
+class APIClientTestCase(unittest.TestCase):
+    def test_session_auth_headers_set_once(self):
+        redmine = RedmineClient('rkey', True)
+        gitlab = GitlabClient('gkey', False)
+        self.assertEqual(redmine.session.headers['X-Redmine-API-Key'], 'rkey')
+        self.assertEqual(gitlab.session.headers['PRIVATE-TOKEN'], 'gkey')
+        self.assertIs(redmine.session.verify, True)
+        self.assertIs(gitlab.session.verify, False)
+
+    def test_pool_size(self):
+        client = RedmineClient('rkey', True, pool_size=3)
+        adapter = client.session.get_adapter('https://redmine.example.com')
+        self.assertEqual(adapter._pool_maxsize, 3)
+
+    def test_requests_go_through_session(self):
+        client = GitlabClient('gkey', True)
+        with mock.patch.object(
+                client.session, 'request',
+                return_value=make_response(data={'id': 1})) as request:
+            ret = client.put('http://gitlab/issues/1', {'state_event': 'close'})
+        self.assertEqual(ret, {'id': 1})
+        request.assert_called_once_with(
+            'PUT', 'http://gitlab/issues/1', data={'state_event': 'close'})
+
+    @mock.patch('redmine_gitlab_migrator.time.sleep')
+    def test_retry_transient_error(self, sleep):
+        client = GitlabClient('gkey', True)
+        responses = [
+            make_response(429, headers={'Retry-After': '7'}),
+            make_response(502),
+            make_response(data=[]),
+        ]
+        with mock.patch.object(client.session, 'request',
+                               side_effect=responses) as request:
+            self.assertEqual(client.get('http://gitlab/users'), [])
+        self.assertEqual(request.call_count, 3)
+        self.assertEqual(sleep.call_args_list[0], mock.call(7.0))
+
+    @mock.patch('redmine_gitlab_migrator.time.sleep')
+    def test_post_not_retried_once_maybe_applied(self, sleep):
+        client = GitlabClient('gkey', True)
+        with mock.patch.object(client.session, 'request',
+                               return_value=make_response(502)) as request:
+            with self.assertRaises(requests.HTTPError):
+                client.post('http://gitlab/issues', {'title': 'Doc'})
+        self.assertEqual(request.call_count, 1)
+
+    @mock.patch('redmine_gitlab_migrator.time.sleep')
+    def test_no_retry_on_client_error(self, sleep):
+        client = GitlabClient('gkey', True)
+        with mock.patch.object(client.session, 'request',
+                               return_value=make_response(404)) as request:
+            with self.assertRaises(requests.HTTPError):
+                client.get('http://gitlab/users')
+        self.assertEqual(request.call_count, 1)
+        sleep.assert_not_called()
+
+
+    def test_gitlab_pages_fetched_in_parallel(self):
+        client = GitlabClient('gkey', True, page_workers=3)
+        client.MAX_PER_PAGE = 2
+
+        def request(method, url, params, **kwargs):
+            items = list(range(5))[(params['page'] - 1) * 2:params['page'] * 2]
+            return make_response(data=items, headers={'X-Total-Pages': '3'})
+
+        with mock.patch.object(client.session, 'request',
+                               side_effect=request) as session_request:
+            self.assertEqual(client.get('http://gitlab/users'), [0, 1, 2, 3, 4])
+        self.assertEqual(session_request.call_count, 3)
+
+    def test_gitlab_pages_without_total(self):
+        client = GitlabClient('gkey', True)
+        client.MAX_PER_PAGE = 2
+
+        def request(method, url, params, **kwargs):
+            items = list(range(4))[(params['page'] - 1) * 2:params['page'] * 2]
+            return make_response(data=items)
+
+        with mock.patch.object(client.session, 'request',
+                               side_effect=request) as session_request:
+            self.assertEqual(client.get('http://gitlab/users'), [0, 1, 2, 3])
+        self.assertEqual(session_request.call_count, 3)
+
+
+    def test_gitlab_iter_get_keyset(self):
+        client = GitlabClient('gkey', True)
+        responses = [
+            make_response(data=[1, 2], headers={
+                'Link': '<http://gitlab/api/v4/users?cursor=abc>; rel="next"'}),
+            make_response(data=[3]),
+        ]
+        with mock.patch.object(client.session, 'request',
+                               side_effect=responses) as request:
+            users = client.iter_get('http://gitlab/api/v4/users')
+            self.assertEqual(next(users), 1)
+            self.assertEqual(request.call_count, 1)
+            self.assertEqual(list(users), [2, 3])
+        first, second = request.call_args_list
+        self.assertEqual(first.kwargs['params']['pagination'], 'keyset')
+        self.assertEqual(
+            second.args, ('GET', 'http://gitlab/api/v4/users?cursor=abc'))
+
+    def test_gitlab_iter_get_offset(self):
+        client = GitlabClient('gkey', True)
+        responses = [
+            make_response(data=[1], headers={'X-Next-Page': '2'}),
+            make_response(data=[2], headers={'X-Next-Page': ''}),
+        ]
+        with mock.patch.object(client.session, 'request',
+                               side_effect=responses) as request:
+            self.assertEqual(
+                list(client.iter_get('http://gitlab/api/v4/projects/1/issues')),
+                [1, 2])
+        self.assertNotIn('pagination', request.call_args_list[0].kwargs['params'])
+        self.assertEqual(request.call_args_list[1].kwargs['params']['page'], '2')
+
+    def test_gitlab_single_object_get(self):
+        client = GitlabClient('gkey', True)
+        project = {str(i): i for i in range(client.MAX_PER_PAGE)}
+        with mock.patch.object(client.session, 'request',
+                               return_value=make_response(data=project)) as request:
+            self.assertEqual(client.get('http://gitlab/api/v4/projects/1'), project)
+            self.assertEqual(
+                client.get_object('http://gitlab/api/v4/projects/1'), project)
+        self.assertEqual(request.call_count, 2)
+        self.assertIsNone(request.call_args_list[1].kwargs['params'])
+
+
+class RetryPolicyTestCase(unittest.TestCase):
+    def test_classification(self):
+        policy = RetryPolicy()
+        for status, expected in ((429, True), (503, True), (400, False),
+                                 (404, False)):
+            resp = make_response(status)
+            self.assertEqual(policy.is_retryable(
+                requests.HTTPError(response=resp), resp), expected)
+        self.assertTrue(policy.is_retryable(requests.ConnectionError()))
+        self.assertFalse(policy.is_retryable(requests.exceptions.InvalidURL()))
+
+    def test_classification_of_non_idempotent_requests(self):
+        policy = RetryPolicy()
+        for status, expected in ((429, True), (503, True), (502, False),
+                                 (500, False), (504, False)):
+            resp = make_response(status)
+            self.assertEqual(policy.is_retryable(
+                requests.HTTPError(response=resp), resp, 'POST'), expected)
+            self.assertTrue(policy.is_retryable(
+                requests.HTTPError(response=resp), resp, 'PUT'))
+        refused = requests.ConnectionError(urllib3.exceptions.MaxRetryError(
+            None, '/', urllib3.exceptions.NewConnectionError(None, 'refused')))
+        lost = requests.ConnectionError(
+            urllib3.exceptions.ProtocolError('Connection aborted.'))
+        for exc, expected in ((refused, True), (lost, False),
+                              (requests.exceptions.ConnectTimeout(), True),
+                              (requests.exceptions.ReadTimeout(), False),
+                              (requests.exceptions.ChunkedEncodingError(), False)):
+            self.assertEqual(policy.is_retryable(exc, method='POST'), expected, exc)
+            self.assertTrue(policy.is_retryable(exc, method='GET'), exc)
+
+    def test_max_retries_and_budget(self):
+        error = requests.ConnectionError()
+        policy = RetryPolicy(max_retries=2, budget=3)
+        self.assertTrue(policy.should_retry(0, error))
+        self.assertTrue(policy.should_retry(1, error))
+        self.assertFalse(policy.should_retry(2, error))
+        self.assertTrue(policy.should_retry(0, error))
+        # budget is spent, even for a fresh request
+        self.assertFalse(policy.should_retry(0, error))
+
+    def test_delay(self):
+        policy = RetryPolicy(backoff=2, max_backoff=5)
+        self.assertLessEqual(policy.delay(0), 2)
+        self.assertLessEqual(policy.delay(10), 5)
+        resp = make_response(429, headers={
+            'RateLimit-Remaining': '0',
+            'RateLimit-Reset': str(int(time.time()) + 30)})
+        self.assertAlmostEqual(policy.delay(0, resp), 30, delta=2)
+
+
+class RateLimiterTestCase(unittest.TestCase):
+    def test_token_bucket_burst_then_wait(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        # bucket is empty: the next tokens are due every 1/rate seconds
+        self.assertAlmostEqual(bucket.reserve(), 0.1, delta=0.01)
+        self.assertAlmostEqual(bucket.reserve(), 0.2, delta=0.01)
+
+    def test_buckets_per_host_and_kind(self):
+        limiter = RateLimiter(rate=5, write_rate=1)
+        limiter.acquire('GET', 'http://redmine/issues.json')
+        limiter.acquire('POST', 'http://gitlab/api/v4/projects/1/issues')
+        self.assertEqual(sorted(limiter._buckets), [
+            ('gitlab', 'all'), ('gitlab', 'write'), ('redmine', 'all')])
+
+    def test_client_requests_are_limited(self):
+        limiter = mock.Mock()
+        client = GitlabClient('gkey', True, rate_limiter=limiter)
+        with mock.patch.object(client.session, 'request',
+                               return_value=make_response(data={})):
+            client.post('http://gitlab/api/v4/projects/1/issues')
+        limiter.acquire.assert_called_once_with(
+            'POST', 'http://gitlab/api/v4/projects/1/issues')
@@ -0,0 +1,238 @@
+from concurrent.futures import Future
+import io
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+from .test_api import make_response
+from redmine_gitlab_migrator.attachments import (
+    ByteLimit, MultipartUpload, UploadCache, UploadPool, download, lookahead)
+from redmine_gitlab_migrator.cache import DiskCache
+from redmine_gitlab_migrator.gitlab import GitlabClient, GitlabProject
+
+
+class MultipartUploadTestCase(unittest.TestCase):
+    def test_same_body_as_requests(self):
+        content = bytes(range(256)) * 100
+        body = MultipartUpload('file', 'schéma.png', io.BytesIO(content), 'image/png')
+        boundary = body.content_type.split('boundary=')[1]
+        with mock.patch('urllib3.filepost.choose_boundary', return_value=boundary):
+            expected = requests.Request(
+                'POST', 'http://gitlab/uploads',
+                files={'file': ('schéma.png', content, 'image/png')}).prepare()
+        self.assertEqual(body.read(), expected.body)
+        self.assertEqual(body.len, len(expected.body))
+        self.assertEqual(expected.headers['Content-Type'], body.content_type)
+
+    def test_replayable(self):
+        body = MultipartUpload('file', 'a.txt', io.BytesIO(b'abc' * 1000), 'text/plain')
+        first = b''.join(iter(lambda: body.read(100), b''))
+        body.seek(0)
+        self.assertEqual(body.read(), first)
+        self.assertEqual(body.tell(), body.len)
+
+    def test_streamed_by_requests(self):
+        body = MultipartUpload('file', 'a.txt', io.BytesIO(b'abc'), 'text/plain')
+        prepared = requests.Request(
+            'POST', 'http://gitlab/uploads', data=body,
+            headers={'Content-Type': body.content_type}).prepare()
+        self.assertIs(prepared.body, body)
+        self.assertEqual(prepared.headers['Content-Length'], str(body.len))
+
+
+class DownloadTestCase(unittest.TestCase):
+    def download(self, content, max_memory_size):
+        with mock.patch('redmine_gitlab_migrator.attachments.urlopen',
+                        return_value=io.BytesIO(content)):
+            return download('http://redmine/attachments/1', max_memory_size)
+
+    def test_small_file_in_memory(self):
+        with self.download(b'abc', 10) as spool:
+            self.assertFalse(spool._rolled)
+            self.assertEqual(spool.read(), b'abc')
+
+    def test_large_file_on_disk(self):
+        with self.download(b'abc' * 10, 10) as spool:
+            self.assertTrue(spool._rolled)
+            self.assertEqual(spool.read(), b'abc' * 10)
+
+
+class RetriedUploadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = GitlabClient('gkey', True)
+        self.bodies = []
+
+    def request(self, responses):
+        def request(method, url, data=None, **kwargs):
+            self.bodies.append(data.read())
+            return responses.pop(0)
+        return request
+
+    @mock.patch('redmine_gitlab_migrator.time.sleep')
+    def test_body_rewound_on_retry(self, sleep):
+        body = MultipartUpload('file', 'a.txt', io.BytesIO(b'abc'), 'text/plain')
+        responses = [make_response(503), make_response(data={'markdown': 'md'})]
+        with mock.patch.object(self.client.session, 'request',
+                               side_effect=self.request(responses)):
+            self.assertEqual(self.client.post('http://gitlab/uploads', data=body),
+                             {'markdown': 'md'})
+        self.assertEqual(len(self.bodies), 2)
+        self.assertEqual(self.bodies[0], self.bodies[1])
+
+    @mock.patch('redmine_gitlab_migrator.time.sleep')
+    def test_no_retry_of_unseekable_body(self, sleep):
+        class Unseekable(io.BytesIO):
+            def seekable(self):
+                return False
+
+        responses = [make_response(503), make_response(data={})]
+        with mock.patch.object(self.client.session, 'request',
+                               side_effect=self.request(responses)):
+            with self.assertRaises(requests.HTTPError):
+                self.client.post('http://gitlab/uploads', data=Unseekable(b'abc'))
+        self.assertEqual(len(self.bodies), 1)
+
+    def test_project_upload_downloads_once(self):
+        project = GitlabProject('http://gitlab/root/project', self.client)
+        project.instance_data = {'id': 3}
+        responses = [make_response(400), make_response(data={'markdown': '[ä](/u)'})]
+        uploads = [{'filename': 'ä.txt', 'content_url': 'http://redmine/1',
+                    'content_type': 'text/plain', 'description': 'desc'}]
+        with mock.patch('redmine_gitlab_migrator.attachments.urlopen',
+                        return_value=io.BytesIO(b'abc')) as urlopen, \
+                mock.patch.object(self.client.session, 'request',
+                                  side_effect=self.request(responses)):
+            self.assertEqual(project.uploads_to_string(uploads), '[ä](/u) desc')
+        urlopen.assert_called_once_with('http://redmine/1')
+        self.assertIn('filename="ä.txt"'.encode(), self.bodies[0])
+        self.assertIn(b'filename=" .txt"', self.bodies[1])
+        self.assertIn(b'\r\n\r\nabc\r\n', self.bodies[1])
+
+
+class UploadCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = GitlabClient('gkey', True)
+        self.project = GitlabProject('http://gitlab/root/project', self.client)
+        self.contents = {'http://redmine/1': b'png', 'http://redmine/2': b'png',
+                         'http://redmine/3': b'other', 'http://redmine/4': b'png'}
+        self.uploaded = []
+
+    def urlopen(self, url):
+        return io.BytesIO(self.contents[url])
+
+    def request(self, method, url, data=None, **kwargs):
+        body = data.read()
+        self.uploaded.append(body)
+        return make_response(data={'markdown': '[a.png](/uploads/{}/a.png)'.format(
+            len(self.uploaded))})
+
+    def migrate(self, uploads):
+        with mock.patch('redmine_gitlab_migrator.attachments.urlopen',
+                        side_effect=self.urlopen) as urlopen, \
+                mock.patch.object(self.client.session, 'request',
+                                  side_effect=self.request):
+            text = self.project.uploads_to_string(uploads)
+        return text, urlopen.call_count
+
+    @staticmethod
+    def attachment(id, filename='a.png'):
+        return {'id': id, 'filename': filename, 'description': '',
+                'content_url': 'http://redmine/{}'.format(id),
+                'content_type': 'image/png'}
+
+    def test_same_content_uploaded_once(self):
+        text, downloads = self.migrate([
+            self.attachment(1), self.attachment(2), self.attachment(3),
+            self.attachment(4, 'b.png')])
+        self.assertEqual(downloads, 4)
+        # 2 and 4 have the content of 1; under another name, it is uploaded again
+        self.assertEqual(len(self.uploaded), 3)
+        self.assertEqual(text.split('\n  * ')[:3], [
+            '[a.png](/uploads/1/a.png) ', '[a.png](/uploads/1/a.png) ',
+            '[a.png](/uploads/2/a.png) '])
+
+    def test_same_attachment_not_downloaded_again(self):
+        self.migrate([self.attachment(1)])
+        text, downloads = self.migrate([self.attachment(1)])
+        self.assertEqual(downloads, 0)
+        self.assertEqual(len(self.uploaded), 1)
+        self.assertEqual(text, '[a.png](/uploads/1/a.png) ')
+
+    def test_kept_between_runs(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            self.project.upload_cache = UploadCache(DiskCache(cache_dir), 'project 3')
+            self.migrate([self.attachment(1)])
+            self.project.upload_cache = UploadCache(DiskCache(cache_dir), 'project 3')
+            self.assertEqual(self.migrate([self.attachment(1)]),
+                             ('[a.png](/uploads/1/a.png) ', 0))
+            # Recreated project
+            self.project.upload_cache = UploadCache(DiskCache(cache_dir), 'project 4')
+            self.assertEqual(self.migrate([self.attachment(1)]),
+                             ('[a.png](/uploads/2/a.png) ', 1))
+
+
+class UploadPoolTestCase(unittest.TestCase):
+    def test_byte_limit(self):
+        limit = ByteLimit(10)
+        acquired = threading.Event()
+
+        def reserve():
+            with limit.reserve(6):
+                acquired.set()
+
+        with limit.reserve(6):
+            blocked = threading.Thread(target=reserve)
+            blocked.start()
+            self.assertFalse(acquired.wait(0.05))
+            with limit.reserve(4):
+                self.assertEqual(limit.used, 10)
+        blocked.join()
+        self.assertTrue(acquired.is_set())
+        self.assertEqual(limit.used, 0)
+        # Too large for the limit, waits for all other transfers
+        with ByteLimit(10).reserve(100):
+            pass
+
+    def test_transfers_within_size(self):
+        in_transfer = []
+        peak = []
+
+        def upload(u):
+            in_transfer.append(u['filesize'])
+            peak.append(sum(in_transfer))
+            time.sleep(0.01)
+            in_transfer.remove(u['filesize'])
+            return u['filename']
+
+        pool = UploadPool(upload, workers=4, max_size=10)
+        try:
+            futures = pool.submit([{'filename': str(i), 'filesize': 4} for i in range(8)])
+            self.assertEqual([i.result() for i in futures], [str(i) for i in range(8)])
+        finally:
+            pool.shutdown()
+        self.assertEqual(max(peak), 8)
+
+    def test_lookahead(self):
+        started = []
+        items = lookahead(range(5), 2, lambda i: started.append(i) or -i)
+        self.assertEqual(next(items), (0, 0))
+        self.assertEqual(started, [0, 1, 2])
+        self.assertEqual(list(items), [(1, -1), (2, -2), (3, -3), (4, -4)])
+
+    def test_issue_created_with_prefetched_uploads(self):
+        project = GitlabProject('http://gitlab/root/project', mock.Mock())
+        project.api.post.return_value = {'iid': 1}
+        meta = {'notes': [], 'must_close': False,
+                'uploads': [{'description': 'first'}, {'description': 'second'}],
+                'human_time_estimate': None, 'human_total_time_spent': None}
+        futures = [Future(), Future()]
+        futures[0].set_result('[a](/uploads/a)')
+        futures[1].set_result(None)
+        data = {'description': 'Text'}
+        project.create_issue(data, meta, {}, uploads=futures)
+        self.assertEqual(data['description'],
+                         'Text\n* Uploads:\n  * [a](/uploads/a) first')
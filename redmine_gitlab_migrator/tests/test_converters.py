@@ -1,8 +1,21 @@
+import copy
+import json
+import os
+import pickle
+import tempfile
 import unittest
+from functools import partial
+from unittest import mock
 
-from .fake import JOHN, JACK, REDMINE_ISSUE_1439, REDMINE_ISSUE_1732
+import pypandoc
+
+from .fake import (
+    JOHN, JACK, PLAIN_TEXT_SAMPLES, REDMINE_ISSUE_1439, REDMINE_ISSUE_1732,
+    TEXTILE_SAMPLES)
+from redmine_gitlab_migrator.cache import DiskCache
 from redmine_gitlab_migrator.converters import (
-    convert_issue, convert_version, relations_to_string)
+    convert_issue, convert_issues, convert_version, prefetch_conversions,
+    relations_to_string)
 from redmine_gitlab_migrator.wiki import TextileConverter
 
 
@@ -149,3 +162,184 @@ class ConvertorTestCase(unittest.TestCase):
         self.assertEqual(
             relations_to_string([], [], 5, 2),
             '  * parent #5')
+
+
+class TextileBatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.converter = TextileConverter()
+
+    def test_convert_many_agrees_with_convert(self):
+        expected = [self.converter.convert(i) for i in TEXTILE_SAMPLES]
+        self.assertEqual(self.converter.convert_many(TEXTILE_SAMPLES), expected)
+
+    def test_convert_many_single_pandoc_run(self):
+        texts = ['h1. Title', 'Some *bold*', 'plain']
+        with mock.patch('pypandoc.convert_text',
+                        wraps=pypandoc.convert_text) as convert_text:
+            converted = self.converter.convert_many(texts)
+        self.assertEqual(convert_text.call_count, 1)
+        self.assertEqual(converted, ['# Title\n', 'Some **bold**\n', 'plain\n'])
+
+    def test_convert_many_falls_back(self):
+        texts = ['h1. Title', '*bold*']
+        with mock.patch('pypandoc.convert_text',
+                        side_effect=[RuntimeError, '# Title\n', '**bold**\n']):
+            self.assertEqual(self.converter.convert_many(texts),
+                             ['# Title\n', '**bold**\n'])
+
+    def test_prefetch_conversions(self):
+        issues = [REDMINE_ISSUE_1439, REDMINE_ISSUE_1732]
+        with mock.patch.object(self.converter, 'prefetch',
+                               wraps=self.converter.prefetch) as prefetch:
+            self.assertEqual(
+                list(prefetch_conversions(issues, self.converter, 1)), issues)
+        self.assertEqual(prefetch.call_count, 2)
+        with mock.patch('pypandoc.convert_text') as convert_text:
+            self.assertEqual(
+                self.converter.convert(REDMINE_ISSUE_1732['description']),
+                'The doc is a bit old\n')
+        convert_text.assert_not_called()
+
+
+class TextileCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cache = DiskCache(tmp_dir.name)
+        self.addCleanup(self.cache.close)
+
+    def test_memory_cache(self):
+        converter = TextileConverter(memory_cache_size=2)
+        with mock.patch('pypandoc.convert_text',
+                        wraps=pypandoc.convert_text) as convert_text:
+            for text in ('*Fixed*', '*Fixed*', '*Done*', '*Fixed*', '_Other_', '*Done*'):
+                converter.convert(text)
+        # '*Done*' was evicted by '_Other_', as '*Fixed*' was used more recently
+        self.assertEqual(convert_text.call_count, 4)
+        self.assertEqual(converter.convert('*Fixed*'), '**Fixed**\n')
+
+    def test_disk_cache_across_runs(self):
+        TextileConverter(cache=self.cache).prefetch(['_Fixed_', '*Done*'])
+        converter = TextileConverter(cache=self.cache)
+        with mock.patch('pypandoc.convert_text') as convert_text:
+            self.assertEqual(converter.convert('*Done*'), '**Done**\n')
+            converter.prefetch(['_Fixed_', '*Done*'])
+        convert_text.assert_not_called()
+
+    def test_disk_cache_per_pandoc_version(self):
+        TextileConverter(cache=self.cache).convert('*Done*')
+        with mock.patch('pypandoc.get_pandoc_version', return_value='99.0'):
+            converter = TextileConverter(cache=self.cache)
+        with mock.patch('pypandoc.convert_text',
+                        return_value='**Done**\n') as convert_text:
+            converter.convert('*Done*')
+        convert_text.assert_called_once()
+
+
+class TextileFastPathTestCase(unittest.TestCase):
+    def setUp(self):
+        self.converter = TextileConverter()
+
+    def pandoc(self, text):
+        return self.converter.postprocess(pypandoc.convert_text(
+            self.converter.preprocess(text), 'markdown_strict', format='textile'))
+
+    def test_plain_texts_skip_pandoc(self):
+        for text in PLAIN_TEXT_SAMPLES:
+            self.assertTrue(
+                self.converter.is_plain_text(self.converter.preprocess(text)),
+                text)
+        with mock.patch('pypandoc.convert_text') as convert_text:
+            for text in PLAIN_TEXT_SAMPLES:
+                self.converter.convert(text)
+        convert_text.assert_not_called()
+
+    def test_fast_path_agrees_with_pandoc(self):
+        for text in PLAIN_TEXT_SAMPLES + TEXTILE_SAMPLES:
+            self.assertEqual(self.converter.convert(text), self.pandoc(text), text)
+
+    def test_markup_is_not_plain(self):
+        for text in ('"quoted"', "it's", 'a -- b', '(c) 2020', 'wait...',
+                     '1. item', 'a. item', 'iv. item', 'h2. Title', '!img.png!',
+                     'snake_case', '50%', 'tab\there', '日本語'):
+            self.assertFalse(self.converter.is_plain_text(text), text)
+
+
+class PidDiskCache(DiskCache):
+    """ Remembers the process which opened its connection
+    """
+    def __init__(self, cache_dir):
+        super().__init__(cache_dir)
+        self.pid = os.getpid()
+
+
+def cache_opened_by(redmine_issue, textile_converter):
+    return textile_converter.cache.pid, os.getpid()
+
+
+class ConvertIssuesTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cache = DiskCache(tmp_dir.name)
+        self.addCleanup(self.cache.close)
+
+        self.issues = []
+        for i in range(7):
+            issue = copy.deepcopy([REDMINE_ISSUE_1439, REDMINE_ISSUE_1732][i % 2])
+            issue['id'] = i
+            issue['description'] = TEXTILE_SAMPLES[i]
+            self.issues.append(issue)
+        self.convert = partial(
+            convert_issue, redmine_api_key='<redmine_api_key>',
+            redmine_user_index={}, gitlab_user_index={'root': JOHN},
+            gitlab_milestones_index={}, closed_states=['closed'],
+            custom_fields_include=[],
+            textile_converter=TextileConverter(cache=self.cache),
+            migrator_user='root', keep_title=False, sudo=True,
+            archive_acc=None)
+
+    def test_process_pool_gives_same_results(self):
+        expected = [self.convert(redmine_issue=i) for i in self.issues]
+        self.assertEqual(
+            list(convert_issues(self.issues, self.convert, workers=2,
+                                batch_size=2)),
+            expected)
+        self.assertEqual(
+            list(convert_issues(self.issues, self.convert)), expected)
+
+    def test_workers_open_their_own_cache(self):
+        cache = PidDiskCache(os.path.dirname(self.cache.path))
+        self.addCleanup(cache.close)
+        convert = partial(cache_opened_by,
+                          textile_converter=TextileConverter(cache=cache))
+        for opened_by, worker in convert_issues(
+                self.issues, convert, workers=2, batch_size=2):
+            self.assertNotEqual(worker, os.getpid())
+            self.assertEqual(opened_by, worker)
+
+    def test_converter_pickles_with_its_cache(self):
+        converter = pickle.loads(pickle.dumps(self.convert.keywords['textile_converter']))
+        converter.convert('*Done*')
+        self.assertEqual(self.cache.get(
+            converter.cache_namespace, converter.cache_key('*Done*')),
+            '**Done**\n')
+
+
+class PostprocessTestCase(unittest.TestCase):
+    GOLDEN = os.path.join(os.path.dirname(__file__), 'golden', 'postprocess.json')
+
+    def setUp(self):
+        self.converter = TextileConverter()
+
+    def test_golden_outputs(self):
+        # [pandoc output, expected postprocess() output] pairs
+        with open(self.GOLDEN, encoding='utf-8') as f:
+            golden = json.load(f)
+        for text, expected in golden:
+            self.assertEqual(self.converter.postprocess(text), expected, text)
+
+    def test_every_occurrence_rewritten(self):
+        text = '\\[\\[Page\\]\\] {{tip(x)}} {{toc}}\n' * 30
+        self.assertEqual(self.converter.postprocess(text),
+                         '[Page](Page) ---\n**TIP**: x\n---\n toc\n' * 30)
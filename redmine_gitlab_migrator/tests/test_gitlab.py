@@ -1,7 +1,13 @@
+import threading
+import time
 import unittest
+from unittest import mock
 
-from .fake import FakeGitlabClient
-from redmine_gitlab_migrator.gitlab import GitlabInstance, GitlabProject
+from .fake import FakeGitlabClient, FakeGitlabNotesServer, JOHN
+from redmine_gitlab_migrator.gitlab import (
+    CreationAborted, CreationOrder, GitlabClient, GitlabInstance, GitlabProject,
+    GitlabUserResolver, GraphQLError)
+from redmine_gitlab_migrator.journal import IssueProgress
 
 
 class GitlabinstanceTestCase(unittest.TestCase):
@@ -20,6 +26,23 @@ class GitlabinstanceTestCase(unittest.TestCase):
         self.assertEqual(
             gitlab.check_users_exist([]), True)
 
+    def test_user_resolver(self):
+        gitlab = GitlabInstance('http://localhost:3000', self.client)
+        resolver = GitlabUserResolver(gitlab, concurrency=2)
+        with mock.patch.object(self.client, 'get',
+                               wraps=self.client.get) as get:
+            self.assertEqual(
+                resolver.resolve(['john_smith', 'babar']),
+                {'john_smith': JOHN})
+            self.assertEqual(get.call_count, 2)
+            # known and unknown users are both memoized
+            self.assertEqual(
+                sorted(resolver.resolve(['john_smith', 'babar', 'jack_smith'])),
+                ['jack_smith', 'john_smith'])
+            self.assertEqual(get.call_count, 3)
+            self.assertNotIn('http://localhost:3000/users',
+                             [c.args[0] for c in get.call_args_list])
+
 
 class GitlabprojectTestCase(unittest.TestCase):
     def setUp(self):
@@ -41,6 +64,144 @@ class GitlabprojectTestCase(unittest.TestCase):
         self.assertEqual(len(self.project_1.get_issues()), 2)
         self.assertEqual(len(self.project_2.get_issues()), 0)
 
+    def test_migrated_issues_index(self):
+        issues = [
+            {'iid': 1, 'description': 'Doc\n\n*(from redmine: issue id 1732, '
+                                      'created on 2015-08-21)*\n'},
+            {'iid': 2, 'description': 'Created in gitlab'},
+            {'iid': 3, 'description': None},
+        ]
+        with mock.patch.object(self.client, 'iter_get',
+                               return_value=iter(issues)):
+            index = self.project_1.get_migrated_issues_index()
+        self.assertEqual(index, {1732: issues[0]})
+
+    def test_update_issue(self):
+        issue = {
+            'iid': 7, 'state': 'opened',
+            'description': 'Old\n* Uploads:\n  * [a.png](/uploads/1/a.png) ',
+            'time_stats': {'time_estimate': 3600, 'total_time_spent': 1800},
+        }
+        data = {'title': 'Doc', 'description': 'New',
+                'created_at': '2015-08-21T13:29:41Z'}
+        meta = {
+            'notes': [({'body': 'old note'}, {}), ({'body': 'new note'}, {})],
+            'must_close': True,
+            'uploads': [{'filename': 'a.png'}],
+            'human_time_estimate': 1,
+            'human_total_time_spent': 1,
+        }
+        api = mock.Mock()
+        api.get.return_value = [{'body': 'old note'}]
+        self.project_1.api = api
+        self.project_1.update_issue(issue, data, meta, {})
+
+        issue_url = '{}/issues/7'.format(self.project_1.api_url)
+        api.put.assert_called_once_with(issue_url, data={
+            'title': 'Doc', 'state_event': 'close',
+            'description': 'New\n* Uploads:\n  * [a.png](/uploads/1/a.png) '})
+        self.assertEqual(api.post.call_args_list, [
+            mock.call('{}/notes'.format(issue_url),
+                      data={'body': 'new note'}, headers={}),
+            mock.call('{}/add_spent_time?duration=1800s'.format(issue_url)),
+        ])
+
+    def create_with_quick_actions(self, time_stats, note_meta,
+                                  saved_note=lambda body: body.replace('\n\n/close', ''),
+                                  state='closed'):
+        """ :param saved_note: body of a note as saved by gitlab, from the
+            one sent; returns None for a response without body
+        """
+        meta = {
+            'notes': [({'body': 'first'}, {}), ({'body': 'last'}, note_meta)],
+            'must_close': True, 'uploads': [],
+            'human_time_estimate': 2.0, 'human_total_time_spent': 1.5,
+        }
+
+        def post(url, data=None, headers=None):
+            if url.endswith('/issues'):
+                issue = {'iid': 5, 'id': 105, 'description': data['description']}
+                if time_stats is not None:
+                    issue['time_stats'] = time_stats
+                return issue
+            if url.endswith('/notes'):
+                body = saved_note(data['body'])
+                return {} if body is None else {'body': body}
+            return {}
+
+        api = mock.Mock()
+        api.post.side_effect = post
+        api.get_object.return_value = {'iid': 5, 'state': state}
+        self.project_1.api = api
+        self.project_1.quick_actions = True
+        self.project_1.create_issue({'title': 'Doc', 'description': 'Text'}, meta, {})
+        return api, '{}/issues'.format(self.project_1.api_url)
+
+    def test_create_issue_with_quick_actions(self):
+        api, issues_url = self.create_with_quick_actions(
+            {'time_estimate': 7200, 'total_time_spent': 5400}, {})
+        self.assertEqual(api.post.call_args_list, [
+            mock.call(issues_url, data={
+                'title': 'Doc',
+                'description': 'Text\n\n/estimate 2.0h\n/spend 1.5h'}, headers={}),
+            mock.call('{}/5/notes'.format(issues_url),
+                      data={'body': 'first'}, headers={}),
+            mock.call('{}/5/notes'.format(issues_url),
+                      data={'body': 'last\n\n/close'}, headers={}),
+        ])
+        api.put.assert_not_called()
+        api.get_object.assert_not_called()
+        self.assertEqual(self.project_1.quick_actions_stats,
+                         {'issues': 1, 'saved_requests': 3})
+
+    def test_close_quick_action_not_applied(self):
+        # Left in the saved note, eg: in an unclosed code block
+        api, issues_url = self.create_with_quick_actions(
+            {'time_estimate': 7200, 'total_time_spent': 5400}, {},
+            saved_note=lambda body: body)
+        api.put.assert_called_once_with(
+            '{}/5'.format(issues_url), {'state_event': 'close'})
+        self.assertEqual(self.project_1.quick_actions_stats,
+                         {'issues': 1, 'saved_requests': 2})
+
+    def test_close_quick_action_checked_on_issue(self):
+        for state, put_calls in (('closed', 0), ('opened', 1)):
+            api, issues_url = self.create_with_quick_actions(
+                {'time_estimate': 7200, 'total_time_spent': 5400}, {},
+                saved_note=lambda body: None, state=state)
+            api.get_object.assert_called_once_with('{}/5'.format(issues_url))
+            self.assertEqual(api.put.call_count, put_calls)
+
+    def test_quick_actions_fallback(self):
+        # Time tracking not applied, last note posted as another user
+        api, issues_url = self.create_with_quick_actions(
+            {'time_estimate': 0, 'total_time_spent': 0}, {'sudo_user': 'john'})
+        self.assertEqual(api.post.call_args_list[2:], [
+            mock.call('{}/5/notes'.format(issues_url),
+                      data={'body': 'last'}, headers={'SUDO': 'john'}),
+            mock.call('{}/5/time_estimate?duration=2.0h'.format(issues_url)),
+            mock.call('{}/5/add_spent_time?duration=1.5h'.format(issues_url)),
+        ])
+        self.assertEqual(api.put.call_args_list, [
+            mock.call('{}/5'.format(issues_url), data={'description': 'Text'},
+                      headers={}),
+            mock.call('{}/5'.format(issues_url), {'state_event': 'close'}),
+        ])
+        self.assertEqual(self.project_1.quick_actions_stats,
+                         {'issues': 1, 'saved_requests': -1})
+
+    def test_quick_actions_left_in_description(self):
+        # Issue created by a user not allowed to set time tracking
+        api, issues_url = self.create_with_quick_actions(None, {})
+        description = api.put.call_args_list[0].kwargs['data']['description']
+        self.assertEqual(description, 'Text')
+        self.assertNotIn('/estimate', description)
+        self.assertNotIn('/spend', description)
+        self.assertEqual(api.post.call_args_list[3:], [
+            mock.call('{}/5/time_estimate?duration=2.0h'.format(issues_url)),
+            mock.call('{}/5/add_spent_time?duration=1.5h'.format(issues_url)),
+        ])
+
     def test_members(self):
         self.assertEqual(
             self.project_1.has_members(['john_smith', 'jack_smith']),
@@ -52,3 +213,104 @@ class GitlabprojectTestCase(unittest.TestCase):
         self.assertEqual(
             self.project_1.has_members([]),
             True)
+
+
+class GraphQLNotesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeGitlabNotesServer()
+        client = GitlabClient('gkey', True)
+        client.session.request = self.server.request
+        self.project = GitlabProject('http://gitlab/root/project', client)
+        self.project.graphql_notes = 2
+        self.issue_url = '{}/issues/12'.format(self.project.api_url)
+
+    def create_notes(self, notes, progress=None, issue_id=12):
+        self.project.create_notes(
+            self.issue_url, [({'body': body}, meta) for body, meta in notes],
+            {}, progress, issue_id=issue_id)
+
+    def test_batched_in_order(self):
+        notes = [('1', {}), ('2', {}), ('3', {'sudo_user': 'john'}),
+                 ('4', {}), ('5', {}), ('6', {'sudo_user': None})]
+        progress = IssueProgress()
+        self.create_notes(notes, progress)
+        self.assertEqual(self.server.notes, [
+            (12, '1', 'root'), (12, '2', 'root'), (12, '3', 'john'),
+            (12, '4', 'root'), (12, '5', 'root'), (12, '6', 'root')])
+        graphql_url = 'http://gitlab/api/graphql'
+        self.assertEqual([url for method, url in self.server.requests], [
+            graphql_url, '{}/notes'.format(self.issue_url), graphql_url,
+            graphql_url])
+        self.assertEqual(progress['notes'], 6)
+
+    def test_rest_without_issue_id(self):
+        self.create_notes([('1', {}), ('2', {})], issue_id=None)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.notes, [(12, '1', 'root'), (12, '2', 'root')])
+
+    def test_failed_note(self):
+        progress = IssueProgress(steps={'notes': 1})
+        with self.assertRaises(GraphQLError):
+            self.create_notes([('1', {}), ('2', {}), ('', {}), ('4', {})], progress)
+        # Created up to the failed note, and the next run resumes from there
+        self.assertEqual(self.server.notes, [(12, '2', 'root')])
+        self.assertEqual(progress['notes'], 2)
+
+
+class CreationOrderTestCase(unittest.TestCase):
+    def run_turns(self, turns, body):
+        threads = [threading.Thread(target=body, args=(i, turn))
+                   for i, turn in reversed(list(enumerate(turns)))]
+        for i in threads:
+            i.start()
+            time.sleep(0.01)
+        for i in threads:
+            i.join()
+
+    def test_turns_in_order(self):
+        order = CreationOrder()
+        turns = [order.next_turn() for i in range(4)]
+        created = []
+
+        def create(i, turn):
+            with turn:
+                created.append(i)
+
+        self.run_turns(turns, create)
+        self.assertEqual(created, [0, 1, 2, 3])
+
+    def test_failed_turn_aborts_next_ones(self):
+        order = CreationOrder()
+        turns = [order.next_turn() for i in range(3)]
+        errors = {}
+
+        def create(i, turn):
+            try:
+                with turn:
+                    if i == 1:
+                        raise ValueError(i)
+            except Exception as e:
+                errors[i] = type(e)
+
+        self.run_turns(turns, create)
+        self.assertEqual(errors, {1: ValueError, 2: CreationAborted})
+
+    def test_create_issue_waits_for_its_turn(self):
+        order = CreationOrder()
+        first, second = order.next_turn(), order.next_turn()
+        project = GitlabProject(
+            'http://localhost:3000/diaspora/diaspora-project-site',
+            mock.Mock())
+        project.api.post.return_value = {'iid': 1}
+        meta = {'notes': [], 'must_close': False, 'uploads': [],
+                'human_time_estimate': None, 'human_total_time_spent': None}
+
+        thread = threading.Thread(target=project.create_issue, args=(
+            {'description': ''}, meta, {}, None, second))
+        thread.start()
+        time.sleep(0.05)
+        project.api.post.assert_not_called()
+        with first:
+            pass
+        thread.join()
+        project.api.post.assert_called_once()
@@ -0,0 +1,79 @@
+import tempfile
+import unittest
+from unittest import mock
+
+from redmine_gitlab_migrator.cache import DiskCache
+from redmine_gitlab_migrator.gitlab import GitlabProject
+from redmine_gitlab_migrator.journal import MigrationJournal
+
+
+class MigrationJournalTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cache_dir = tmp_dir.name
+        self.journal = self.open_journal()
+
+        self.project = GitlabProject(
+            'http://localhost:3000/diaspora/diaspora-project-site',
+            mock.Mock())
+        self.api = self.project.api
+        self.api.post.side_effect = self.fake_post
+        self.api.get_object.return_value = {'iid': 5, 'title': 'Doc'}
+
+        self.data = {'title': 'Doc', 'description': 'The doc is a bit old'}
+        self.meta = {
+            'notes': [({'body': 'one'}, {}), ({'body': 'two'}, {})],
+            'must_close': True,
+            'uploads': [],
+            'human_time_estimate': 2,
+            'human_total_time_spent': None,
+        }
+
+    def open_journal(self):
+        cache = DiskCache(self.cache_dir)
+        self.addCleanup(cache.close)
+        return MigrationJournal(
+            cache, 'http://localhost:9000/projects/diaspora-site',
+            'http://localhost:3000/diaspora/diaspora-project-site')
+
+    def fake_post(self, url, data=None, headers=None):
+        if url.endswith('/issues'):
+            return {'iid': 5, 'title': data['title']}
+        if data == {'body': 'two'}:
+            raise RuntimeError('Interrupted')
+
+    def test_progress_persisted(self):
+        with self.assertRaises(RuntimeError):
+            self.project.create_issue(
+                dict(self.data), self.meta, {}, self.journal.get(1732))
+
+        # As seen by the next run
+        progress = self.open_journal().get(1732)
+        self.assertEqual(progress, {
+            'uploads': '', 'creating': True, 'iid': 5, 'notes': 1})
+        self.assertEqual(self.open_journal().get(1439), {})
+
+    def test_resume(self):
+        with self.assertRaises(RuntimeError):
+            self.project.create_issue(
+                dict(self.data), self.meta, {}, self.journal.get(1732))
+
+        self.api.post.reset_mock()
+        self.api.post.side_effect = None
+        issue = self.project.create_issue(
+            dict(self.data), self.meta, {}, self.open_journal().get(1732))
+
+        self.assertEqual(issue['iid'], 5)
+        issue_url = '{}/issues/5'.format(self.project.api_url)
+        self.assertEqual(self.api.post.call_args_list, [
+            mock.call('{}/notes'.format(issue_url),
+                      data={'body': 'two'}, headers={}),
+            mock.call('{}/time_estimate?duration=2h'.format(issue_url)),
+        ])
+        self.assertTrue(self.open_journal().get(1732)['done'])
+
+    def test_clear(self):
+        self.journal.get(1732).save(iid=5)
+        self.journal.clear()
+        self.assertEqual(self.open_journal().get(1732), {})
@@ -0,0 +1,95 @@
+import os
+import pickle
+import sys
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from .fake import TEXTILE_SAMPLES
+from redmine_gitlab_migrator.pandoc import PandocServer, PandocServerWorker
+from redmine_gitlab_migrator.wiki import TextileConverter
+
+FAKE_SERVER = [
+    sys.executable, os.path.join(os.path.dirname(__file__), 'fake_pandoc_server.py')]
+
+
+class PandocServerTestCase(unittest.TestCase):
+    def make_server(self, workers=2, command=FAKE_SERVER):
+        server = PandocServer(workers=workers, command=command)
+        self.addCleanup(server.close)
+        return server
+
+    def processes(self, server):
+        return [i.process for i in server._idle.queue if i.alive()]
+
+    def test_agrees_with_pandoc_command(self):
+        converter = TextileConverter(engine=self.make_server())
+        for text in TEXTILE_SAMPLES:
+            self.assertEqual(converter._convert(text),
+                             TextileConverter()._convert(text), text)
+
+    def test_started_lazily(self):
+        server = self.make_server()
+        self.assertEqual(self.processes(server), [])
+        self.assertEqual(server.convert('*Done*'), '**Done**\n')
+        self.assertEqual(len(self.processes(server)), 1)
+
+    def test_no_process_per_conversion(self):
+        server = self.make_server(workers=1)
+        server.convert('*Done*')
+        with mock.patch('pypandoc.convert_text') as convert_text:
+            server.convert('_Fixed_')
+        convert_text.assert_not_called()
+
+    def test_concurrent_workers(self):
+        server = self.make_server(workers=2)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            converted = list(executor.map(server.convert, ['*Done*'] * 8))
+        self.assertEqual(converted, ['**Done**\n'] * 8)
+        self.assertLessEqual(len(self.processes(server)), 2)
+
+    def test_restarts_dead_worker(self):
+        server = self.make_server(workers=1)
+        server.convert('*Done*')
+        process, = self.processes(server)
+        process.kill()
+        process.wait()
+        self.assertEqual(server.convert('_Fixed_'), '*Fixed*\n')
+        self.assertNotEqual(self.processes(server), [process])
+
+    def test_server_timeout(self):
+        server = self.make_server(workers=1)
+        server.convert('*Done*')
+        process, = self.processes(server)
+        self.assertEqual(process.args[-2:], [
+            '--timeout', str(PandocServerWorker.REQUEST_TIMEOUT)])
+
+    def test_failed_conversion_retried_with_pandoc_command(self):
+        server = self.make_server(workers=1)
+        # Every conversion exceeds the server timeout
+        with mock.patch.object(PandocServerWorker, 'REQUEST_TIMEOUT', 0):
+            with self.assertLogs('redmine_gitlab_migrator.pandoc', 'WARNING') as logs:
+                self.assertEqual(server.convert('*Done*'), '**Done**\n')
+        self.assertIn('Timeout', logs.output[0])
+        self.assertIsNone(server._fallback)
+
+    def test_falls_back_to_pandoc_command(self):
+        server = self.make_server(command=[sys.executable, '-c', 'pass'])
+        with self.assertLogs('redmine_gitlab_migrator.pandoc', 'WARNING'):
+            self.assertEqual(server.convert('*Done*'), '**Done**\n')
+        self.assertEqual(server.convert('_Fixed_'), '*Fixed*\n')
+
+    def test_pickled_without_processes(self):
+        server = self.make_server()
+        server.convert('*Done*')
+        copy = pickle.loads(pickle.dumps(server))
+        self.addCleanup(copy.close)
+        self.assertEqual(self.processes(copy), [])
+        self.assertEqual(copy.convert('*Done*'), '**Done**\n')
+
+    def test_close(self):
+        server = self.make_server()
+        server.convert('*Done*')
+        process, = self.processes(server)
+        server.close()
+        self.assertIsNotNone(process.poll())
@@ -1,7 +1,50 @@
+import tempfile
 import unittest
+from unittest import mock
 
 from .fake import FakeRedmineClient
-from redmine_gitlab_migrator.redmine import RedmineProject
+from redmine_gitlab_migrator.cache import DiskCache
+from redmine_gitlab_migrator.redmine import RedmineClient, RedmineProject
+
+
+def paginated_response(total_count, offset, limit):
+    return {
+        'issues': [{'id': i} for i in range(
+            offset, min(total_count, offset + limit))],
+        'total_count': total_count, 'offset': offset, 'limit': limit,
+    }
+
+
+class RedmineClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = RedmineClient('rkey', True)
+        self.client.PAGE_MAX_SIZE = 2
+
+    def fake_get(self, url, params):
+        return paginated_response(5, params.get('offset', 0), params['limit'])
+
+    def test_unpaginated_get_is_lazy(self):
+        with mock.patch.object(self.client, 'get',
+                               side_effect=self.fake_get) as get:
+            items = self.client.unpaginated_get(
+                'http://localhost:9000/issues.json')
+            get.assert_not_called()
+            self.assertEqual(next(items), {'id': 0})
+            self.assertEqual(get.call_count, 1)
+            self.assertEqual([i['id'] for i in items], [1, 2, 3, 4])
+            self.assertEqual(get.call_count, 3)
+
+    def test_unpaginated_get_parallel_pages(self):
+        self.client.page_workers = 3
+        with mock.patch.object(self.client, 'get',
+                               side_effect=self.fake_get) as get:
+            items = self.client.unpaginated_get(
+                'http://localhost:9000/issues.json')
+            self.assertEqual([i['id'] for i in items], [0, 1, 2, 3, 4])
+        self.assertEqual(
+            sorted(c.kwargs['params'].get('offset', 0)
+                   for c in get.call_args_list),
+            [0, 2, 4])
 
 
 class RedmineTestCase(unittest.TestCase):
@@ -17,6 +60,21 @@ class RedmineTestCase(unittest.TestCase):
         self.assertEqual(len(issues[0].get('journals', [])), 0)
         self.assertEqual(len(issues[1].get('journals', [])), 2)
 
+    def test_get_issues_concurrent(self):
+        project = RedmineProject(
+            'http://localhost:9000/projects/diaspora-site',
+            self.client, concurrency=4)
+        issues = project.get_issues()
+        self.assertEqual([i['id'] for i in issues], [1439, 1732])
+        self.assertIs(project.get_issues(), issues)
+
+    def test_get_issues_updated_since(self):
+        project = RedmineProject(
+            'http://localhost:9000/projects/diaspora-site',
+            self.client)
+        issues = project.get_issues(updated_since='2015-09-01T00:00:00Z')
+        self.assertEqual([i['id'] for i in issues], [1732])
+
     def test_get_participants(self):
         project_1 = RedmineProject(
             'http://localhost:9000/projects/diaspora-site',
@@ -30,6 +88,28 @@ class RedmineTestCase(unittest.TestCase):
         self.assertIn('@', project_1.get_participants()[0]['mail'])
         self.assertEqual(len(project_2.get_participants()), 0)
 
+    def test_participants_cached_on_disk(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            def participants(cache, ttl=3600):
+                project = RedmineProject(
+                    'http://localhost:9000/projects/diaspora-site',
+                    self.client, concurrency=2, cache=cache, user_cache_ttl=ttl)
+                return project.get_participants()
+
+            with mock.patch.object(self.client, 'get',
+                                   wraps=self.client.get) as get:
+                users = participants(DiskCache(cache_dir))
+                self.assertEqual([i['id'] for i in users], [3, 83])
+                fetched = get.call_count
+
+                # a new run reuses the cached users...
+                self.assertEqual(participants(DiskCache(cache_dir)), users)
+                self.assertEqual(get.call_count, fetched + 2)  # issue details
+
+                # ...until they expire
+                participants(DiskCache(cache_dir), ttl=0)
+                self.assertEqual(get.call_count, 2 * fetched + 2)
+
     def test_get_versions(self):
         project = RedmineProject(
             'http://localhost:9000/projects/diaspora-site',
@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from .fake import FakeRedmineClient
+from redmine_gitlab_migrator.redmine import RedmineProject
+from redmine_gitlab_migrator.snapshot import Snapshot, SnapshotProject
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeRedmineClient()
+        self.project = RedmineProject(
+            'http://localhost:9000/projects/diaspora-site', self.client)
+
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, 'snapshot.sqlite')
+
+        snapshot = Snapshot(self.path)
+        snapshot.export(self.project)
+        snapshot.close()
+
+        self.snapshot = Snapshot(self.path)
+        self.addCleanup(self.snapshot.close)
+        self.offline = SnapshotProject(self.snapshot)
+
+    def test_same_data_as_redmine(self):
+        self.assertEqual(self.offline.public_url, self.project.public_url)
+        self.assertEqual(self.offline.get_issues(), self.project.get_issues())
+        self.assertEqual(self.offline.get_users_index(),
+                         self.project.get_users_index())
+        self.assertEqual(self.offline.get_versions(),
+                         self.project.get_versions())
+
+    def test_no_request_once_exported(self):
+        with mock.patch.object(self.client, 'get') as get, \
+                mock.patch.object(self.client, 'unpaginated_get') as listing:
+            self.offline.get_issues()
+            self.offline.get_participants()
+            self.offline.get_all_pages()
+        get.assert_not_called()
+        listing.assert_not_called()
+
+    def test_issue_ids_filter(self):
+        self.assertEqual(
+            [i['id'] for i in self.offline.get_issues('1732')], [1732])
+        self.assertEqual(
+            [i['id'] for i in self.offline.iter_issues()], [1439, 1732])
+
+    def test_wiki_history(self):
+        pages = self.offline.get_all_pages()
+        self.assertEqual([(i['title'], i['version']) for i in pages],
+                         [('Wiki', 2)])
+        self.assertEqual(self.offline.get_page('Wiki', 1)['text'],
+                         'h1. Diaspora\n\nVersion 1')
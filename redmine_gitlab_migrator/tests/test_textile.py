@@ -0,0 +1,102 @@
+import pickle
+import unittest
+from unittest import mock
+
+from .fake import PLAIN_TEXT_SAMPLES
+from redmine_gitlab_migrator.engines import ENGINES, make_engine
+from redmine_gitlab_migrator.pandoc import PandocProcess
+from redmine_gitlab_migrator.textile import TextileEngine, textile_to_markdown
+from redmine_gitlab_migrator.wiki import TextileConverter
+
+# textile, and its conversion by pandoc
+PANDOC_CONVERSIONS = [
+    ('h2. Install\n\n# first\n# second\n## nested\n\n* a\n** b\n* c',
+     '## Install\n\n1.  first\n2.  second\n    1.  nested\n\n- a\n  - b\n- c\n'),
+    ('Some @code@ and *bold* and _it_ and **b2** and __i2__ and -strike- '
+     'and +ins+ and ^sup^ and ~sub~',
+     'Some `code` and **bold** and *it* and **b2** and *i2* and <s>strike</s>\n'
+     'and <u>ins</u> and <sup>sup</sup> and <sub>sub</sub>\n'),
+    ('"link text":http://example.com and "with title(tt)":http://x.org/a?b=c, '
+     'and http://plain.url/x',
+     '[link text](http://example.com) and [with\n'
+     'title(tt)](http://x.org/a?b=c), and http://plain.url/x\n'),
+    ('!image.png! and !http://x/y.png(alt)!',
+     '![](image.png) and ![alt](http://x/y.png "alt")\n'),
+    ('bq. quoted text\nsecond line', '> quoted text  \n> second line\n'),
+    ('bc. code block\nline 2', '    code block\n    line 2\n'),
+    ('bc.. multi\n\npara\n\np. end', '    multi\n\n    para\n\nend\n'),
+    ('<pre>\nraw pre\n  indented\n</pre>', '    raw pre\n      indented\n'),
+    ('|_. head |_. h2 |\n| a | b |',
+     '<table>\n<thead>\n<tr>\n<th>head</th>\n<th>h2</th>\n</tr>\n</thead>\n'
+     '<tbody>\n<tr>\n<td>a</td>\n<td>b</td>\n</tr>\n</tbody>\n</table>\n'),
+    ('* one\n\n* two', '- one\n\n<!-- -->\n\n- two\n'),
+    ('Text\n* list directly after', 'Text\n\n- list directly after\n'),
+    ('# long item ' + 'word ' * 20,
+     '1.  long item word word word word word word word word word word word\n'
+     '    word word word word word word word word word\n'),
+    ('Text with * star and _ underscore and [brackets] and # hash and <tag> & amp',
+     'Text with \\* star and \\_ underscore and \\[brackets\\] and \\# hash and\n'
+     '<tag> & amp\n'),
+    ('Special chars: * _ # < > & ` \\ | [ ] { }',
+     'Special chars: \\* \\_ \\# &lt; &gt; & \\` \\\\ | \\[ \\] { }\n'),
+    ('He said "hello" and it\'s fine -- really...',
+     'He said “hello” and it’s fine — really…\n'),
+    ('1. not a list\n2) also', '1\\. not a list  \n2) also\n'),
+    ('(*bold*) and snake *bold_part* x',
+     '(\\*bold\\*) and snake **bold\\_part** x\n'),
+    ('----\n\nafter rule', '-' * 72 + '\n\nafter rule\n'),
+    ('{{toc}}\n\n{{tip(be careful)}}', '{{toc}}\n\n{{tip(be careful)}}\n'),
+    ('', '\n'),
+]
+
+
+class TextileToMarkdownTestCase(unittest.TestCase):
+    def test_agrees_with_pandoc(self):
+        for text, converted in PANDOC_CONVERSIONS:
+            self.assertEqual(textile_to_markdown(text), converted, text)
+
+    def test_plain_texts(self):
+        converter = TextileConverter()
+        for text in PLAIN_TEXT_SAMPLES:
+            self.assertEqual(
+                textile_to_markdown(text),
+                converter.plain_text_to_markdown(converter.preprocess(text)),
+                text)
+
+    def test_wiki_links_left_to_postprocess(self):
+        self.assertEqual(textile_to_markdown('See [[Page|text]]'),
+                         'See \\[\\[Page|text\\]\\]\n')
+
+    def test_private_use_characters_kept(self):
+        self.assertEqual(textile_to_markdown('icon \ue000 here'), 'icon \ue000 here\n')
+        self.assertEqual(textile_to_markdown('\ue0005\ue001 and @code@'),
+                         '\ue0005\ue001 and `code`\n')
+
+    def test_token_characters_removed(self):
+        self.assertEqual(textile_to_markdown('\ufdd00\ufdd1 and @code@'),
+                         '0 and `code`\n')
+        self.assertEqual(textile_to_markdown('icon \ufdd0 here'), 'icon here\n')
+
+
+class ConversionEngineTestCase(unittest.TestCase):
+    def test_registry(self):
+        self.assertLessEqual({'pandoc', 'pandoc-server', 'python'}, set(ENGINES))
+        self.assertIsInstance(make_engine('python'), TextileEngine)
+        self.assertEqual(make_engine('pandoc-server', workers=3).workers, 3)
+        with self.assertRaises(ValueError):
+            make_engine('word')
+
+    def test_python_engine_runs_no_pandoc(self):
+        converter = TextileConverter(engine=make_engine('python'))
+        with mock.patch('pypandoc.convert_text') as convert_text:
+            self.assertEqual(
+                converter.convert_many(['h1. Title', 'Some *bold*']),
+                ['# Title\n', 'Some **bold**\n'])
+        convert_text.assert_not_called()
+        converter = pickle.loads(pickle.dumps(converter))
+        self.assertEqual(converter.convert('_Fixed_'), '*Fixed*\n')
+
+    def test_cached_per_engine(self):
+        self.assertNotEqual(
+            TextileConverter(engine=make_engine('python')).cache_namespace,
+            TextileConverter(engine=PandocProcess()).cache_namespace)
@@ -0,0 +1,365 @@
+""" Conversion of Redmine textile to markdown, in pure python
+
+Covers the textile Redmine users commonly write: headings, emphasis, code,
+links, images, lists, block quotes, code blocks, tables and textile
+typography. The markdown is written as pandoc writes markdown_strict (same
+escaping, line wrapping at 72 columns, hard line breaks...), so that the
+output goes through TextileConverter.postprocess() the same way.
+
+Less common textile (footnotes, link aliases, styled spans, block
+attributes...) is not converted and is left as text.
+"""
+
+import re
+import textwrap
+
+from .engines import ConversionEngine, register_engine
+
+COLUMNS = 72
+
+# Characters standing for a token (code span, link...) until it is rendered,
+# and for the spaces that must not be wrapped: Unicode noncharacters, removed
+# from the text beforehand
+TOKEN_START = '\ufdd0'
+TOKEN_END = '\ufdd1'
+NO_BREAK_SPACE = '\ufdd2'
+# Spaces of a hard line break, which pandoc counts in the width of the line
+HARD_BREAK = '\ufdd3\ufdd3'
+
+regexBlankLines = re.compile(r'\n(?:[ \t]*\n)+')
+regexPre = re.compile(r'^<pre>\n?(.*?)\n?</pre>[ \t]*', re.MULTILINE | re.DOTALL)
+regexBlockCode = re.compile(r'^bc(\.\.?) (.*)', re.DOTALL)
+regexBlockStart = re.compile(r'^(h[1-6]|bq|bc|p|fn\d+)(\([^)]*\)|\{[^}]*\}|\[[^\]]*\]|[<>=]+)*\.\.? ')
+regexHeading = re.compile(r'^h([1-6])(?:\([^)]*\)|\{[^}]*\}|\[[^\]]*\]|[<>=]+)*\. (.*)', re.DOTALL)
+regexBlockQuote = re.compile(r'^bq(?:\([^)]*\)|\{[^}]*\})*\. (.*)', re.DOTALL)
+regexParagraph = re.compile(r'^p(?:\([^)]*\)|\{[^}]*\}|\[[^\]]*\]|[<>=]+)*\. (.*)', re.DOTALL)
+regexListItem = re.compile(r'^([*#]+) (.*)')
+regexRule = re.compile(r'^-{4,}$')
+regexTableRow = re.compile(r'^\|.*\|$')
+regexTableCellAttributes = re.compile(r'^(_)?(?:[<>=^~]|\\\d+|/\d+|\([^)]*\)|\{[^}]*\})*\. ')
+
+regexCode = re.compile(r'@([^@\n]+)@')
+regexNoTextile = re.compile(r'<notextile>(.*?)</notextile>|==(.+?)==')
+regexLink = re.compile(r'"([^"\n]+)":((?:https?|ftp)://[^\s<>"]+|#[^\s<>"]*|/[^\s<>"]*)')
+regexImage = re.compile(r'!([^\s!()]+)(?:\(([^)]*)\))?!')
+regexPhrase = re.compile(
+    r'(?:(?<=^)|(?<=[\s“‘\[{]))'
+    r'(\*\*|__|\*|_|-|\+|\^|~|\?\?)(?=\S)(.+?)(?<=\S)\1'
+    r'(?=$|[\s.,;:!?”’)\]}])')
+regexEntity = re.compile(r'&(?!lt;|gt;)(#\d+|#x[0-9a-fA-F]+|\w+);')
+regexHtmlTag = re.compile(r'</?[a-zA-Z][^<>\n]*>')
+regexEscapingBackslash = re.compile(r'\\(?=[^\w' + TOKEN_START + r']|$)')
+regexNonCharacters = re.compile('[\ufdd0-\ufdef]')
+regexToken = re.compile(TOKEN_START + r'(\d+)' + TOKEN_END)
+regexParagraphStartEscape = re.compile(r'^(\d+)\.(?= )|^([+-])(?= |$)')
+
+PHRASES = {
+    '**': '**{}**', '*': '**{}**',
+    '__': '*{}*', '_': '*{}*',
+    '-': '<s>{}</s>', '+': '<u>{}</u>',
+    '^': '<sup>{}</sup>', '~': '<sub>{}</sub>',
+    '??': '{}',
+}
+
+GLYPHS = [
+    (re.compile(r'(^|[\s(\[{])"'), '\\1“'),
+    (re.compile(r'"'), '”'),
+    (re.compile(r"(\w)'"), '\\1’'),
+    (re.compile(r"(^|[\s(\[{])'"), '\\1‘'),
+    (re.compile(r"'"), '’'),
+    (re.compile(r'--'), '—'),
+    (re.compile(r'\.\.\.'), '…'),
+    (re.compile(r'\((c|C)\)'), '©'),
+    (re.compile(r'\((r|R)\)'), '®'),
+    (re.compile(r'\((tm|TM)\)'), '™'),
+]
+
+ENTITIES = {
+    'amp': '&', 'quot': '"', 'apos': "'", 'nbsp': ' ', 'copy': '©',
+    'reg': '®', 'trade': '™', 'hellip': '…', 'mdash': '—', 'ndash': '–',
+    'laquo': '«', 'raquo': '»', 'euro': '€', 'deg': '°',
+}
+
+
+def textile_to_markdown(text):
+    """ Converts a textile text to markdown, as pandoc would
+    """
+    return Document(text).render()
+
+
+class Document:
+    """ A textile text, being converted block by block
+    """
+    def __init__(self, text):
+        text = regexNonCharacters.sub('', text)
+        self.text = text.replace('\r\n', '\n').replace('\t', ' ')
+        self.tokens = []
+
+    def render(self):
+        blocks = []
+        position = 0
+        # <pre> may contain blank lines, look for them first
+        for pre in regexPre.finditer(self.text):
+            blocks.extend(self.render_blocks(self.text[position:pre.start()]))
+            blocks.append(indent(pre.group(1)))
+            position = pre.end()
+        blocks.extend(self.render_blocks(self.text[position:]))
+        blocks = [i for i in blocks if i]
+        if not blocks:
+            return '\n'
+        return '\n\n'.join(blocks) + '\n'
+
+    def render_blocks(self, text):
+        blocks = []
+        extended_code = None
+        # Marker of the top level list ending the previous block
+        list_marker = None
+        for block in regexBlankLines.split(text.strip('\n')):
+            if extended_code is not None:
+                # bc.. goes on until the next block signature
+                if not regexBlockStart.match(block):
+                    extended_code.append(block)
+                    continue
+                blocks.append(indent('\n\n'.join(extended_code)))
+                extended_code = None
+            code = regexBlockCode.match(block)
+            if code and code.group(1) == '..':
+                extended_code = [code.group(2)]
+            elif code:
+                blocks.append(indent(code.group(2)))
+            else:
+                # Keeps successive lists from being read as a single one
+                item = regexListItem.match(block)
+                if list_marker and item and item.group(1) == list_marker:
+                    blocks.append('<!-- -->')
+                blocks.extend(self.render_block(block))
+            list_marker = None
+            if not code:
+                for line in block.split('\n'):
+                    item = regexListItem.match(line)
+                    if item and len(item.group(1)) == 1:
+                        list_marker = item.group(1)
+        if extended_code is not None:
+            blocks.append(indent('\n\n'.join(extended_code)))
+        return blocks
+
+    def render_block(self, block):
+        """ :return: the markdown blocks a textile block is made of
+        """
+        lines = block.strip('\n').split('\n')
+        heading = regexHeading.match(block)
+        if heading:
+            return ['{} {}'.format(
+                '#' * int(heading.group(1)),
+                self.render_tokens(self.inline(' '.join(heading.group(2).split()))))]
+        quote = regexBlockQuote.match(block)
+        if quote:
+            return [prefix(self.paragraph(quote.group(1).split('\n'), COLUMNS - 2), '> ')]
+        paragraph = regexParagraph.match(block)
+        if paragraph:
+            return [self.paragraph(paragraph.group(1).split('\n'))]
+        if len(lines) == 1 and regexRule.match(lines[0].strip()):
+            return ['-' * COLUMNS]
+        if all(regexTableRow.match(i.strip()) for i in lines):
+            return [self.table(lines)]
+
+        # A list may follow a paragraph without a blank line
+        for i, line in enumerate(lines):
+            if regexListItem.match(line):
+                if i == 0:
+                    return [self.list(lines)]
+                return [self.paragraph(lines[:i]), self.list(lines[i:])]
+        return [self.paragraph(lines)]
+
+    def paragraph(self, lines, width=COLUMNS):
+        """ Lines wrapped at width, textile line breaks are kept
+        """
+        lines = [' '.join(i.split()) for i in lines]
+        lines = [self.inline(i) for i in lines if i]
+        if lines:
+            lines[0] = regexParagraphStartEscape.sub(escape_paragraph_start, lines[0])
+        lines = [i + HARD_BREAK for i in lines[:-1]] + lines[-1:]
+        return '\n'.join(self.wrap(i, width) for i in lines)
+
+    def list(self, lines):
+        """ Nested bullet and numbered lists
+        """
+        items = []
+        for line in lines:
+            item = regexListItem.match(line)
+            if item:
+                items.append((item.group(1), [item.group(2)]))
+            elif items:
+                items[-1][1].append(line)
+
+        output = []
+        # Per nesting level: indent of its items, and number of the last one
+        levels = []
+        for markers, text in items:
+            depth = len(markers)
+            del levels[depth:]
+            while len(levels) < depth:
+                parent = levels[-1] if levels else None
+                levels.append([parent[2] if parent else 0, 0, 0])
+            level = levels[-1]
+            level[1] += 1
+            if markers[-1] == '#':
+                marker = '{}.'.format(level[1]).ljust(4)
+            else:
+                marker = '- '
+            # items nested in this one are indented as its text
+            level[2] = level[0] + len(marker)
+            body = self.paragraph(text, COLUMNS - level[2])
+            output.append(' ' * level[0] + marker + body.replace('\n', '\n' + ' ' * level[2]))
+        return '\n'.join(output)
+
+    def table(self, lines):
+        """ Tables become HTML tables, as pandoc does with textile ones
+        """
+        rows = []
+        for line in lines:
+            cells = []
+            for cell in line.strip()[1:-1].split('|'):
+                attributes = regexTableCellAttributes.match(cell.strip())
+                header = bool(attributes and attributes.group(1))
+                if attributes:
+                    cell = cell.strip()[attributes.end():]
+                cells.append((header, self.render_tokens(self.inline(' '.join(cell.split())))))
+            rows.append(cells)
+
+        output = ['<table>']
+        if all(header for header, cell in rows[0]):
+            output.extend(['<thead>'] + table_row(rows.pop(0), 'th') + ['</thead>'])
+        if rows:
+            output.append('<tbody>')
+            for row in rows:
+                output.extend(table_row(row, 'td'))
+            output.append('</tbody>')
+        output.append('</table>')
+        return '\n'.join(output)
+
+    def wrap(self, line, width):
+        # Rendered first, for the wrapping to count the actual width
+        line = self.render_tokens(line, no_break=True)
+        line = textwrap.fill(line, max(width, 1), break_long_words=False,
+                             break_on_hyphens=False)
+        return line.replace(NO_BREAK_SPACE, ' ').replace(HARD_BREAK, '  ')
+
+    def token(self, markdown):
+        """ Keeps an already rendered piece of markdown out of the next
+        conversion steps
+        """
+        self.tokens.append(markdown)
+        return '{}{}{}'.format(TOKEN_START, len(self.tokens) - 1, TOKEN_END)
+
+    def render_token(self, index):
+        """ A token only holds tokens made before it, which ends the recursion
+        """
+        return regexToken.sub(
+            lambda m: self.render_token(int(m.group(1))), self.tokens[index])
+
+    def render_tokens(self, text, no_break=False):
+        text = regexToken.sub(lambda m: self.render_token(int(m.group(1))), text)
+        if no_break:
+            return text
+        return text.replace(NO_BREAK_SPACE, ' ')
+
+    def inline(self, text):
+        """ Converts a line of text, tokens are rendered when wrapping it
+        """
+        text = regexNoTextile.sub(
+            lambda m: self.token(escape(m.group(1) or m.group(2))), text)
+        text = regexCode.sub(
+            lambda m: self.token('`{}`'.format(no_break(m.group(1)))), text)
+        text = regexImage.sub(self.image, text)
+        text = regexLink.sub(self.link, text)
+        text = regexHtmlTag.sub(lambda m: self.token(no_break(m.group())), text)
+        for regex, glyph in GLYPHS:
+            text = regex.sub(glyph, text)
+        return escape(self.phrases(text))
+
+    def phrases(self, text):
+        def phrase(match):
+            return self.token(PHRASES[match.group(1)].format(
+                escape(self.phrases(match.group(2)))))
+        return regexPhrase.sub(phrase, text)
+
+    def image(self, match):
+        source, alt = match.group(1), match.group(2)
+        if alt:
+            return self.token(no_break('![{0}]({1} "{0}")'.format(alt, source)))
+        return self.token('![]({})'.format(source))
+
+    def link(self, match):
+        text, url = match.group(1), match.group(2)
+        # Punctuation ending a sentence is not part of the url
+        stripped = url.rstrip('.,;:!?')
+        if stripped.endswith(')') and stripped.count('(') < stripped.count(')'):
+            stripped = stripped[:-1]
+        return self.token('[{}]({})'.format(
+            escape(self.phrases(text)), stripped)) + url[len(stripped):]
+
+
+def escape(text):
+    """ Escapes what markdown would take for markup
+    """
+    # A backslash only escapes the punctuation following it
+    text = regexEscapingBackslash.sub(r'\\\\', text)
+    text = regexEntity.sub(entity, text)
+    for c in '*_[]#`':
+        text = text.replace(c, '\\' + c)
+    return text.replace('<', '&lt;').replace('>', '&gt;')
+
+
+def entity(match):
+    name = match.group(1)
+    try:
+        if name.startswith('#x'):
+            return chr(int(name[2:], 16))
+        if name.startswith('#'):
+            return chr(int(name[1:]))
+    except (ValueError, OverflowError):
+        # Not a character
+        return match.group()
+    return ENTITIES.get(name, match.group())
+
+
+def escape_paragraph_start(match):
+    if match.group(1):
+        return '{}\\.'.format(match.group(1))
+    return '\\' + match.group(2)
+
+
+def no_break(text):
+    return text.replace(' ', NO_BREAK_SPACE)
+
+
+def indent(text):
+    return '\n'.join('    ' + i if i.strip() else '' for i in text.split('\n'))
+
+
+def prefix(text, marker):
+    return '\n'.join(marker + i for i in text.split('\n'))
+
+
+def table_row(cells, tag):
+    return ['<tr>'] + ['<{0}>{1}</{0}>'.format(tag, cell) for header, cell in cells] + ['</tr>']
+
+
+@register_engine('python')
+class TextileEngine(ConversionEngine):
+    """ Converts in-process, no external program needed
+
+    Cheaper than a pandoc process per text, for any number of worker
+    processes. The markdown may differ from pandoc's for the textile that
+    is not covered.
+    """
+    # Bump when the conversion changes, to invalidate cached conversions
+    VERSION = 2
+
+    @property
+    def version(self):
+        return 'python-{}'.format(self.VERSION)
+
+    def convert(self, text):
+        return textile_to_markdown(text)
@@ -1,56 +1,88 @@
 from git import Repo, Actor
 
-import pypandoc
 import logging
+import hashlib
 import re
+import textwrap
 import unicodedata
+import uuid
+from collections import OrderedDict
 
-log = logging.getLogger(__name__)
-
-MIN_PANDOC_VERSION = (1, 17)
-
-
-def _pandoc_version_tuple():
-    """ '3.10.1' -> (3, 10, 1); tolerant of non-numeric suffixes. """
-    parts = []
-    for chunk in pypandoc.get_pandoc_version().split('.'):
-        digits = ''.join(c for c in chunk if c.isdigit())
-        parts.append(int(digits) if digits else 0)
-    return tuple(parts)
+from .pandoc import PandocProcess
 
+log = logging.getLogger(__name__)
 
-def check_pandoc_version():
-    """ Numeric version check (a string compare mishandles e.g. 1.2 vs 1.17). """
-    if _pandoc_version_tuple() < MIN_PANDOC_VERSION:
-        log.error('You need at least pandoc {}, download from '
-                  'http://pandoc.org/installing.html'.format(
-                      '.'.join(str(n) for n in MIN_PANDOC_VERSION)))
-        exit(1)
+# Besides letters and digits, the only characters of a text without markup
+PLAIN_TEXT_PUNCTUATION = frozenset(' \n,.;:?!')
 
 
 class TextileConverter():
-    def __init__(self):
-        check_pandoc_version()
+    # Bump when the pre/post-processing changes, to invalidate cached conversions
+    CONVERSION_VERSION = 3
+    MEMORY_CACHE_SIZE = 4096
+
+    def __init__(self, cache=None, memory_cache_size=MEMORY_CACHE_SIZE,
+                 engine=None):
+        """ :param cache: optional DiskCache, conversions are kept there
+            between runs
+        :param memory_cache_size: number of conversions kept in memory
+        :param engine: ConversionEngine converting textile to markdown, a
+            PandocProcess by default
+        """
+        self.engine = engine or PandocProcess()
+        self._prefetched = {}
+
+        # Conversions by hash of the text, most recently used last
+        self.cache = cache
+        self.cache_namespace = 'textile:{}:{}:{}'.format(
+            type(self).__name__, self.CONVERSION_VERSION, self.engine.version)
+        self._memory_cache = OrderedDict()
+        self.memory_cache_size = memory_cache_size
 
         # precompile regular expressions
-        self.regexWikiLinkWithText = re.compile(r'\\\[\\\[\s*([^\]]*?)\s*\|\s*([^\]]*?)\s*\\\]\\\]')
-        self.regexWikiLinkWithoutText = re.compile(r'\\\[\\\[\s*([^\]]*?)\s*\\\]\\\]')
-        self.regexTipMacro = re.compile(r'\{\{tip\((.*?)\)\}\}')
-        self.regexNoteMacro = re.compile(r'\{\{note\((.*?)\)\}\}')
-        self.regexWarningMacro = re.compile(r'\{\{warning\((.*?)\)\}\}')
-        self.regexImportantMacro = re.compile(r'\{\{important\((.*?)\)\}\}')
-        self.regexAnyMacro = re.compile(r'\{\{(.*)\}\}')
+        # Everything postprocess() rewrites in a single scan, see rewrite().
+        # Each alternative starts with a literal, out of any group, so that
+        # the scan skips quickly to the few characters that may start a match
+        noteMacro = r'\{\{(?:tip|note|warning|important)\(.*?\)\}\}'
+        rewrites = [
+            # [[ wikipage | link_text ]] and [[ link_url ]], escaped by pandoc
+            r'\\\[\\\[\s*(?P<link>[^\]]*?)\s*(?:\|\s*(?P<link_text>[^\]]*?)\s*)?\\\]\\\]',
+            # nested lists, fix at least the common issues (indent checked
+            # behind, for spaces not to be scan starts)
+            r'\\(?<=    \\)(?P<nested_list>#\\\*|\*\\#)',
+            # Redmine is using '>' for blockquote, which is not textile
+            r'&gt; (?P<blockquote>)',
+            # wiki note macros
+            r'\{\{(?P<note>tip|note|warning|important)\((?P<note_text>.*?)\)\}\}',
+            # all other macros, up to the last "}}" of the line (but not
+            # across nor into a note macro, whose replacement spans several
+            # lines)
+            r'\{(?!' + noteMacro + r')\{(?P<macro>(?:(?!' + noteMacro + r').)*)\}\}',
+        ]
+        self.regexPostprocess = re.compile('|'.join(rewrites))
+        # within a macro, whose content is kept as it is by the macro rule
+        self.regexPostprocessMacro = re.compile('|'.join(rewrites[:-1]))
         self.regexCodeBlock = re.compile(r'\A  ((.|\n)*)', re.MULTILINE)
         self.regexCollapse = re.compile(r'({{collapse\s?\(([^)]+)\))(.*)(}})', re.MULTILINE | re.DOTALL)
         self.regexParagraph = re.compile(r'p(\(+|(\)+)?>?|=)?\.', re.MULTILINE | re.DOTALL)
         self.regexCodeHighlight = re.compile(r'(<code\s?(class=\"(.*)\")?>).*(</code>)', re.MULTILINE | re.DOTALL)
         self.regexAttachment = re.compile(r'attachment:[\'\"“”‘’„”«»](.*)[\'\"“”‘’„”«»]', re.MULTILINE | re.DOTALL)
-
-    def wiki_link(self, match):
-        name = match.group(1)
-        if len(match.groups()) > 1:
-            text = match.group(2)
-        else:
+        # footnotes and link aliases are resolved across the whole document
+        self.regexDocumentScoped = re.compile(r'^(fn\d+[^ ]*\.|\[[^\]\s]+\]\S)', re.MULTILINE)
+        # plain text that textile or markdown would still read as markup:
+        # block signatures, list-like "1." "a." "iv.", images, "..." and "??"
+        self.regexNotPlainText = re.compile(r'^ *(h[1-6]|bq|fn\d+|bc|pre|notextile|p|table)\.|(^|\s)(\w|[ivxlcdmIVXLCDM]+)\.|![^\s]|\d\.|\.\.|\?\?', re.MULTILINE)
+        self.regexBlankLines = re.compile(r'\n(?: *\n)+')
+
+    def __getstate__(self):
+        # Conversion worker processes start with empty memory caches
+        state = dict(self.__dict__)
+        state['_prefetched'] = {}
+        state['_memory_cache'] = OrderedDict()
+        return state
+
+    def wiki_link(self, name, text=None):
+        if text is None:
             text = name
 
         name = self.normalize(name).replace(' ', '_')
@@ -65,6 +97,156 @@ class TextileConverter():
         return title
 
     def convert(self, text):
+        if text in self._prefetched:
+            return self._prefetched[text]
+        key = self.cache_key(text)
+        converted = self.cached(key)
+        if converted is None:
+            converted = self._convert(text)
+            self.store(key, converted)
+        return converted
+
+    def _convert(self, text):
+        text = self.preprocess(text)
+        if self.is_plain_text(text):
+            return self.postprocess(self.plain_text_to_markdown(text))
+
+        # convert from textile to markdown
+        try:
+            text = self.engine.convert(text)
+        except RuntimeError as e:
+            return False
+        return self.postprocess(text)
+
+    def is_plain_text(self, text):
+        """ Whether a pre-processed text has no markup at all
+
+        Only letters, digits, spaces, line breaks and a few punctuation marks
+        are allowed. Quotes, dashes, parens... are not: textile turns them
+        into typographic characters.
+        """
+        if self.regexNotPlainText.search(text):
+            return False
+        for c in text:
+            if c in PLAIN_TEXT_PUNCTUATION:
+                continue
+            # pandoc counts wide characters twice when wrapping lines
+            if not c.isalnum() or unicodedata.east_asian_width(c) in ('W', 'F'):
+                return False
+        return True
+
+    def plain_text_to_markdown(self, text):
+        """ Converts a plain text as pandoc does, without running it
+
+        Paragraphs are wrapped at 72 columns, textile line breaks become
+        markdown hard line breaks. As pandoc does, the two spaces of a hard
+        line break count in the width of the line, along with its last word.
+        """
+        paragraphs = []
+        for paragraph in self.regexBlankLines.split(text):
+            lines = [' '.join(i.split()) for i in paragraph.split('\n')]
+            lines = [i for i in lines if i]
+            # Plain texts have no NUL, it stands for the hard break spaces
+            lines = [i + '\0\0' for i in lines[:-1]] + lines[-1:]
+            lines = [textwrap.fill(i, 72, break_long_words=False, break_on_hyphens=False)
+                     for i in lines]
+            if lines:
+                paragraphs.append('\n'.join(lines).replace('\0\0', '  '))
+        return '\n\n'.join(paragraphs) + '\n'
+
+    @staticmethod
+    def cache_key(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def cached(self, key):
+        """ Returns the conversion cached in memory or on disk, None if missing
+        """
+        if key in self._memory_cache:
+            self._memory_cache.move_to_end(key)
+            return self._memory_cache[key]
+        if self.cache is not None:
+            converted = self.cache.get(self.cache_namespace, key)
+            if converted is not None:
+                self._remember(key, converted)
+            return converted
+        return None
+
+    def store(self, key, converted):
+        if converted is False:
+            # Not worth keeping, the text is converted as is
+            return
+        self._remember(key, converted)
+        if self.cache is not None:
+            self.cache.set(self.cache_namespace, key, converted)
+
+    def _remember(self, key, converted):
+        self._memory_cache[key] = converted
+        self._memory_cache.move_to_end(key)
+        if len(self._memory_cache) > self.memory_cache_size:
+            self._memory_cache.popitem(last=False)
+
+    def convert_many(self, texts):
+        """ Converts several texts with a single pandoc run
+
+        Texts are sent as one document, separated by sentinel paragraphs, and
+        split back out of pandoc's output. If the split does not give back as
+        many texts (eg: a text leaving a block open swallowed a sentinel), or
+        pandoc fails, texts are converted one by one instead. So are the texts
+        with footnotes or link aliases, which would leak into their neighbours,
+        and the plain texts, which do not need pandoc. Engines without batches
+        (ConversionEngine.batches) convert texts one by one.
+
+        :return: the list of converted texts, False for those failing to convert
+        """
+        texts = list(texts)
+        if not self.engine.batches:
+            return [self.convert(i) for i in texts]
+        batch = [i for i in texts
+                 if not self.regexDocumentScoped.search(i)
+                 and not self.is_plain_text(self.preprocess(i))]
+        if len(batch) < 2:
+            return [self.convert(i) for i in texts]
+        if len(batch) < len(texts):
+            converted = dict(zip(batch, self.convert_many(batch)))
+            return [converted[i] if i in converted else self.convert(i)
+                    for i in texts]
+
+        sentinel = 'rgmsplit{}'.format(uuid.uuid4().hex)
+        document = '\n\np. {}\n\n'.format(sentinel).join(
+            self.preprocess(i) for i in texts)
+        try:
+            output = self.engine.convert(document)
+        except RuntimeError:
+            output = ''
+        parts = re.split(r'^{}\n\n?'.format(sentinel), output, flags=re.MULTILINE)
+        if len(parts) != len(texts):
+            log.debug('Batch conversion of {} texts failed, converting them '
+                      'one by one'.format(len(texts)))
+            return [self.convert(i) for i in texts]
+
+        # pandoc ends every document with a single newline
+        return [self.postprocess(i.strip('\n') + '\n') for i in parts]
+
+    def prefetch(self, texts):
+        """ Batch-converts texts that are about to be convert()-ed
+
+        Texts already in the cache are not converted again. Only the texts of
+        the last prefetch() are kept.
+        """
+        self._prefetched = {}
+        missing = {}
+        for text in set(texts):
+            key = self.cache_key(text)
+            converted = self.cached(key)
+            if converted is None:
+                missing[text] = key
+            else:
+                self._prefetched[text] = converted
+        for text, converted in zip(missing, self.convert_many(missing)):
+            self.store(missing[text], converted)
+            self._prefetched[text] = converted
+
+    def preprocess(self, text):
         text = '\n\n'.join([re.sub(self.regexCodeBlock, r'<pre>\1</pre>', block) for block in text.split('\n\n')])
 
         collapseResults = re.findall(self.regexCollapse, text)
@@ -74,53 +256,65 @@ class TextileConverter():
                 text = text.replace(collapseResults[i][2], "<summary>{}</summary> \n\n{}".format(collapseResults[i][1], collapseResults[i][2]))
                 text = text.replace(collapseResults[i][3], "</details>")
         text = re.sub(self.regexParagraph, "", text)
+        return text
 
-        # convert from textile to markdown
-        try:
-            text = pypandoc.convert_text(text, 'markdown_strict', format='textile')
-
-            # pandoc does not convert everything, notably the [[link|text]] syntax
-            # is not handled. So let's fix that.
-
-            # [[ wikipage | link_text ]] -> [link_text](wikipage)
-            text = re.sub(self.regexWikiLinkWithText, self.wiki_link, text, re.MULTILINE | re.DOTALL)
-
-            # [[ link_url ]] -> [link_url](link_url)
-            text = re.sub(self.regexWikiLinkWithoutText, self.wiki_link, text, re.MULTILINE | re.DOTALL)
-
-            # nested lists, fix at least the common issues
-            text = text.replace("    \\#\\*", "    -")
-            text = text.replace("    \\*\\#", "    1.")
+    def postprocess(self, text):
+        """ Fixes what pandoc does not convert
+
+        Wiki links, nested lists, blockquotes and macros are rewritten in a
+        single scan of the text. Attachment references and code highlight,
+        which span from their first occurrence to their last one, are then
+        looked for once in the result.
+        """
+        text = self.postprocess_scan(text)
+
+        # attachments in notes
+        attachment = self.regexAttachment.search(text)
+        if attachment:
+            text = '{}\n\n*(Merged from Redmine, please check first note for attachment named **{}**)*{}'.format(
+                text[:attachment.start()], attachment.group(1), text[attachment.end():])
+
+        # code highlight: the match spans from the first opening tag to the
+        # last closing one, so there is at most one
+        code = self.regexCodeHighlight.search(text)
+        if code:
+            text = text.replace(code.group(1), "\n```{}".format((code.group(3) or '').lower()))
+            text = text.replace(code.group(4), "\n```")
+        return text
 
-            # Redmine is using '>' for blockquote, which is not textile
-            text = text.replace("&gt; ", ">")
+    def rewrite(self, match):
+        """ Replacement of a regexPostprocess match
+        """
+        kind = match.lastgroup
+        if kind == 'blockquote':
+            return '>'
+        elif kind == 'nested_list':
+            return '-' if match.group(kind).endswith('*') else '1.'
+        elif kind in ('link', 'link_text'):
+            return self.postprocess_scan(
+                self.wiki_link(match.group('link'), match.group('link_text')),
+                match.re)
+        elif kind == 'note_text':
+            return '---\n**{}**: {}\n---\n'.format(
+                match.group('note').upper(),
+                self.postprocess_scan(match.group('note_text'), match.re))
+        else:
+            # the macro rule is not applied again to the macros it keeps
+            return self.postprocess_scan(
+                match.group('macro'), self.regexPostprocessMacro)
 
-            # wiki note macros
-            text = re.sub(self.regexTipMacro, r'---\n**TIP**: \1\n---\n', text, re.MULTILINE | re.DOTALL)
-            text = re.sub(self.regexNoteMacro, r'---\n**NOTE**: \1\n---\n', text, re.MULTILINE | re.DOTALL)
-            text = re.sub(self.regexWarningMacro, r'---\n**WARNING**: \1\n---\n', text, re.MULTILINE | re.DOTALL)
-            text = re.sub(self.regexImportantMacro, r'---\n**IMPORTANT**: \1\n---\n', text, re.MULTILINE | re.DOTALL)
-
-            # all other macros
-            text = re.sub(self.regexAnyMacro, r'\1', text, re.MULTILINE | re.DOTALL)
-
-            # attachments in notes
-            text = re.sub(self.regexAttachment, r"\n\n*(Merged from Redmine, please check first note for attachment named **\1**)*", text, re.MULTILINE | re.DOTALL)
-
-            # code highlight
-            codeHighlights = re.findall(self.regexCodeHighlight, text)
-            if len(codeHighlights) > 0:
-                for i in range(0, len(codeHighlights)):
-                    text = text.replace(codeHighlights[i][0], "\n```{}".format(codeHighlights[i][2].lower()))
-                    text = text.replace(codeHighlights[i][3], "\n```")
-        except RuntimeError as e:
-            return False
-        return text
+    def postprocess_scan(self, text, regex=None):
+        if '\\' not in text and '{{' not in text and '&gt; ' not in text:
+            return text
+        return (regex or self.regexPostprocess).sub(self.rewrite, text)
 
 class NopConverter(TextileConverter):
     def convert(self, text):
         return text
 
+    def prefetch(self, texts):
+        pass
+
 class WikiPageConverter():
     """
     TODO:
@@ -143,8 +337,6 @@ class WikiPageConverter():
         self.repo_path = local_repo_path
         self.repo = Repo(local_repo_path)
 
-        check_pandoc_version()
-
         self.textile_converter = textile_converter
 
     def convert(self, redmine_page):